@@ -0,0 +1,341 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Script Name: bench_maintenance.py
+Description: Banco de pruebas reproducible para los scripts de mantenimiento. Genera árboles sintéticos
+             de descargas, bibliotecas y backups en un directorio temporal y mide cómo escalan
+             'find_matching_file' y 'clean_empty_directories' (downloadclean.py) y 'get_latest_backups'
+             (rotabackup.py).
+Version: 1.0
+License: MIT License
+Usage:
+    python3 benchmarks/bench_maintenance.py --library-files 2000 --downloads 200 --hardlink-ratio 0.5
+    python3 benchmarks/bench_maintenance.py --scenario match --scenario match-warm --json resultados.json
+    python3 benchmarks/bench_maintenance.py --strace   # cuenta syscalls reales con 'strace -c'
+Notes:
+    - Cada escenario se ejecuta en un proceso hijo para que el pico de RSS y los contadores de E/S
+      sean independientes. El árbol sintético se genera fuera de la fase medida.
+    - 'bytes_read' es el 'rchar' de /proc/self/io (bytes pedidos con read(), incluida la caché de páginas).
+    - Las llamadas se cuentan envolviendo las funciones del módulo 'os'; las llamadas a DirEntry.stat()
+      no son visibles de esta forma. Con '--strace' se engancha 'strace -c' al proceso hijo solo durante
+      la fase medida y se obtiene el recuento real de syscalls (requiere permisos de ptrace).
+    - Las semillas fijas hacen que el mismo comando genere siempre el mismo árbol.
+"""
+
+import os
+import re
+import sys
+import json
+import time
+import random
+import signal
+import shutil
+import logging
+import argparse
+import tempfile
+import resource
+import contextlib
+import subprocess
+import importlib.util
+import multiprocessing
+from datetime import datetime, timedelta
+
+INSTALL_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SCRIPTS_DIR = os.path.join(INSTALL_DIR, "scripts")
+
+SCENARIOS = ["match", "match-warm", "match-nofull", "clean_empty_directories", "get_latest_backups"]
+
+# Funciones de 'os' que se cuentan sin strace
+COUNTED_OS_FUNCTIONS = ["stat", "lstat", "scandir", "listdir", "open", "remove", "rmdir", "walk"]
+
+SIZE_DISTRIBUTIONS = {
+    # nombre: (mínimo, máximo) en bytes; los tamaños siguen una distribución log-uniforme
+    "small": (4 * 1024, 256 * 1024),
+    "mixed": (4 * 1024, 8 * 1024 * 1024),
+    "large": (1024 * 1024, 64 * 1024 * 1024),
+}
+
+logger = logging.getLogger("bench_maintenance")
+
+def load_script(name):
+    """Importa un script de 'scripts/' como módulo."""
+    spec = importlib.util.spec_from_file_location(name, os.path.join(SCRIPTS_DIR, f"{name}.py"))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+def random_size(rng, distribution):
+    low, high = SIZE_DISTRIBUTIONS[distribution]
+    return int(low * (high / low) ** rng.random())
+
+def write_random_file(path, size, rng):
+    """Escribe 'size' bytes pseudoaleatorios reproducibles."""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    block = rng.randbytes(min(size, 1024 * 1024))
+    with open(path, "wb") as f:
+        remaining = size
+        while remaining > 0:
+            # Se altera el inicio de cada bloque para que el contenido no se repita
+            chunk = rng.randbytes(16) + block[16:min(remaining, len(block))]
+            f.write(chunk[:remaining])
+            remaining -= len(chunk)
+
+def nested_dir(root, rng, depth):
+    """Devuelve un subdirectorio aleatorio de 'root' con la profundidad indicada."""
+    parts = [f"d{rng.randrange(8)}" for _ in range(depth)]
+    return os.path.join(root, *parts)
+
+def generate_media_tree(base, args):
+    """Genera una biblioteca y un directorio de descargas sintéticos.
+
+    Las descargas son hardlinks de la biblioteca ('--hardlink-ratio'), copias ('--copy-ratio')
+    o archivos únicos del mismo tamaño que alguno de la biblioteca (el peor caso para el hash).
+    """
+    rng = random.Random(args.seed)
+    library_dir = os.path.join(base, "library")
+    download_dir = os.path.join(base, "downloads")
+    library_files = []
+    for i in range(args.library_files):
+        path = os.path.join(nested_dir(library_dir, rng, args.depth), f"episode_{i:06d}.mkv")
+        size = random_size(rng, args.size_dist)
+        write_random_file(path, size, rng)
+        library_files.append((path, size))
+
+    stats = {"hardlinks": 0, "copies": 0, "unique": 0}
+    for i in range(args.downloads):
+        source, size = rng.choice(library_files)
+        target = os.path.join(nested_dir(download_dir, rng, args.depth), f"download_{i:06d}.mkv")
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        roll = rng.random()
+        if roll < args.hardlink_ratio:
+            os.link(source, target)
+            stats["hardlinks"] += 1
+        elif roll < args.hardlink_ratio + args.copy_ratio:
+            shutil.copyfile(source, target)
+            stats["copies"] += 1
+        else:
+            write_random_file(target, size, rng)
+            stats["unique"] += 1
+        with open(os.path.splitext(target)[0] + ".nfo", "w") as f:
+            f.write("nfo")
+    return library_dir, download_dir, stats
+
+def generate_empty_dirs(base, args):
+    """Genera un árbol de directorios vacíos con algunos archivos repartidos."""
+    rng = random.Random(args.seed)
+    root = os.path.join(base, "empty_dirs")
+    for i in range(args.library_files):
+        directory = os.path.join(nested_dir(root, rng, args.depth), f"dir_{i:06d}")
+        os.makedirs(directory, exist_ok=True)
+        if rng.random() < 0.1:
+            with open(os.path.join(directory, "keep.txt"), "w") as f:
+                f.write("keep")
+    return root
+
+def generate_backups(base, args):
+    """Genera backups con el patrón de nombres de las apps *arr y mtimes escalonados."""
+    rng = random.Random(args.seed)
+    root = os.path.join(base, "backups")
+    os.makedirs(root)
+    start = datetime(2024, 1, 1, 3, 0, 0)
+    for i in range(args.backups):
+        stamp = start + timedelta(hours=6 * i)
+        name = f"radarr_backup_v5.3.6.8612_{stamp:%Y.%m.%d_%H.%M.%S}.zip"
+        path = os.path.join(root, name)
+        with open(path, "wb") as f:
+            f.write(rng.randbytes(1024))
+        os.utime(path, (stamp.timestamp(), stamp.timestamp()))
+    return root
+
+def read_proc_io():
+    """Devuelve los contadores de /proc/self/io (vacío si no existen)."""
+    try:
+        with open("/proc/self/io") as f:
+            return {k: int(v) for k, v in (line.split(": ") for line in f.read().splitlines())}
+    except OSError:
+        return {}
+
+class OsCallCounter:
+    """Cuenta las llamadas a funciones del módulo 'os' mientras está activo."""
+
+    def __init__(self, names):
+        self.names = names
+        self.counts = {name: 0 for name in names}
+        self._originals = {}
+
+    def _wrap(self, name, func):
+        def wrapper(*a, **kw):
+            self.counts[name] += 1
+            return func(*a, **kw)
+        return wrapper
+
+    def __enter__(self):
+        for name in self.names:
+            self._originals[name] = getattr(os, name)
+            setattr(os, name, self._wrap(name, self._originals[name]))
+        return self
+
+    def __exit__(self, *exc):
+        for name, func in self._originals.items():
+            setattr(os, name, func)
+
+def run_scenario(scenario, base, args):
+    """Ejecuta un escenario en el proceso actual y devuelve la función medida."""
+    # Los scripts crean sus logs en el directorio actual al importarse
+    os.chdir(base)
+    logging.disable(logging.CRITICAL)
+
+    if scenario.startswith("match"):
+        downloadclean = load_script("downloadclean")
+        library_dir, download_dir, _ = generate_media_tree(base, args)
+        index_file = os.path.join(base, "hash_index.db")
+        verify_full_hash = scenario != "match-nofull"
+
+        def run_match():
+            index = downloadclean.open_hash_index(index_file)
+            size_map = downloadclean.build_size_map([library_dir])
+            cache = {}
+            matched = 0
+            for entry in downloadclean.walk_files(download_dir, extensions={".mkv"}):
+                if downloadclean.find_matching_file(entry.path, size_map, index, entry.stat(),
+                                                    verify_full_hash, cache):
+                    matched += 1
+            index.commit()
+            index.close()
+            return {"matched": matched}
+
+        if scenario == "match-warm":
+            # Primera pasada fuera de la medición para llenar el índice
+            run_match()
+        return run_match
+
+    if scenario == "clean_empty_directories":
+        downloadclean = load_script("downloadclean")
+        root = generate_empty_dirs(base, args)
+        return lambda: downloadclean.clean_empty_directories(root)
+
+    if scenario == "get_latest_backups":
+        rotabackup = load_script("rotabackup")
+        root = generate_backups(base, args)
+        catalog = rotabackup.BackupCatalog(os.path.join(base, "backup_catalog.db"))
+        return lambda: {"kept": len(rotabackup.get_latest_backups(root, args.keep, catalog))}
+
+    raise ValueError(f"Escenario desconocido: {scenario}")
+
+class StraceCounter:
+    """Engancha 'strace -c' al proceso actual solo durante la fase medida."""
+
+    def __init__(self):
+        self.counts = {}
+        self._output = tempfile.NamedTemporaryFile(prefix="confiraspa_strace_", suffix=".txt", delete=False)
+        self._process = None
+
+    def __enter__(self):
+        self._process = subprocess.Popen(
+            ["strace", "-f", "-c", "-o", self._output.name, "-p", str(os.getpid())],
+            stderr=subprocess.PIPE, text=True
+        )
+        # strace avisa por stderr cuando se ha enganchado al proceso
+        self._process.stderr.readline()
+        return self
+
+    def __exit__(self, *exc):
+        self._process.send_signal(signal.SIGINT)
+        self._process.wait()
+        with open(self._output.name) as f:
+            for line in f:
+                match = re.match(r"\s*[\d.]+\s+[\d.]+\s+\d+\s+(\d+)\s+(?:\d+\s+)?(\w+)$", line)
+                if match:
+                    self.counts[match.group(2)] = int(match.group(1))
+        os.unlink(self._output.name)
+
+def child_main(scenario, args, result_queue):
+    """Punto de entrada del proceso hijo: prepara el árbol, mide y devuelve el resultado."""
+    with tempfile.TemporaryDirectory(prefix="confiraspa_bench_") as base:
+        func = run_scenario(scenario, base, args)
+        strace = StraceCounter() if args.strace else contextlib.nullcontext()
+        io_before = read_proc_io()
+        with strace, OsCallCounter(COUNTED_OS_FUNCTIONS) as counter:
+            started = time.perf_counter()
+            extra = func() or {}
+            wall_time = time.perf_counter() - started
+        io_after = read_proc_io()
+        result = {
+            "scenario": scenario,
+            "wall_time_s": round(wall_time, 4),
+            "bytes_read": io_after.get("rchar", 0) - io_before.get("rchar", 0),
+            "read_syscalls": io_after.get("syscr", 0) - io_before.get("syscr", 0),
+            "os_calls": counter.counts,
+            "peak_rss_kb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+        }
+        if args.strace:
+            result["syscalls"] = strace.counts
+        result.update(extra)
+        result_queue.put(result)
+
+def run_in_child(scenario, args):
+    """Ejecuta un escenario en un proceso hijo aislado."""
+    ctx = multiprocessing.get_context("fork")
+    result_queue = ctx.Queue()
+    process = ctx.Process(target=child_main, args=(scenario, args, result_queue))
+    process.start()
+    result = result_queue.get()
+    process.join()
+    return result
+
+def print_table(results):
+    """Muestra un resumen legible de los resultados."""
+    header = f"{'Escenario':<26}{'Tiempo (s)':>12}{'Bytes leídos':>16}{'read()':>10}{'stat':>10}{'scandir':>10}{'RSS (KiB)':>12}"
+    print(header)
+    print("-" * len(header))
+    for r in results:
+        calls = r["os_calls"]
+        stats = calls.get("stat", 0) + calls.get("lstat", 0)
+        print(f"{r['scenario']:<26}{r['wall_time_s']:>12.3f}{r['bytes_read']:>16}{r['read_syscalls']:>10}"
+              f"{stats:>10}{calls.get('scandir', 0):>10}{r['peak_rss_kb']:>12}")
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Banco de pruebas de los scripts de mantenimiento de Confiraspa.")
+    parser.add_argument("--scenario", action="append", choices=SCENARIOS,
+                        help="Escenario a ejecutar (se puede repetir; por defecto, todos).")
+    parser.add_argument("--library-files", type=int, default=500, help="Archivos en la biblioteca sintética.")
+    parser.add_argument("--downloads", type=int, default=100, help="Archivos en el directorio de descargas.")
+    parser.add_argument("--size-dist", choices=sorted(SIZE_DISTRIBUTIONS), default="small",
+                        help="Distribución de tamaños de los archivos.")
+    parser.add_argument("--hardlink-ratio", type=float, default=0.5,
+                        help="Fracción de descargas que son hardlinks de la biblioteca.")
+    parser.add_argument("--copy-ratio", type=float, default=0.25,
+                        help="Fracción de descargas que son copias de la biblioteca.")
+    parser.add_argument("--depth", type=int, default=2, help="Profundidad de directorios de los árboles.")
+    parser.add_argument("--backups", type=int, default=1000, help="Número de backups sintéticos.")
+    parser.add_argument("--keep", type=int, default=5, help="Copias a conservar en 'get_latest_backups'.")
+    parser.add_argument("--repeat", type=int, default=1, help="Repeticiones de cada escenario.")
+    parser.add_argument("--seed", type=int, default=42, help="Semilla para generar los árboles.")
+    parser.add_argument("--json", help="Guarda los resultados en este archivo JSON.")
+    parser.add_argument("--strace", action="store_true",
+                        help="Cuenta syscalls reales con 'strace -c' durante la fase medida.")
+    return parser.parse_args(argv)
+
+def main():
+    args = parse_args()
+    scenarios = args.scenario or SCENARIOS
+
+    if args.strace and not shutil.which("strace"):
+        print("ERROR: 'strace' no está instalado.", file=sys.stderr)
+        sys.exit(1)
+
+    results = []
+    for scenario in scenarios:
+        for repetition in range(args.repeat):
+            result = run_in_child(scenario, args)
+            result["repetition"] = repetition + 1
+            results.append(result)
+
+    print_table(results)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"parameters": vars(args), "results": results}, f, indent=2)
+        print(f"Resultados guardados en '{args.json}'.")
+
+if __name__ == "__main__":
+    main()
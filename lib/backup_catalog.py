@@ -0,0 +1,210 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Module Name: backup_catalog.py
+Description: Catálogo persistente (SQLite) de los backups de cada directorio, compartido por
+             restaurarr.py y rotabackup.py.
+Version: 1.0
+License: MIT License
+Usage:
+    from backup_catalog import BackupCatalog
+    catalog = BackupCatalog()
+    catalog.refresh("/media/Backup/radarr/scheduled")
+    latest = catalog.latest("/media/Backup/radarr/scheduled", ext=".zip")
+    keep = catalog.newest("/media/Backup/radarr/scheduled", 5)
+Notes:
+    - Para cada backup se guarda nombre, fecha (extraída del nombre con el patrón de las apps *arr,
+      p. ej. 'radarr_backup_v5.3.6.8612_2024.05.26_03.15.22.zip'), tamaño y SHA256.
+    - La fecha del nombre tiene prioridad sobre el mtime, que es incorrecto tras un rsync que no
+      conserva tiempos. Si el nombre no tiene fecha se usa el mtime.
+    - 'refresh' hace una sola pasada con os.scandir y un stat() por entrada. Las conocidas cuyo
+      tamaño y mtime coinciden con el catálogo se reutilizan sin recalcular su SHA256 ni, si son
+      directorios, su tamaño total (en ellos solo se compara el mtime); un backup sobrescrito con
+      el mismo nombre se vuelve a registrar. Con verify=True se reexaminan todas.
+    - Los backups que son directorios se registran con el tamaño total de su contenido.
+"""
+
+import os
+import re
+import hashlib
+import sqlite3
+import threading
+from datetime import datetime
+
+from fswalk import tree_size
+
+INSTALL_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+CATALOG_FILE = os.path.join(INSTALL_DIR, "data", "backup_catalog.db")
+
+# Patrones de fecha en el nombre, del más específico al más genérico
+TIMESTAMP_PATTERNS = [
+    re.compile(r"(\d{4})\.(\d{2})\.(\d{2})_(\d{2})\.(\d{2})\.(\d{2})"),  # *arr
+    re.compile(r"(\d{4})-(\d{2})-(\d{2})_(\d{2})-(\d{2})-(\d{2})"),      # scripts confiraspa
+    re.compile(r"(\d{4})(\d{2})(\d{2})_(\d{2})(\d{2})(\d{2})"),           # create_backup (utils.sh)
+]
+
+CHECKSUM_CHUNK_SIZE = 1024 * 1024
+
+def parse_backup_timestamp(name):
+    """Extrae la fecha de un nombre de backup y la devuelve como epoch, o None si no tiene."""
+    for pattern in TIMESTAMP_PATTERNS:
+        match = pattern.search(name)
+        if match:
+            try:
+                return datetime(*(int(g) for g in match.groups())).timestamp()
+            except ValueError:
+                continue
+    return None
+
+def file_checksum(path):
+    """Calcula el SHA256 de un archivo leyéndolo por bloques."""
+    hasher = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(CHECKSUM_CHUNK_SIZE), b""):
+            hasher.update(chunk)
+    return hasher.hexdigest()
+
+class BackupEntry:
+    """Backup registrado en el catálogo."""
+
+    __slots__ = ("directory", "name", "is_dir", "size", "mtime_ns", "timestamp", "checksum")
+
+    def __init__(self, directory, name, is_dir, size, mtime_ns, timestamp, checksum):
+        self.directory = directory
+        self.name = name
+        self.is_dir = bool(is_dir)
+        self.size = size
+        self.mtime_ns = mtime_ns
+        self.timestamp = timestamp
+        self.checksum = checksum
+
+    @property
+    def path(self):
+        return os.path.join(self.directory, self.name)
+
+    def __repr__(self):
+        return f"BackupEntry({self.path!r}, timestamp={self.timestamp}, size={self.size})"
+
+class BackupCatalog:
+    """Catálogo de backups por directorio con consultas 'último' y 'N más recientes' indexadas."""
+
+    _COLUMNS = "dir, name, is_dir, size, mtime_ns, timestamp, checksum"
+
+    def __init__(self, db_path=CATALOG_FILE):
+        os.makedirs(os.path.dirname(db_path), exist_ok=True)
+        self.db_path = db_path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        self._conn.execute(
+            """CREATE TABLE IF NOT EXISTS backups (
+                   dir TEXT NOT NULL,
+                   name TEXT NOT NULL,
+                   is_dir INTEGER NOT NULL,
+                   size INTEGER NOT NULL,
+                   mtime_ns INTEGER NOT NULL,
+                   timestamp REAL NOT NULL,
+                   checksum TEXT,
+                   PRIMARY KEY (dir, name)
+               )"""
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_backups_time ON backups (dir, timestamp DESC)")
+        self._conn.commit()
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+    def refresh(self, directory, checksum=False, verify=False):
+        """Sincroniza el catálogo con el contenido de 'directory' en una sola pasada de os.scandir.
+
+        Las entradas ya conocidas con el mismo tamaño y mtime (solo mtime si son directorios) no se
+        vuelven a registrar salvo con 'verify=True' (o si falta su checksum y se pide 'checksum=True').
+        Devuelve el número de entradas nuevas o actualizadas.
+        """
+        directory = os.path.abspath(directory)
+        with self._lock:
+            known = {
+                row[0]: row[1:]
+                for row in self._conn.execute(
+                    "SELECT name, is_dir, size, mtime_ns, checksum FROM backups WHERE dir = ?", (directory,))
+            }
+
+        seen = set()
+        updates = []
+        with os.scandir(directory) as it:
+            for entry in it:
+                try:
+                    is_dir = entry.is_dir()
+                    if not is_dir and not entry.is_file():
+                        continue
+                except OSError:
+                    continue
+                seen.add(entry.name)
+                previous = known.get(entry.name)
+                try:
+                    st = entry.stat()
+                except OSError:
+                    continue
+                unchanged = (
+                    previous is not None
+                    and previous[0] == is_dir
+                    and previous[2] == st.st_mtime_ns
+                    and (is_dir or previous[1] == st.st_size)
+                )
+                missing_checksum = checksum and not is_dir and unchanged and previous[3] is None
+                if unchanged and not verify and not missing_checksum:
+                    continue
+
+                digest = previous[3] if unchanged else None
+                if checksum and not is_dir and digest is None:
+                    try:
+                        digest = file_checksum(entry.path)
+                    except OSError:
+                        digest = None
+                timestamp = parse_backup_timestamp(entry.name)
+                if timestamp is None:
+                    timestamp = st.st_mtime
+                size = tree_size(entry.path) if is_dir else st.st_size
+                updates.append((directory, entry.name, int(is_dir), size, st.st_mtime_ns, timestamp, digest))
+
+        removed = [(directory, name) for name in known if name not in seen]
+        with self._lock:
+            self._conn.executemany(
+                f"INSERT OR REPLACE INTO backups ({self._COLUMNS}) VALUES (?, ?, ?, ?, ?, ?, ?)", updates)
+            self._conn.executemany("DELETE FROM backups WHERE dir = ? AND name = ?", removed)
+            self._conn.commit()
+        return len(updates)
+
+    def _query(self, directory, ext=None, include_dirs=True, limit=None):
+        sql = f"SELECT {self._COLUMNS} FROM backups WHERE dir = ?"
+        params = [os.path.abspath(directory)]
+        if ext:
+            sql += " AND substr(name, -?) = ? AND is_dir = 0"
+            params.extend([len(ext), ext])
+        elif not include_dirs:
+            sql += " AND is_dir = 0"
+        sql += " ORDER BY timestamp DESC, name DESC"
+        if limit is not None:
+            sql += " LIMIT ?"
+            params.append(limit)
+        with self._lock:
+            return [BackupEntry(*row) for row in self._conn.execute(sql, params)]
+
+    def latest(self, directory, ext=None, include_dirs=True):
+        """Devuelve el backup más reciente (o None). Con 'ext' solo se consideran archivos."""
+        entries = self._query(directory, ext, include_dirs, limit=1)
+        return entries[0] if entries else None
+
+    def newest(self, directory, count, ext=None, include_dirs=True):
+        """Devuelve los 'count' backups más recientes, del más nuevo al más antiguo."""
+        return self._query(directory, ext, include_dirs, limit=max(0, count))
+
+    def entries(self, directory, ext=None, include_dirs=True):
+        """Devuelve todos los backups del directorio, del más nuevo al más antiguo."""
+        return self._query(directory, ext, include_dirs)
+
+    def forget(self, directory, name):
+        """Elimina un backup del catálogo (por ejemplo, tras borrarlo)."""
+        with self._lock:
+            self._conn.execute("DELETE FROM backups WHERE dir = ? AND name = ?", (os.path.abspath(directory), name))
+            self._conn.commit()
@@ -0,0 +1,53 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Module Name: fsutil.py
+Description: Utilidades de tamaños y discos compartidas por los scripts de mantenimiento.
+Version: 1.0
+License: MIT License
+Usage:
+    from fsutil import parse_size, format_size, device_of
+    parse_size("200M")          # 209715200
+    format_size(209715200)      # '200.0 MiB'
+    device_of("/media/WDElements/Peliculas/nueva")   # st_dev del disco, aunque la ruta no exista aún
+Notes:
+    - Los tamaños de la configuración admiten un entero en bytes o un número con sufijo K, M, G o T
+      (potencias de 1024, con o sin 'B' final: '20G', '20GB', '1.5G').
+    - device_of sube hasta el primer directorio existente, así que sirve para destinos que la copia
+      todavía no ha creado. Dos rutas del mismo disco dan el mismo valor.
+"""
+
+import os
+
+SIZE_UNITS = {"K": 1024, "M": 1024**2, "G": 1024**3, "T": 1024**4}
+
+def parse_size(value):
+    """Convierte '200M', '512K', '20GB' o un número en bytes. None si no se indica."""
+    if value is None:
+        return None
+    if isinstance(value, (int, float)):
+        return int(value)
+    text = str(value).strip().upper().rstrip("B")
+    if text[-1:] in SIZE_UNITS:
+        return int(float(text[:-1]) * SIZE_UNITS[text[-1]])
+    return int(text)
+
+def format_size(num_bytes):
+    """Formatea un número de bytes para los logs y los informes."""
+    for unit in ("B", "KiB", "MiB", "GiB"):
+        if num_bytes < 1024:
+            return f"{num_bytes:.1f} {unit}"
+        num_bytes /= 1024
+    return f"{num_bytes:.1f} TiB"
+
+def device_of(path):
+    """Devuelve st_dev de una ruta (o del primer directorio existente por encima), o None."""
+    path = os.path.abspath(path)
+    while True:
+        try:
+            return os.stat(path).st_dev
+        except OSError:
+            parent = os.path.dirname(path)
+            if parent == path:
+                return None
+            path = parent
@@ -0,0 +1,215 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Module Name: fswalk.py
+Description: Recorrido de directorios con os.scandir compartido por los scripts de mantenimiento.
+Version: 1.0
+License: MIT License
+Usage:
+    from fswalk import walk_files, walk, tree_size
+    for entry in walk_files(["/media/WDElements/Peliculas"], extensions={".mkv", ".mp4"}, workers=2):
+        st = entry.stat()
+    for dirpath, dirs, files in walk("/media/DiscoDuro/torrents", topdown=False):
+        ...
+Notes:
+    - Se devuelven objetos os.DirEntry: el tipo (archivo, directorio, enlace) viene de la propia lectura
+      del directorio, así que distinguir archivos de directorios no cuesta ninguna llamada a stat().
+      Solo DirEntry.stat() hace una, y el resultado queda guardado en la entrada. Frente a os.walk más
+      os.path.isfile/getsize/getmtime se pasa de tres o cuatro stat() por archivo a uno como mucho.
+    - El filtro de extensiones se aplica al nombre antes de cualquier stat(): los archivos descartados
+      no cuestan nada más que su entrada en el directorio.
+    - 'prune' recibe el DirEntry de cada subdirectorio y devuelve True para no entrar en él.
+    - 'same_device' no cruza puntos de montaje (un stat() por directorio, no por archivo).
+    - Con 'workers' > 1, walk_files reparte los subdirectorios de primer nivel de cada raíz entre hilos.
+      Conviene con raíces en discos distintos o con directorios muy grandes en discos con cola de
+      comandos (NCQ); en una tarjeta SD o un disco USB lento basta con 1.
+    - Los errores de lectura (permisos, directorios que desaparecen) se pasan a 'on_error' si se indica
+      y se omite esa entrada; el recorrido continúa.
+"""
+
+import os
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+def _normalize_extensions(extensions):
+    if extensions is None:
+        return None
+    return {e.lower() if e.startswith(".") else f".{e.lower()}" for e in extensions}
+
+def _scandir(path, on_error):
+    """Lee un directorio entero. Devuelve la lista de DirEntry (vacía si hay error)."""
+    try:
+        with os.scandir(path) as it:
+            return list(it)
+    except OSError as e:
+        if on_error is not None:
+            on_error(e)
+        return []
+
+def _descend(entry, prune, root_dev, on_error):
+    """Indica si hay que entrar en el subdirectorio 'entry'."""
+    if prune is not None and prune(entry):
+        return False
+    if root_dev is not None:
+        try:
+            return entry.stat(follow_symlinks=False).st_dev == root_dev
+        except OSError as e:
+            if on_error is not None:
+                on_error(e)
+            return False
+    return True
+
+def _root_device(root, same_device, on_error):
+    if not same_device:
+        return None
+    try:
+        return os.stat(root).st_dev
+    except OSError as e:
+        if on_error is not None:
+            on_error(e)
+        return None
+
+def _split(entries, on_error):
+    """Separa las entradas de un directorio en (subdirectorios, resto) sin seguir enlaces simbólicos."""
+    dirs, others = [], []
+    for entry in entries:
+        try:
+            (dirs if entry.is_dir(follow_symlinks=False) else others).append(entry)
+        except OSError as e:
+            if on_error is not None:
+                on_error(e)
+    return dirs, others
+
+def _wanted_file(entry, extensions, on_error):
+    """Archivo regular (o enlace a uno) con una de las extensiones pedidas."""
+    if extensions is not None and os.path.splitext(entry.name)[1].lower() not in extensions:
+        return False
+    try:
+        return entry.is_file()
+    except OSError as e:
+        if on_error is not None:
+            on_error(e)
+        return False
+
+def iter_files(root, extensions=None, prune=None, same_device=False, on_error=None, _root_dev=None):
+    """Devuelve (DirEntry) para cada archivo regular bajo 'root', en profundidad."""
+    extensions = _normalize_extensions(extensions)
+    root_dev = _root_dev if _root_dev is not None else _root_device(root, same_device, on_error)
+    pending = [root]
+    while pending:
+        dirs, others = _split(_scandir(pending.pop(), on_error), on_error)
+        for entry in others:
+            if _wanted_file(entry, extensions, on_error):
+                yield entry
+        pending.extend(d.path for d in dirs if _descend(d, prune, root_dev, on_error))
+
+_DONE = object()
+
+def walk_files(roots, extensions=None, prune=None, same_device=False, workers=1, on_error=None):
+    """Devuelve (DirEntry) para cada archivo regular bajo las raíces 'roots'.
+
+    Con 'workers' > 1 cada subdirectorio de primer nivel se recorre en un hilo; el orden de salida
+    no está definido. Si se deja de consumir el generador, los hilos terminan en cuanto lo notan.
+    """
+    if isinstance(roots, (str, os.PathLike)):
+        roots = [roots]
+    if workers <= 1:
+        for root in roots:
+            yield from iter_files(root, extensions, prune, same_device, on_error)
+        return
+
+    extensions = _normalize_extensions(extensions)
+    # Primer nivel en el hilo actual: los archivos sueltos salen ya y los subdirectorios se reparten
+    tasks = []
+    for root in roots:
+        root_dev = _root_device(root, same_device, on_error)
+        dirs, others = _split(_scandir(root, on_error), on_error)
+        for entry in others:
+            if _wanted_file(entry, extensions, on_error):
+                yield entry
+        tasks.extend((d.path, root_dev) for d in dirs if _descend(d, prune, root_dev, on_error))
+    if not tasks:
+        return
+
+    results = queue.Queue(maxsize=4096)
+    stop = threading.Event()
+
+    def put(item):
+        while not stop.is_set():
+            try:
+                results.put(item, timeout=0.5)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def worker(path, root_dev):
+        try:
+            for entry in iter_files(path, extensions, prune, same_device, on_error, _root_dev=root_dev):
+                if not put(entry):
+                    return
+        except BaseException as e:
+            put(e)
+        finally:
+            put(_DONE)
+
+    executor = ThreadPoolExecutor(max_workers=min(workers, len(tasks)), thread_name_prefix="fswalk")
+    try:
+        for path, root_dev in tasks:
+            executor.submit(worker, path, root_dev)
+        remaining = len(tasks)
+        while remaining:
+            item = results.get()
+            if item is _DONE:
+                remaining -= 1
+            elif isinstance(item, BaseException):
+                raise item
+            else:
+                yield item
+    finally:
+        stop.set()
+        executor.shutdown(wait=True, cancel_futures=True)
+
+def walk(root, topdown=True, prune=None, same_device=False, on_error=None):
+    """Como os.walk, pero devuelve (ruta, [DirEntry de subdirectorios], [DirEntry del resto]).
+
+    Con topdown=True se puede modificar la lista de subdirectorios para no entrar en algunos.
+    """
+    root_dev = _root_device(root, same_device, on_error)
+    if topdown:
+        pending = [root]
+        while pending:
+            path = pending.pop()
+            dirs, others = _split(_scandir(path, on_error), on_error)
+            dirs = [d for d in dirs if _descend(d, prune, root_dev, on_error)]
+            yield path, dirs, others
+            pending.extend(d.path for d in reversed(dirs))
+        return
+
+    # Orden posterior sin recursión: cada directorio sale después de todos sus descendientes
+    stack = [(root, None)]
+    while stack:
+        path, listing = stack.pop()
+        if listing is None:
+            dirs, others = _split(_scandir(path, on_error), on_error)
+            dirs = [d for d in dirs if _descend(d, prune, root_dev, on_error)]
+            stack.append((path, (dirs, others)))
+            stack.extend((d.path, None) for d in dirs)
+        else:
+            yield path, listing[0], listing[1]
+
+def tree_size(path, same_device=False):
+    """Suma el tamaño de todos los archivos bajo 'path' (sin seguir enlaces simbólicos)."""
+    total = 0
+    root_dev = _root_device(path, same_device, None)
+    pending = [path]
+    while pending:
+        dirs, others = _split(_scandir(pending.pop(), None), None)
+        for entry in others:
+            try:
+                total += entry.stat(follow_symlinks=False).st_size
+            except OSError:
+                continue
+        pending.extend(d.path for d in dirs if _descend(d, None, root_dev, None))
+    return total
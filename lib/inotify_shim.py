@@ -0,0 +1,117 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Module Name: inotify_shim.py
+Description: Envoltorio mínimo de la API inotify de Linux usando solo ctypes (sin dependencias externas).
+Version: 1.0
+License: MIT License
+Usage:
+    from inotify_shim import Inotify, IN_CLOSE_WRITE
+    with Inotify() as ino:
+        ino.add_watch("/ruta", IN_CLOSE_WRITE)
+        for wd, mask, cookie, name in ino.read_events(timeout=1.0):
+            ...
+"""
+
+import os
+import ctypes
+import ctypes.util
+import select
+import struct
+
+# Máscaras de eventos (linux/inotify.h)
+IN_ACCESS = 0x00000001
+IN_MODIFY = 0x00000002
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_CLOSE_NOWRITE = 0x00000010
+IN_OPEN = 0x00000020
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+
+IN_UNMOUNT = 0x00002000
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+
+IN_ONLYDIR = 0x01000000
+IN_DONT_FOLLOW = 0x02000000
+IN_EXCL_UNLINK = 0x04000000
+IN_ISDIR = 0x40000000
+
+IN_CLOEXEC = 0o2000000
+IN_NONBLOCK = 0o4000
+
+_EVENT_HEADER = struct.Struct("iIII")
+
+_libc = None
+
+def _get_libc():
+    """Carga libc una sola vez y declara las firmas de las funciones inotify."""
+    global _libc
+    if _libc is None:
+        libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+        libc.inotify_init1.argtypes = [ctypes.c_int]
+        libc.inotify_init1.restype = ctypes.c_int
+        libc.inotify_add_watch.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+        libc.inotify_add_watch.restype = ctypes.c_int
+        libc.inotify_rm_watch.argtypes = [ctypes.c_int, ctypes.c_int]
+        libc.inotify_rm_watch.restype = ctypes.c_int
+        _libc = libc
+    return _libc
+
+def _check(result, what):
+    """Convierte un retorno -1 de libc en OSError con el errno correspondiente."""
+    if result == -1:
+        errno = ctypes.get_errno()
+        raise OSError(errno, f"{what}: {os.strerror(errno)}")
+    return result
+
+class Inotify:
+    """Descriptor inotify con lectura de eventos no bloqueante."""
+
+    def __init__(self):
+        self._libc = _get_libc()
+        self.fd = _check(self._libc.inotify_init1(IN_CLOEXEC | IN_NONBLOCK), "inotify_init1")
+
+    def add_watch(self, path, mask):
+        """Añade (o actualiza) una vigilancia sobre 'path' y devuelve su descriptor."""
+        return _check(self._libc.inotify_add_watch(self.fd, os.fsencode(path), mask), f"inotify_add_watch '{path}'")
+
+    def rm_watch(self, wd):
+        """Elimina una vigilancia; ignora errores si ya no existía."""
+        self._libc.inotify_rm_watch(self.fd, wd)
+
+    def read_events(self, timeout=None):
+        """Espera hasta 'timeout' segundos y devuelve una lista de (wd, mask, cookie, name)."""
+        readable, _, _ = select.select([self.fd], [], [], timeout)
+        if not readable:
+            return []
+        try:
+            data = os.read(self.fd, 64 * 1024)
+        except BlockingIOError:
+            return []
+
+        events = []
+        offset = 0
+        while offset + _EVENT_HEADER.size <= len(data):
+            wd, mask, cookie, length = _EVENT_HEADER.unpack_from(data, offset)
+            offset += _EVENT_HEADER.size
+            name = os.fsdecode(data[offset:offset + length].rstrip(b"\0"))
+            offset += length
+            events.append((wd, mask, cookie, name))
+        return events
+
+    def close(self):
+        if self.fd >= 0:
+            os.close(self.fd)
+            self.fd = -1
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
@@ -0,0 +1,237 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Module Name: metrics.py
+Description: Métricas de ejecución de los scripts de mantenimiento: contadores, tiempos por fase y
+             un registro JSON por ejecución, con exportación para el textfile collector de node_exporter.
+Version: 1.0
+License: MIT License
+Usage:
+    from metrics import RunMetrics
+    metrics = RunMetrics("downloadclean")
+    with metrics:                       # start() al entrar y finish() al salir; el estado es 'error'
+        with metrics.span("scan"):      # si hay una excepción o si se asigna metrics.status = "error"
+            ...
+        metrics.incr("bytes_hashed", 4096)
+
+    Desde scripts de shell:
+        python3 /opt/confiraspa/lib/metrics.py start backup_rsync
+        python3 /opt/confiraspa/lib/metrics.py finish backup_rsync --status ok --counter jobs_ok=7 --span rsync=812.4
+Notes:
+    - Cada ejecución añade una línea JSON a 'logs/metrics.jsonl' con inicio, duración, estado,
+      contadores, valores y fases.
+    - Si existe el directorio del textfile collector ('/var/lib/prometheus/node-exporter' o el de la
+      variable CONFIRASPA_TEXTFILE_DIR) se reescribe de forma atómica 'confiraspa_<job>.prom'. Al empezar
+      se publica 'confiraspa_job_running 1' con la hora de inicio, para poder alertar de ejecuciones que
+      se salen de su hueco de cron.
+    - Los contadores y las fases son seguros entre hilos. Antes de start() se pueden usar igualmente
+      (por ejemplo, al importar el script desde los benchmarks) y no se escribe nada.
+"""
+
+import os
+import sys
+import json
+import time
+import socket
+import argparse
+import threading
+from contextlib import contextmanager
+from datetime import datetime
+
+INSTALL_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+LOG_DIR = os.path.join(INSTALL_DIR, "logs")
+DATA_DIR = os.path.join(INSTALL_DIR, "data")
+METRICS_FILE = os.path.join(LOG_DIR, "metrics.jsonl")
+DEFAULT_TEXTFILE_DIR = "/var/lib/prometheus/node-exporter"
+
+def textfile_dir():
+    """Directorio del textfile collector, o None si no está disponible."""
+    path = os.environ.get("CONFIRASPA_TEXTFILE_DIR", DEFAULT_TEXTFILE_DIR)
+    return path if os.path.isdir(path) and os.access(path, os.W_OK) else None
+
+def _label(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", " ")
+
+class RunMetrics:
+    """Métricas de una ejecución de un script."""
+
+    def __init__(self, job, metrics_file=METRICS_FILE, prom_dir=None):
+        self.job = job
+        self.metrics_file = metrics_file
+        self.prom_dir = prom_dir
+        self._lock = threading.Lock()
+        self.counters = {}
+        self.gauges = {}
+        self.spans = {}
+        self.started = None
+        self._start_monotonic = None
+        # Estado con el que termina la ejecución al salir del 'with' sin excepción
+        self.status = "ok"
+
+    def incr(self, name, value=1):
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def set(self, name, value):
+        with self._lock:
+            self.gauges[name] = value
+
+    def add_span(self, name, seconds):
+        """Suma una duración a la fase 'name' (las fases repetidas se acumulan)."""
+        with self._lock:
+            span = self.spans.setdefault(name, {"seconds": 0.0, "count": 0})
+            span["seconds"] += seconds
+            span["count"] += 1
+
+    @contextmanager
+    def span(self, name):
+        """Mide el bloque y lo acumula en la fase 'name'."""
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            self.add_span(name, time.monotonic() - start)
+
+    def start(self):
+        self.started = time.time()
+        self._start_monotonic = time.monotonic()
+        self._write_prom(running=True)
+        return self
+
+    def finish(self, status="ok", duration=None):
+        """Cierra la ejecución: añade el registro JSON y actualiza el archivo .prom. Devuelve el registro."""
+        if self.started is None:
+            self.start()
+        if duration is None:
+            duration = time.monotonic() - self._start_monotonic
+        with self._lock:
+            record = {
+                "job": self.job,
+                "host": socket.gethostname(),
+                "start": datetime.fromtimestamp(self.started).isoformat(timespec="seconds"),
+                "duration": round(duration, 3),
+                "status": status,
+                "counters": dict(self.counters),
+                "gauges": dict(self.gauges),
+                "spans": {k: {"seconds": round(v["seconds"], 3), "count": v["count"]} for k, v in self.spans.items()},
+            }
+        try:
+            os.makedirs(os.path.dirname(self.metrics_file), exist_ok=True)
+            with open(self.metrics_file, "a") as f:
+                f.write(json.dumps(record, ensure_ascii=False) + "\n")
+        except OSError:
+            pass
+        self._write_prom(running=False, record=record)
+        return record
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc, tb):
+        failed = exc_type is not None and not (issubclass(exc_type, SystemExit) and not exc.code)
+        self.finish("error" if failed else self.status)
+        return False
+
+    def _write_prom(self, running, record=None):
+        """Reescribe 'confiraspa_<job>.prom' de forma atómica (node_exporter no debe leerlo a medias)."""
+        directory = self.prom_dir or textfile_dir()
+        if directory is None:
+            return
+        job = _label(self.job)
+        lines = [
+            "# HELP confiraspa_job_running 1 mientras el trabajo se está ejecutando.",
+            "# TYPE confiraspa_job_running gauge",
+            f'confiraspa_job_running{{job="{job}"}} {1 if running else 0}',
+            "# HELP confiraspa_job_start_timestamp_seconds Inicio de la última ejecución.",
+            "# TYPE confiraspa_job_start_timestamp_seconds gauge",
+            f'confiraspa_job_start_timestamp_seconds{{job="{job}"}} {self.started:.3f}',
+        ]
+        if record is not None:
+            lines += [
+                "# HELP confiraspa_job_last_run_timestamp_seconds Fin de la última ejecución.",
+                "# TYPE confiraspa_job_last_run_timestamp_seconds gauge",
+                f'confiraspa_job_last_run_timestamp_seconds{{job="{job}"}} {time.time():.3f}',
+                "# HELP confiraspa_job_duration_seconds Duración de la última ejecución.",
+                "# TYPE confiraspa_job_duration_seconds gauge",
+                f'confiraspa_job_duration_seconds{{job="{job}"}} {record["duration"]}',
+                "# HELP confiraspa_job_success 1 si la última ejecución terminó bien.",
+                "# TYPE confiraspa_job_success gauge",
+                f'confiraspa_job_success{{job="{job}"}} {1 if record["status"] == "ok" else 0}',
+                "# HELP confiraspa_job_phase_seconds Tiempo acumulado por fase en la última ejecución.",
+                "# TYPE confiraspa_job_phase_seconds gauge",
+            ]
+            lines += [f'confiraspa_job_phase_seconds{{job="{job}",phase="{_label(k)}"}} {v["seconds"]}'
+                      for k, v in sorted(record["spans"].items())]
+            lines += [
+                "# HELP confiraspa_job_counter Contadores de la última ejecución.",
+                "# TYPE confiraspa_job_counter gauge",
+            ]
+            lines += [f'confiraspa_job_counter{{job="{job}",counter="{_label(k)}"}} {v}'
+                      for k, v in sorted(record["counters"].items())]
+            lines += [
+                "# HELP confiraspa_job_value Valores registrados en la última ejecución.",
+                "# TYPE confiraspa_job_value gauge",
+            ]
+            lines += [f'confiraspa_job_value{{job="{job}",name="{_label(k)}"}} {v}'
+                      for k, v in sorted(record["gauges"].items()) if isinstance(v, (int, float))]
+
+        path = os.path.join(directory, f"confiraspa_{self.job}.prom")
+        try:
+            with open(f"{path}.tmp", "w") as f:
+                f.write("\n".join(lines) + "\n")
+            os.replace(f"{path}.tmp", path)
+        except OSError:
+            pass
+
+# --- Interfaz de línea de comandos (scripts de shell) -------------------------------------------
+
+def _start_file(job):
+    return os.path.join(DATA_DIR, f"metrics_{job}.start")
+
+def _parse_pairs(pairs):
+    result = {}
+    for pair in pairs or []:
+        name, _, value = pair.partition("=")
+        try:
+            result[name] = float(value) if "." in value else int(value)
+        except ValueError:
+            continue
+    return result
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Registra métricas de un script de shell.")
+    parser.add_argument("action", choices=["start", "finish"])
+    parser.add_argument("job")
+    parser.add_argument("--status", default="ok",
+                        help="'ok', 'error' o un código de salida (0 = ok).")
+    parser.add_argument("--counter", action="append", metavar="NOMBRE=VALOR")
+    parser.add_argument("--gauge", action="append", metavar="NOMBRE=VALOR")
+    parser.add_argument("--span", action="append", metavar="FASE=SEGUNDOS")
+    args = parser.parse_args(argv)
+
+    metrics = RunMetrics(args.job)
+    if args.action == "start":
+        metrics.start()
+        os.makedirs(DATA_DIR, exist_ok=True)
+        with open(_start_file(args.job), "w") as f:
+            f.write(f"{metrics.started}\n")
+        return 0
+
+    try:
+        with open(_start_file(args.job), "r") as f:
+            metrics.started = float(f.read().strip())
+        os.remove(_start_file(args.job))
+    except (OSError, ValueError):
+        metrics.started = time.time()
+    for name, value in _parse_pairs(args.counter).items():
+        metrics.incr(name, value)
+    for name, value in _parse_pairs(args.gauge).items():
+        metrics.set(name, value)
+    for name, value in _parse_pairs(args.span).items():
+        metrics.add_span(name, value)
+    status = "ok" if args.status in ("ok", "0") else "error"
+    metrics.finish(status, duration=time.time() - metrics.started)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,327 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Module Name: preflight.py
+Description: Comprobaciones previas y control de E/S compartidos por las copias y la limpieza: verifica
+             que los discos de 'puntos_de_montaje.json' están montados (y que son los correctos) y
+             adapta el ritmo de lectura por disco a la actividad ajena que se ve en /proc/diskstats.
+Version: 1.0
+License: MIT License
+Usage:
+    from preflight import check_paths, IOPacer, load_pacing, set_idle_priority
+    problems = check_paths(["/media/DiscoDuro/torrents", "/media/WDElements/Peliculas"])
+    pacer = IOPacer(load_pacing())
+    pacer.consume(st.st_dev, len(chunk))    # tras cada lectura; duerme si hay que ir más despacio
+
+    Desde scripts de shell:
+        python3 /opt/confiraspa/lib/preflight.py check /media/WDElements/Fotos /media/Backup/Fotos
+        python3 /opt/confiraspa/lib/preflight.py bwlimit /media/WDElements/Fotos /media/Backup/Fotos
+Notes:
+    - Con 'nofail' en fstab, un disco USB desconectado deja su punto de montaje como un directorio
+      vacío de la tarjeta SD: rsync --delete copiaría ahí y downloadclean no encontraría nada. Una ruta
+      bajo un punto de 'puntos_de_montaje.json' solo se da por buena si ese punto aparece en
+      /proc/self/mountinfo y el dispositivo montado tiene el UUID esperado ("uuid" en la entrada o el
+      de la línea UUID=... de /etc/fstab que escribe generate_fstab.sh) o, si no hay UUID, el LABEL.
+      Las rutas que no están bajo ningún punto configurado (/var/lib/sonarr...) no se comprueban.
+    - IOPacer compara, cada "sample_seconds", los sectores leídos y escritos del disco con los bytes que
+      ha leído el propio proceso. Si la diferencia (E/S ajena: Plex, Transmission...) supera
+      "foreign_threshold", la lectura baja a "min_rate"; mientras el disco siga tranquilo el límite se
+      duplica en cada muestra hasta desaparecer (o hasta "max_rate" si se indica).
+    - Los valores de ritmo se leen de "io_pacing" en 'puntos_de_montaje.json' (admiten sufijos K, M y G).
+      "enabled": false desactiva el control de ritmo.
+    - set_idle_priority() pone el proceso en la clase 'idle' de ionice: con el planificador BFQ el disco
+      solo lo atiende cuando nadie más lo usa. Debe llamarse antes de crear hilos, que heredan la clase.
+"""
+
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import threading
+import subprocess
+
+from fsutil import device_of, parse_size
+
+INSTALL_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+MOUNTS_CONFIG_FILE = os.path.join(INSTALL_DIR, "configs", "puntos_de_montaje.json")
+MOUNTINFO_FILE = "/proc/self/mountinfo"
+DISKSTATS_FILE = "/proc/diskstats"
+FSTAB_FILE = "/etc/fstab"
+DISK_BY_DIR = "/dev/disk"
+SECTOR_SIZE = 512
+
+DEFAULT_PACING = {
+    "enabled": True,
+    "min_rate": 4 * 1024**2,            # bytes/s mientras hay E/S ajena en el disco
+    "max_rate": None,                   # bytes/s con el disco tranquilo (None: sin límite)
+    "foreign_threshold": 256 * 1024,    # bytes/s ajenos a partir de los que se frena
+    "sample_seconds": 2,
+}
+# Por encima de este ritmo un disco USB no se nota limitado: se quita el límite
+UNTHROTTLE_RATE = 64 * 1024**2
+# Lectura anticipada del kernel: parte de lo leído del disco por encima de lo pedido no es ajena
+READAHEAD_MARGIN = 0.25
+def load_config(config_file=MOUNTS_CONFIG_FILE):
+    try:
+        with open(config_file, "r") as f:
+            return json.load(f)
+    except (OSError, json.JSONDecodeError):
+        return {}
+
+def load_mounts(config_file=MOUNTS_CONFIG_FILE):
+    return load_config(config_file).get("puntos_de_montaje", [])
+
+def load_pacing(config_file=MOUNTS_CONFIG_FILE):
+    """Parámetros de IOPacer: los de 'io_pacing' sobre los valores por defecto."""
+    settings = dict(DEFAULT_PACING)
+    settings.update(load_config(config_file).get("io_pacing", {}))
+    for key in ("min_rate", "max_rate", "foreign_threshold"):
+        settings[key] = parse_size(settings[key])
+    return settings
+
+# --- Puntos de montaje ----------------------------------------------------------------------------
+
+def _unescape(field):
+    """Deshace los escapes octales de mountinfo y fstab ('\\040' es un espacio)."""
+    if "\\" not in field:
+        return field
+    return field.encode().decode("unicode_escape").encode("latin-1").decode()
+
+def read_mountinfo(path=MOUNTINFO_FILE):
+    """Devuelve [{'mount_point', 'dev', 'fstype', 'source'}] en el orden de /proc/self/mountinfo."""
+    mounts = []
+    try:
+        with open(path, "r") as f:
+            for line in f:
+                fields = line.split()
+                separator = fields.index("-")
+                major, minor = fields[2].split(":")
+                mounts.append({
+                    "mount_point": _unescape(fields[4]),
+                    "dev": (int(major), int(minor)),
+                    "fstype": fields[separator + 1],
+                    "source": _unescape(fields[separator + 2]),
+                })
+    except (OSError, ValueError, IndexError):
+        pass
+    return mounts
+
+def fstab_uuids(path=FSTAB_FILE):
+    """Devuelve {punto de montaje: UUID} de las líneas 'UUID=...' de /etc/fstab."""
+    uuids = {}
+    try:
+        with open(path, "r") as f:
+            for line in f:
+                fields = line.split()
+                if len(fields) >= 2 and fields[0].startswith("UUID="):
+                    uuids[_unescape(fields[1]).rstrip("/") or "/"] = fields[0][len("UUID="):]
+    except OSError:
+        pass
+    return uuids
+
+def tagged_device(kind, value):
+    """Dispositivo de /dev/disk/by-uuid o /dev/disk/by-label, o None si no está conectado."""
+    path = os.path.join(DISK_BY_DIR, f"by-{kind}", value.replace("/", "\\x2f").replace(" ", "\\x20"))
+    return os.path.realpath(path) if os.path.exists(path) else None
+
+def _same_device(mount, device):
+    """Indica si 'mount' (de mountinfo) tiene montado el dispositivo de bloques 'device'."""
+    try:
+        rdev = os.stat(device).st_rdev
+    except OSError:
+        return False
+    # Los montajes FUSE (ntfs-3g) tienen un dispositivo anónimo (0:N); se compara el origen
+    if mount["dev"][0] != 0:
+        return mount["dev"] == (os.major(rdev), os.minor(rdev))
+    return os.path.realpath(mount["source"]) == device
+
+def check_mount(entry, mountinfo=None, uuids=None):
+    """Comprueba un punto de 'puntos_de_montaje.json'. Devuelve la descripción del problema o None."""
+    path = entry["ruta"].rstrip("/") or "/"
+    mountinfo = read_mountinfo() if mountinfo is None else mountinfo
+    # Si hay montajes apilados, el que se ve es el último
+    mount = next((m for m in reversed(mountinfo) if m["mount_point"] == path), None)
+    if mount is None:
+        return f"'{path}' no está montado ({entry.get('label', 'sin etiqueta')}); se escribiría en la tarjeta SD."
+
+    uuids = fstab_uuids() if uuids is None else uuids
+    uuid = entry.get("uuid") or uuids.get(path)
+    if uuid:
+        kind, value = "uuid", uuid
+    elif entry.get("label"):
+        kind, value = "label", entry["label"]
+    else:
+        return None
+    device = tagged_device(kind, value)
+    if device is None or not _same_device(mount, device):
+        return f"En '{path}' está montado '{mount['source']}', no el disco con {kind.upper()}={value}."
+    return None
+
+def _under(path, root):
+    path, root = os.path.abspath(path), root.rstrip("/") or "/"
+    return path == root or path.startswith(root.rstrip("/") + "/")
+
+def check_paths(paths, config_file=MOUNTS_CONFIG_FILE):
+    """Comprueba los puntos de montaje de los que dependen 'paths'. Devuelve la lista de problemas."""
+    paths = [p for p in paths if p]
+    entries = [e for e in load_mounts(config_file)
+               if e.get("ruta") and any(_under(p, e["ruta"]) for p in paths)]
+    if not entries:
+        return []
+    mountinfo = read_mountinfo()
+    uuids = fstab_uuids()
+    problems = [check_mount(e, mountinfo, uuids) for e in entries]
+    return [p for p in problems if p]
+
+# --- Ritmo de E/S ---------------------------------------------------------------------------------
+
+_diskstats_keys = {}
+
+def diskstats_key(dev):
+    """Devuelve la clave (major, minor) de /proc/diskstats para un st_dev.
+
+    Los montajes FUSE (ntfs-3g) tienen un dispositivo anónimo (0:N) que no aparece en /proc/diskstats;
+    en ese caso se usa el dispositivo de bloques de origen que indica mountinfo.
+    """
+    key = _diskstats_keys.get(dev)
+    if key is None:
+        key = (os.major(dev), os.minor(dev))
+        if key[0] == 0:
+            mount = next((m for m in reversed(read_mountinfo()) if m["dev"] == key), None)
+            if mount is not None and mount["source"].startswith("/dev/"):
+                try:
+                    rdev = os.stat(mount["source"]).st_rdev
+                    key = (os.major(rdev), os.minor(rdev))
+                except OSError:
+                    pass
+        _diskstats_keys[dev] = key
+    return key
+
+def read_diskstats(path=DISKSTATS_FILE):
+    """Devuelve {(major, minor): bytes leídos + escritos} de /proc/diskstats."""
+    stats = {}
+    try:
+        with open(path, "r") as f:
+            for line in f:
+                fields = line.split()
+                if len(fields) >= 10:
+                    stats[(int(fields[0]), int(fields[1]))] = (int(fields[5]) + int(fields[9])) * SECTOR_SIZE
+    except (OSError, ValueError):
+        pass
+    return stats
+
+def sample_rates(devices, seconds=DEFAULT_PACING["sample_seconds"]):
+    """Mide durante 'seconds' los bytes/s de E/S de cada dispositivo (st_dev). {dev: bytes/s}."""
+    keys = {d: diskstats_key(d) for d in devices if d is not None}
+    before = read_diskstats()
+    start = time.monotonic()
+    time.sleep(seconds)
+    after = read_diskstats()
+    elapsed = time.monotonic() - start
+    return {d: (after[k] - before[k]) / elapsed for d, k in keys.items() if k in before and k in after}
+
+class IOPacer:
+    """Ritmo de lectura adaptativo por dispositivo, seguro entre hilos."""
+
+    def __init__(self, settings=None):
+        self.settings = dict(DEFAULT_PACING)
+        self.settings.update(settings or {})
+        self._lock = threading.Lock()
+        self._devices = {}
+
+    def _state(self, dev, now):
+        state = self._devices.get(dev)
+        if state is None:
+            state = {"rate": self.settings["max_rate"], "next": now, "own": 0,
+                     "sampled": now, "disk": read_diskstats().get(diskstats_key(dev))}
+            self._devices[dev] = state
+        return state
+
+    def _resample(self, dev, state, now):
+        """Ajusta el límite del dispositivo según la E/S ajena desde la muestra anterior."""
+        disk = read_diskstats().get(diskstats_key(dev))
+        elapsed = now - state["sampled"]
+        if disk is not None and state["disk"] is not None and elapsed > 0:
+            own = state["own"]
+            foreign = (disk - state["disk"] - own * (1 + READAHEAD_MARGIN)) / elapsed
+            if foreign > self.settings["foreign_threshold"]:
+                state["rate"] = self.settings["min_rate"]
+            elif state["rate"] is not None:
+                rate = state["rate"] * 2
+                ceiling = self.settings["max_rate"]
+                if ceiling is not None:
+                    state["rate"] = min(rate, ceiling)
+                else:
+                    state["rate"] = None if rate >= UNTHROTTLE_RATE else rate
+        state.update(own=0, sampled=now, disk=disk)
+
+    def rate(self, dev):
+        """Límite actual del dispositivo en bytes/s (None: sin límite)."""
+        with self._lock:
+            state = self._devices.get(dev)
+            return state["rate"] if state else self.settings["max_rate"]
+
+    def consume(self, dev, nbytes):
+        """Anota 'nbytes' leídos de 'dev' y espera lo necesario para no pasar del límite."""
+        if not self.settings["enabled"] or dev is None or nbytes <= 0:
+            return
+        with self._lock:
+            now = time.monotonic()
+            state = self._state(dev, now)
+            state["own"] += nbytes
+            if now - state["sampled"] >= self.settings["sample_seconds"]:
+                self._resample(dev, state, now)
+            if state["rate"] is None:
+                state["next"] = now
+                return
+            # Cada lectura reserva su hueco: varios hilos sobre el mismo disco comparten el límite
+            state["next"] = max(state["next"], now) + nbytes / state["rate"]
+            delay = state["next"] - now
+        if delay > 0:
+            time.sleep(delay)
+
+def ionice_command():
+    """Prefijo para lanzar un comando en la clase 'idle' de ionice ([] si no está disponible)."""
+    return ["ionice", "-c", "3"] if shutil.which("ionice") else []
+
+def set_idle_priority():
+    """Pone el proceso actual en la clase 'idle' de ionice. Devuelve True si se pudo."""
+    command = ionice_command()
+    if not command:
+        return False
+    return subprocess.run(command + ["-p", str(os.getpid())],
+                          stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL).returncode == 0
+
+def rsync_bwlimit(paths, settings=None):
+    """Valor de --bwlimit de rsync (KiB/s) según la E/S actual de los discos de 'paths'; 0 sin límite."""
+    settings = load_pacing() if settings is None else settings
+    if not settings["enabled"]:
+        return 0
+    rates = sample_rates({device_of(p) for p in paths}, settings["sample_seconds"])
+    if any(r > settings["foreign_threshold"] for r in rates.values()):
+        return max(1, settings["min_rate"] // 1024)
+    return settings["max_rate"] // 1024 if settings["max_rate"] else 0
+
+# --- Línea de comandos ----------------------------------------------------------------------------
+
+def main():
+    parser = argparse.ArgumentParser(description="Comprobaciones de montaje y ritmo de E/S para scripts de shell.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    check = subparsers.add_parser("check", help="Sale con 1 si algún disco del que dependen las rutas no está bien montado.")
+    check.add_argument("paths", nargs="+")
+    bwlimit = subparsers.add_parser("bwlimit", help="Imprime el --bwlimit de rsync (KiB/s, 0 sin límite).")
+    bwlimit.add_argument("paths", nargs="+")
+    parser.add_argument("--config", default=MOUNTS_CONFIG_FILE, help="Archivo de puntos de montaje.")
+    args = parser.parse_args()
+
+    if args.command == "check":
+        problems = check_paths(args.paths, args.config)
+        for problem in problems:
+            print(problem, file=sys.stderr)
+        sys.exit(1 if problems else 0)
+    print(rsync_bwlimit(args.paths, load_pacing(args.config)))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,342 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Module Name: snapshot_store.py
+Description: Almacén de backups deduplicado por contenido para los backups programados de las apps *arr.
+Version: 1.0
+License: MIT License
+Usage:
+    from snapshot_store import SnapshotStore
+    store = SnapshotStore("/media/Backup/snapshots")
+    snapshot = store.add_zip("radarr", "/media/Backup/radarr/scheduled/radarr_backup_....zip")
+    store.restore_file(snapshot["files"]["radarr.db"], "/tmp/radarr.db")
+Notes:
+    - Cada archivo del ZIP se trocea en bloques de tamaño fijo ('chunk_size', múltiplo del tamaño de
+      página de SQLite). Cada bloque se guarda una sola vez en 'chunks/<aa>/<sha256>', así que entre dos
+      backups solo ocupan espacio las páginas de la base de datos que han cambiado.
+    - Una instantánea es un JSON en 'snapshots/<id>.json' con la lista de bloques de cada archivo.
+    - Los bloques se guardan sin comprimir para que la restauración pueda copiarlos sin pasar por
+      espacio de usuario (os.copy_file_range, os.sendfile como alternativa). Con 'verify=True' la
+      restauración lee cada bloque, comprueba su SHA256 y devuelve el SHA256 del archivo escrito.
+    - Un bloqueo (flock) sobre 'store.lock' impide que 'gc' borre bloques mientras otro proceso
+      crea una instantánea o restaura desde ella.
+    - Los bloques y el JSON de la instantánea se escriben con fsync antes del rename, y los directorios
+      se sincronizan antes de guardar la instantánea: tras un corte de luz no puede quedar una
+      instantánea que apunte a un bloque truncado. Un bloque existente solo se reutiliza si su tamaño
+      coincide; si no, se vuelve a escribir.
+"""
+
+import os
+import json
+import fcntl
+import errno
+import hashlib
+import zipfile
+from contextlib import contextmanager
+from datetime import datetime
+
+from backup_catalog import parse_backup_timestamp
+
+DEFAULT_CHUNK_SIZE = 64 * 1024
+SNAPSHOTS_DIR_NAME = "snapshots"
+CHUNKS_DIR_NAME = "chunks"
+LOCK_FILE_NAME = "store.lock"
+
+def read_full(src, size):
+    """Lee hasta 'size' bytes de 'src', aunque el flujo devuelva lecturas parciales."""
+    parts = []
+    remaining = size
+    while remaining > 0:
+        data = src.read(remaining)
+        if not data:
+            break
+        parts.append(data)
+        remaining -= len(data)
+    return b"".join(parts)
+
+def copy_range(src_fd, dst_fd, count):
+    """Copia 'count' bytes entre descriptores sin pasar por espacio de usuario si el kernel lo permite."""
+    remaining = count
+    if hasattr(os, "copy_file_range"):
+        try:
+            while remaining > 0:
+                copied = os.copy_file_range(src_fd, dst_fd, remaining)
+                if copied == 0:
+                    break
+                remaining -= copied
+            return count - remaining
+        except OSError as e:
+            if e.errno not in (errno.EXDEV, errno.ENOSYS, errno.EINVAL, errno.EOPNOTSUPP):
+                raise
+    try:
+        while remaining > 0:
+            sent = os.sendfile(dst_fd, src_fd, None, remaining)
+            if sent == 0:
+                break
+            remaining -= sent
+        return count - remaining
+    except OSError as e:
+        if e.errno not in (errno.ENOSYS, errno.EINVAL):
+            raise
+    while remaining > 0:
+        data = os.read(src_fd, min(remaining, DEFAULT_CHUNK_SIZE))
+        if not data:
+            break
+        os.write(dst_fd, data)
+        remaining -= len(data)
+    return count - remaining
+
+def fsync_dir(path):
+    """Sincroniza un directorio para que los renames hechos en él sobrevivan a un corte de luz."""
+    fd = os.open(path, os.O_RDONLY | os.O_DIRECTORY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+def write_durable(path, data):
+    """Escribe 'data' (bytes) en 'path' de forma atómica y sincronizada (sin sincronizar el directorio)."""
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+class SnapshotStore:
+    """Almacén de bloques direccionados por SHA256 e instantáneas que los referencian."""
+
+    def __init__(self, root, chunk_size=DEFAULT_CHUNK_SIZE):
+        self.root = root
+        self.chunk_size = chunk_size
+        self.snapshots_dir = os.path.join(root, SNAPSHOTS_DIR_NAME)
+        self.chunks_dir = os.path.join(root, CHUNKS_DIR_NAME)
+        # Directorios de bloques con renames pendientes de sincronizar
+        self._dirty_dirs = set()
+        os.makedirs(self.snapshots_dir, exist_ok=True)
+        os.makedirs(self.chunks_dir, exist_ok=True)
+
+    @contextmanager
+    def lock(self, exclusive=False):
+        """Bloqueo compartido (lectura) o exclusivo (escritura, gc) sobre el almacén."""
+        with open(os.path.join(self.root, LOCK_FILE_NAME), "a") as f:
+            fcntl.flock(f, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+            try:
+                yield
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    def chunk_path(self, digest):
+        return os.path.join(self.chunks_dir, digest[:2], digest)
+
+    def _store_chunk(self, data):
+        """Guarda un bloque si no existe (o si el guardado está truncado). Devuelve (digest, bytes nuevos)."""
+        digest = hashlib.sha256(data).hexdigest()
+        path = self.chunk_path(digest)
+        try:
+            if os.stat(path).st_size == len(data):
+                return digest, 0
+        except FileNotFoundError:
+            pass
+        directory = os.path.dirname(path)
+        os.makedirs(directory, exist_ok=True)
+        write_durable(path, data)
+        self._dirty_dirs.add(directory)
+        return digest, len(data)
+
+    def _sync_chunks(self):
+        """Sincroniza los directorios de los bloques escritos desde la última llamada."""
+        for directory in self._dirty_dirs:
+            fsync_dir(directory)
+        if self._dirty_dirs:
+            fsync_dir(self.chunks_dir)
+        self._dirty_dirs.clear()
+
+    def _store_stream(self, src):
+        """Trocea un flujo en bloques. Devuelve (lista de bloques, tamaño, sha256, bytes nuevos)."""
+        chunks = []
+        hasher = hashlib.sha256()
+        size = 0
+        new_bytes = 0
+        while True:
+            data = read_full(src, self.chunk_size)
+            if not data:
+                break
+            hasher.update(data)
+            size += len(data)
+            digest, written = self._store_chunk(data)
+            chunks.append(digest)
+            new_bytes += written
+        return chunks, size, hasher.hexdigest(), new_bytes
+
+    def _snapshot_path(self, snapshot_id):
+        return os.path.join(self.snapshots_dir, f"{snapshot_id}.json")
+
+    def _new_snapshot_id(self, app, timestamp):
+        base = f"{app}_{datetime.fromtimestamp(timestamp):%Y-%m-%d_%H-%M-%S}"
+        snapshot_id = base
+        suffix = 2
+        while os.path.exists(self._snapshot_path(snapshot_id)):
+            snapshot_id = f"{base}_{suffix}"
+            suffix += 1
+        return snapshot_id
+
+    def add_zip(self, app, zip_path):
+        """Crea una instantánea de 'app' con el contenido de un backup ZIP y la devuelve."""
+        timestamp = parse_backup_timestamp(os.path.basename(zip_path))
+        if timestamp is None:
+            timestamp = os.stat(zip_path).st_mtime
+
+        files = {}
+        total_size = 0
+        new_bytes = 0
+        with self.lock(exclusive=True), zipfile.ZipFile(zip_path, "r") as zf:
+            for info in zf.infolist():
+                if info.is_dir():
+                    continue
+                with zf.open(info) as src:
+                    chunks, size, digest, written = self._store_stream(src)
+                name = os.path.normpath(info.filename.replace("\\", "/")).lstrip("/")
+                files[name] = {
+                    "size": size,
+                    "sha256": digest,
+                    "mtime": datetime(*info.date_time).timestamp(),
+                    "chunks": chunks,
+                }
+                total_size += size
+                new_bytes += written
+
+            snapshot = {
+                "id": self._new_snapshot_id(app, timestamp),
+                "app": app,
+                "source": os.path.basename(zip_path),
+                "timestamp": timestamp,
+                "created": datetime.now().isoformat(timespec="seconds"),
+                "size": total_size,
+                "new_bytes": new_bytes,
+                "files": files,
+            }
+            # Los bloques tienen que estar en disco antes que la instantánea que los referencia
+            self._sync_chunks()
+            write_durable(self._snapshot_path(snapshot["id"]), json.dumps(snapshot).encode())
+            fsync_dir(self.snapshots_dir)
+        return snapshot
+
+    def load(self, snapshot_id):
+        """Carga una instantánea por su ID. Lanza FileNotFoundError si no existe."""
+        with open(self._snapshot_path(snapshot_id), "r") as f:
+            return json.load(f)
+
+    def snapshots(self, app=None):
+        """Devuelve las instantáneas (opcionalmente de una app), de la más nueva a la más antigua."""
+        result = []
+        with os.scandir(self.snapshots_dir) as it:
+            for entry in it:
+                if not entry.name.endswith(".json"):
+                    continue
+                try:
+                    with open(entry.path, "r") as f:
+                        snapshot = json.load(f)
+                except (OSError, json.JSONDecodeError):
+                    continue
+                if app is None or snapshot.get("app") == app:
+                    result.append(snapshot)
+        result.sort(key=lambda s: (s["timestamp"], s["id"]), reverse=True)
+        return result
+
+    def restore_file(self, file_record, dst_path, verify=False):
+        """Reconstruye un archivo de una instantánea en 'dst_path'.
+
+        Sin 'verify' los bloques se copian sin pasar por espacio de usuario y devuelve None. Con
+        'verify' cada bloque se lee y se comprueba contra su SHA256 en la misma pasada; devuelve el
+        SHA256 del archivo escrito.
+        """
+        hasher = hashlib.sha256() if verify else None
+        with self.lock():
+            with open(dst_path, "wb") as dst:
+                for digest in file_record["chunks"]:
+                    with open(self.chunk_path(digest), "rb") as src:
+                        if verify:
+                            data = src.read()
+                            if hashlib.sha256(data).hexdigest() != digest:
+                                raise OSError(f"Bloque '{digest}' dañado")
+                            hasher.update(data)
+                            dst.write(data)
+                            continue
+                        count = os.fstat(src.fileno()).st_size
+                        if copy_range(src.fileno(), dst.fileno(), count) != count:
+                            raise OSError(f"Bloque '{digest}' incompleto")
+            mtime = file_record.get("mtime")
+            if mtime is not None:
+                os.utime(dst_path, (mtime, mtime))
+        return hasher.hexdigest() if verify else None
+
+    def delete(self, snapshot_id):
+        """Elimina una instantánea (sus bloques se liberan con 'gc')."""
+        with self.lock(exclusive=True):
+            os.remove(self._snapshot_path(snapshot_id))
+
+    def verify(self, snapshot):
+        """Comprueba que todos los bloques de una instantánea existen y su SHA256 es correcto.
+
+        Devuelve la lista de bloques ausentes o dañados.
+        """
+        bad = []
+        with self.lock():
+            for file_record in snapshot["files"].values():
+                for digest in file_record["chunks"]:
+                    try:
+                        with open(self.chunk_path(digest), "rb") as f:
+                            if hashlib.sha256(f.read()).hexdigest() != digest:
+                                bad.append(digest)
+                    except FileNotFoundError:
+                        bad.append(digest)
+        return bad
+
+    def gc(self, dry_run=False, ignore=()):
+        """Borra los bloques que no referencia ninguna instantánea. Devuelve (bloques, bytes) liberados.
+
+        Con 'dry_run' no borra nada y devuelve lo que liberaría; las instantáneas de 'ignore' se
+        tratan como ya eliminadas (las que una poda en modo simulación borraría).
+        """
+        removed = 0
+        freed = 0
+        with self.lock(exclusive=not dry_run):
+            referenced = set()
+            for snapshot in self.snapshots():
+                if snapshot["id"] in ignore:
+                    continue
+                for file_record in snapshot["files"].values():
+                    referenced.update(file_record["chunks"])
+
+            with os.scandir(self.chunks_dir) as prefixes:
+                for prefix in prefixes:
+                    if not prefix.is_dir():
+                        continue
+                    with os.scandir(prefix.path) as it:
+                        for entry in it:
+                            if entry.name in referenced:
+                                continue
+                            try:
+                                size = entry.stat().st_size
+                                if not dry_run:
+                                    os.remove(entry.path)
+                            except OSError:
+                                continue
+                            removed += 1
+                            freed += size
+        return removed, freed
+
+    def usage(self):
+        """Devuelve (número de bloques, bytes ocupados) del almacén."""
+        count = 0
+        total = 0
+        with os.scandir(self.chunks_dir) as prefixes:
+            for prefix in prefixes:
+                if not prefix.is_dir():
+                    continue
+                with os.scandir(prefix.path) as it:
+                    for entry in it:
+                        count += 1
+                        total += entry.stat().st_size
+        return count, total
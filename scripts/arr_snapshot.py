@@ -0,0 +1,217 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Script Name: arr_snapshot.py
+Description: Convierte los backups programados (ZIP) de las apps *arr en instantáneas de un almacén
+             deduplicado por contenido, elimina las instantáneas antiguas y libera los bloques sin uso.
+Version: 1.0
+License: MIT License
+Usage:
+    python3 arr_snapshot.py [run] [--dry-run]  Ingesta, poda y gc (lo que ejecuta cron)
+    python3 arr_snapshot.py ingest [--dry-run] Solo crea instantáneas de los ZIP nuevos
+    python3 arr_snapshot.py list [--app radarr]
+    python3 arr_snapshot.py prune [--dry-run]
+    python3 arr_snapshot.py gc [--dry-run]
+    python3 arr_snapshot.py verify [ID ...]
+Notes:
+    - La configuración está en 'configs/arr_snapshot.json':
+          {
+              "store_dir": "/media/Backup/snapshots",
+              "chunk_size": 65536,
+              "apps": [
+                  {"app": "radarr", "source_dir": "/media/Backup/radarr/scheduled", "keep_snapshots": 180}
+              ]
+          }
+    - Debe ejecutarse después de 'backup_rsync.sh' y antes de 'rotabackup.py', para que ningún ZIP se
+      borre sin haber pasado al almacén.
+    - Cada ZIP se ingiere una sola vez (se recuerda el nombre del ZIP de origen de cada instantánea).
+    - 'restaurarr.py --snapshot <ID>' restaura directamente desde una instantánea.
+    - Con '--dry-run' solo se informa: no se crean instantáneas ni se borran instantáneas o bloques.
+      El gc simulado cuenta también los bloques que liberaría la poda simulada.
+"""
+
+import os
+import sys
+import json
+import logging
+import argparse
+
+INSTALL_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+CONFIG_DIR = os.path.join(INSTALL_DIR, "configs")
+LOG_DIR = os.path.join(INSTALL_DIR, "logs")
+CONFIG_FILE = os.path.join(CONFIG_DIR, "arr_snapshot.json")
+sys.path.insert(0, os.path.join(INSTALL_DIR, "lib"))
+
+from backup_catalog import BackupCatalog
+from snapshot_store import SnapshotStore, DEFAULT_CHUNK_SIZE
+from metrics import RunMetrics
+from fsutil import format_size
+from preflight import check_paths
+
+# Configuración del logger
+LOG_FILE = os.path.join(LOG_DIR, "arr_snapshot.log")
+os.makedirs(LOG_DIR, exist_ok=True)
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s [%(levelname)s] [%(filename)s]: %(message)s',
+    handlers=[
+        logging.FileHandler(LOG_FILE),
+        logging.StreamHandler()
+    ]
+)
+logger = logging.getLogger(__name__)
+metrics = RunMetrics("arr_snapshot")
+
+DEFAULT_KEEP_SNAPSHOTS = 180
+
+def load_config(config_file):
+    try:
+        with open(config_file, "r") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        logger.error(f"El archivo de configuración '{config_file}' no se encontró.")
+        sys.exit(1)
+    except json.JSONDecodeError as e:
+        logger.error(f"Error al parsear el archivo JSON: {e}")
+        sys.exit(1)
+
+def open_store(config):
+    return SnapshotStore(config["store_dir"], config.get("chunk_size", DEFAULT_CHUNK_SIZE))
+
+def ingest(store, config, dry_run=False):
+    """Crea una instantánea por cada ZIP que aún no esté en el almacén."""
+    catalog = BackupCatalog()
+    for app_config in config.get("apps", []):
+        app = app_config["app"]
+        source_dir = app_config["source_dir"]
+        if not os.path.isdir(source_dir):
+            logger.warning(f"El directorio de backups '{source_dir}' de '{app}' no existe.")
+            continue
+
+        snapshots = store.snapshots(app)
+        known = {s["source"] for s in snapshots}
+        keep = app_config.get("keep_snapshots", DEFAULT_KEEP_SNAPSHOTS)
+        # Con el cupo lleno, un ZIP anterior a la instantánea más antigua se podaría enseguida
+        oldest = snapshots[-1]["timestamp"] if snapshots and len(snapshots) >= keep else None
+        catalog.refresh(source_dir)
+        # Del más antiguo al más nuevo, para que el orden de creación siga el de los backups
+        for entry in reversed(catalog.entries(source_dir, ext=".zip")):
+            if entry.name in known or (oldest is not None and entry.timestamp <= oldest):
+                continue
+            if dry_run:
+                logger.info(f"[dry-run] Se crearía una instantánea de '{app}' desde '{entry.name}'.")
+                continue
+            try:
+                snapshot = store.add_zip(app, entry.path)
+            except Exception as e:
+                logger.error(f"No se pudo crear la instantánea de '{entry.path}': {e}")
+                metrics.status = "error"
+                continue
+            metrics.incr("snapshots_created")
+            metrics.incr("bytes_ingested", snapshot["size"])
+            metrics.incr("bytes_new", snapshot["new_bytes"])
+            logger.info(
+                f"Instantánea '{snapshot['id']}' creada desde '{entry.name}': "
+                f"{format_size(snapshot['size'])}, {format_size(snapshot['new_bytes'])} nuevos."
+            )
+    catalog.close()
+
+def prune(store, config, dry_run=False):
+    """Elimina las instantáneas que exceden 'keep_snapshots' para cada app. Devuelve sus IDs."""
+    pruned = []
+    for app_config in config.get("apps", []):
+        app = app_config["app"]
+        keep = app_config.get("keep_snapshots", DEFAULT_KEEP_SNAPSHOTS)
+        for snapshot in store.snapshots(app)[keep:]:
+            pruned.append(snapshot["id"])
+            if dry_run:
+                logger.info(f"[dry-run] Se eliminaría la instantánea '{snapshot['id']}'.")
+                continue
+            store.delete(snapshot["id"])
+            metrics.incr("snapshots_pruned")
+            logger.info(f"Instantánea '{snapshot['id']}' eliminada.")
+    return pruned
+
+def gc(store, dry_run=False, pruned=()):
+    removed, freed = store.gc(dry_run, ignore=set(pruned))
+    if dry_run:
+        logger.info(f"[dry-run] gc liberaría {removed} bloques ({format_size(freed)}).")
+        return
+    count, total = store.usage()
+    metrics.incr("chunks_freed", removed)
+    metrics.incr("bytes_freed", freed)
+    metrics.set("store_bytes", total)
+    metrics.set("store_chunks", count)
+    logger.info(
+        f"gc: {removed} bloques liberados ({format_size(freed)}); "
+        f"el almacén ocupa {format_size(total)} en {count} bloques."
+    )
+
+def list_snapshots(store, app=None):
+    for snapshot in store.snapshots(app):
+        logger.info(
+            f"{snapshot['id']}  {snapshot['source']}  {format_size(snapshot['size'])} "
+            f"({format_size(snapshot['new_bytes'])} nuevos)"
+        )
+
+def verify(store, snapshot_ids):
+    snapshots = [store.load(i) for i in snapshot_ids] if snapshot_ids else store.snapshots()
+    failed = 0
+    for snapshot in snapshots:
+        bad = store.verify(snapshot)
+        if bad:
+            failed += 1
+            logger.error(f"Instantánea '{snapshot['id']}': {len(bad)} bloques ausentes o dañados.")
+        else:
+            logger.info(f"Instantánea '{snapshot['id']}' correcta.")
+    return failed == 0
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Almacén deduplicado de backups de las apps *arr.")
+    parser.add_argument("command", nargs="?", default="run",
+                        choices=["run", "ingest", "list", "prune", "gc", "verify"])
+    parser.add_argument("ids", nargs="*", help="IDs de instantánea para 'verify'.")
+    parser.add_argument("--app", help="Filtra 'list' por aplicación.")
+    parser.add_argument("--dry-run", action="store_true",
+                        help="'run', 'ingest', 'prune' y 'gc' solo informan de lo que harían.")
+    parser.add_argument("--config", default=CONFIG_FILE, help="Archivo de configuración.")
+    return parser.parse_args()
+
+def maintain(store, config, args):
+    """Ingesta, poda y gc según el comando. Con '--dry-run' no se modifica el almacén."""
+    pruned = []
+    if args.command in ("run", "ingest"):
+        with metrics.span("ingest"):
+            ingest(store, config, args.dry_run)
+    if args.command in ("run", "prune"):
+        with metrics.span("prune"):
+            pruned = prune(store, config, args.dry_run)
+    if args.command in ("run", "gc"):
+        with metrics.span("gc"):
+            gc(store, args.dry_run, pruned)
+
+def main():
+    args = parse_args()
+    config = load_config(args.config)
+    # Con 'nofail', un disco desconectado deja su punto de montaje vacío en la tarjeta SD y el
+    # almacén se crearía ahí
+    problems = check_paths([config["store_dir"]] + [a["source_dir"] for a in config.get("apps", [])])
+    if problems:
+        for problem in problems:
+            logger.error(problem)
+        sys.exit(1)
+    store = open_store(config)
+
+    if args.command in ("run", "ingest", "prune", "gc"):
+        if args.dry_run:
+            maintain(store, config, args)
+        else:
+            with metrics:
+                maintain(store, config, args)
+    if args.command == "list":
+        list_snapshots(store, args.app)
+    if args.command == "verify" and not verify(store, args.ids):
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
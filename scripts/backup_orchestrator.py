@@ -0,0 +1,404 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Script Name: backup_orchestrator.py
+Description: Ejecuta en paralelo las copias de 'backup_rsync_config.json' y 'backup_rclone_config.json'
+             con límites de concurrencia por disco y por remoto, reintentos con espera creciente y un
+             resumen estructurado (JSON) de las estadísticas de cada copia.
+Version: 1.0
+License: GNU
+Usage:
+    python3 backup_orchestrator.py [--only rsync|rclone] [--workers N] [--json resultado.json]
+                                   [--rsync-bin RUTA] [--rclone-bin RUTA]
+Dependencies: rsync y/o rclone.
+Notes:
+    - Sustituye a 'backup_rsync.sh' y 'backup_rclone.sh' en el crontab. Las entradas 'directorios' de
+      ambos archivos se usan tal cual.
+    - Cada copia rsync ocupa una plaza de lectura en el disco de origen y una de escritura en el de
+      destino (identificados por st_dev); cada copia rclone ocupa una plaza en su remoto ('GDriveJuanjo',
+      'GPhotosJuanjo'...) y otra de escritura (descarga) o de lectura (subida) en el disco de su lado
+      local. "per_device_read" y "per_device_write" se cuentan por separado: todas las copias escriben
+      en el disco de backup, y con una sola plaza por disco un rclone lento frenaría a todos los rsync.
+    - Los límites, reintentos, binarios y opciones se configuran en 'configs/backup_orchestrator.json'.
+      Los binarios se pueden sustituir por otros falsos para hacer pruebas.
+    - La salida de cada copia se guarda en 'logs/backup_orchestrator_<fecha>/' y el resumen con las
+      estadísticas ('--stats' de rsync, log JSON de rclone) en 'logs/backup_orchestrator_<fecha>.json'.
+    - Antes de cada copia se comprueba con 'lib/preflight.py' que los discos locales (origen y destino
+      en rsync, el lado local en rclone) están montados; si no, la copia falla sin tocar nada. Las
+      copias se lanzan con ionice en la clase 'idle' ("ionice": false lo desactiva) y, si otro proceso
+      está usando alguno de los discos al empezar, con '--bwlimit' al ritmo mínimo de "io_pacing" en 'puntos_de_montaje.json'.
+"""
+
+import os
+import re
+import sys
+import json
+import time
+import logging
+import argparse
+import subprocess
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from datetime import datetime
+
+INSTALL_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+CONFIG_DIR = os.path.join(INSTALL_DIR, "configs")
+LOG_DIR = os.path.join(INSTALL_DIR, "logs")
+RSYNC_CONFIG_FILE = os.path.join(CONFIG_DIR, "backup_rsync_config.json")
+RCLONE_CONFIG_FILE = os.path.join(CONFIG_DIR, "backup_rclone_config.json")
+ORCHESTRATOR_CONFIG_FILE = os.path.join(CONFIG_DIR, "backup_orchestrator.json")
+sys.path.insert(0, os.path.join(INSTALL_DIR, "lib"))
+
+from metrics import RunMetrics
+from fsutil import device_of
+from preflight import check_paths, ionice_command, load_pacing, rsync_bwlimit
+
+DEFAULTS = {
+    "rsync_bin": "rsync",
+    "rclone_bin": "rclone",
+    "rclone_config": "/home/pi/.config/rclone/rclone.conf",
+    "rsync_options": ["-a", "--delete", "--stats"],
+    "rclone_options": ["--use-json-log", "-v", "--stats", "1m"],
+    "max_workers": 4,
+    "per_device_read": 1,
+    "per_device_write": 2,
+    "per_remote": 1,
+    "retries": 3,
+    "backoff_seconds": 5,
+    "backoff_factor": 2,
+    "ionice": True,
+}
+
+# rsync: 24 = algunos archivos desaparecieron durante la copia (normal en directorios en uso)
+RSYNC_OK_CODES = {0, 24}
+
+logger = logging.getLogger("BackupOrchestrator")
+metrics = RunMetrics("backup_orchestrator")
+
+def setup_logging(run_id):
+    """Log en consola y en 'logs/backup_orchestrator_<fecha>.log'."""
+    os.makedirs(LOG_DIR, exist_ok=True)
+    formatter = logging.Formatter("%(asctime)s - [%(levelname)s] - [%(threadName)s] - %(message)s")
+    logger.setLevel(logging.INFO)
+    for handler in (logging.FileHandler(os.path.join(LOG_DIR, f"backup_orchestrator_{run_id}.log")),
+                    logging.StreamHandler()):
+        handler.setFormatter(formatter)
+        logger.addHandler(handler)
+
+def load_json(path, required=True):
+    try:
+        with open(path, "r") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        if required:
+            logger.error(f"Archivo de configuración no encontrado en '{path}'.")
+        return None
+    except json.JSONDecodeError as e:
+        logger.error(f"El archivo de configuración '{path}' no es un JSON válido: {e}")
+        return None
+
+# --- Estadísticas -------------------------------------------------------------------------------
+
+SIZE_SUFFIXES = {"": 1, "K": 1024, "M": 1024 ** 2, "G": 1024 ** 3, "T": 1024 ** 4}
+
+def parse_number(text):
+    """Convierte '1,234', '1.23G' o '12.5M' (salida de rsync, con o sin -h) a número."""
+    text = text.replace(",", "").strip()
+    match = re.fullmatch(r"([\d.]+)([KMGT]?)", text)
+    if not match:
+        return None
+    value = float(match.group(1)) * SIZE_SUFFIXES[match.group(2)]
+    return int(value) if value.is_integer() or match.group(2) else value
+
+RSYNC_STATS_PATTERNS = {
+    "files": r"Number of files:\s+([\d,.]+[KMGT]?)",
+    "files_transferred": r"Number of regular files transferred:\s+([\d,.]+[KMGT]?)",
+    "files_created": r"Number of created files:\s+([\d,.]+[KMGT]?)",
+    "files_deleted": r"Number of deleted files:\s+([\d,.]+[KMGT]?)",
+    "total_size": r"Total file size:\s+([\d,.]+[KMGT]?) bytes",
+    "transferred_size": r"Total transferred file size:\s+([\d,.]+[KMGT]?) bytes",
+    "literal_data": r"Literal data:\s+([\d,.]+[KMGT]?) bytes",
+    "bytes_sent": r"Total bytes sent:\s+([\d,.]+[KMGT]?)",
+    "bytes_received": r"Total bytes received:\s+([\d,.]+[KMGT]?)",
+}
+
+def parse_rsync_stats(output):
+    """Extrae las cifras del bloque '--stats' de rsync."""
+    stats = {}
+    for key, pattern in RSYNC_STATS_PATTERNS.items():
+        match = re.search(pattern, output)
+        if match:
+            stats[key] = parse_number(match.group(1))
+    return stats
+
+RCLONE_TEXT_PATTERNS = {
+    "errors": r"^Errors:\s+(\d+)",
+    "checks": r"^Checks:\s+(\d+)",
+    "transfers": r"^Transferred:\s+(\d+) /",
+    "deletes": r"^Deleted:\s+(\d+)",
+}
+
+def parse_rclone_stats(output):
+    """Extrae las estadísticas finales de rclone.
+
+    Con '--use-json-log' cada bloque de estadísticas es una línea JSON con la clave 'stats' y se usa la
+    última. Sin ella se recurre al bloque de texto.
+    """
+    last = None
+    for line in output.splitlines():
+        line = line.strip()
+        if not line.startswith("{"):
+            continue
+        try:
+            record = json.loads(line)
+        except json.JSONDecodeError:
+            continue
+        if isinstance(record.get("stats"), dict):
+            last = record["stats"]
+    if last is not None:
+        keys = ("bytes", "checks", "deletes", "deletedDirs", "errors", "transfers",
+                "totalBytes", "totalTransfers", "elapsedTime", "speed")
+        return {k: last[k] for k in keys if k in last}
+
+    stats = {}
+    for key, pattern in RCLONE_TEXT_PATTERNS.items():
+        matches = re.findall(pattern, output, re.MULTILINE)
+        if matches:
+            stats[key] = int(matches[-1])
+    return stats
+
+# --- Trabajos -----------------------------------------------------------------------------------
+
+def device_key(path):
+    """Identifica el disco de una ruta (o del primer directorio existente por encima)."""
+    dev = device_of(path)
+    return "dev:?" if dev is None else f"dev:{dev}"
+
+def is_remote(path):
+    """'GDriveJuanjo:Libros' es un remoto de rclone; '/media/Backup/Libros' es una ruta local."""
+    name, sep, _ = path.partition(":")
+    return bool(sep) and "/" not in name
+
+def build_jobs(rsync_config, rclone_config, only=None):
+    """Crea la lista de trabajos con los recursos que ocupa cada uno."""
+    jobs = []
+    if rsync_config and only in (None, "rsync"):
+        for entry in rsync_config.get("directorios", []):
+            origen, destino = entry.get("origen"), entry.get("destino")
+            if not origen or not destino:
+                logger.error("Entrada rsync sin 'origen' o 'destino'. Saltando...")
+                continue
+            jobs.append({"kind": "rsync", "origen": origen, "destino": destino,
+                         "resources": sorted({f"read:{device_key(origen)}", f"write:{device_key(destino)}"})})
+    if rclone_config and only in (None, "rclone"):
+        for entry in rclone_config.get("directorios", []):
+            origen, destino = entry.get("origen"), entry.get("destino")
+            if not origen or not destino:
+                logger.error("Entrada rclone sin 'origen' o 'destino'. Saltando...")
+                continue
+            remote, local = (origen, destino) if is_remote(origen) else (destino, origen)
+            # La copia ocupa una plaza en su remoto y otra en el disco local: de escritura si descarga
+            access = "write" if local == destino else "read"
+            jobs.append({"kind": "rclone", "origen": origen, "destino": destino, "local": local,
+                         "resources": sorted({f"remote:{remote.split(':', 1)[0]}", f"{access}:{device_key(local)}"})})
+    return jobs
+
+def build_command(job, settings):
+    """Devuelve la línea de comandos del trabajo, o None si el origen no existe."""
+    origen, destino = job["origen"], job["destino"]
+    if job["kind"] == "rsync":
+        if os.path.isdir(origen):
+            paths = [origen.rstrip("/") + "/", destino.rstrip("/") + "/"]
+        elif os.path.isfile(origen):
+            paths = [origen, destino.rstrip("/") + "/"]
+        else:
+            logger.error(f"El origen '{origen}' no existe. Saltando...")
+            return None
+        os.makedirs(destino, exist_ok=True)
+        # Si otro proceso está usando alguno de los discos, la copia va a ritmo reducido
+        options = list(settings["rsync_options"])
+        bwlimit = rsync_bwlimit([origen, destino], settings["pacing"]) if settings.get("pacing") else 0
+        if bwlimit:
+            logger.info(f"[rsync] Discos de '{origen}' ocupados: copia limitada a {bwlimit} KiB/s.")
+            options.append(f"--bwlimit={bwlimit}")
+        return [*settings["ionice_prefix"], settings["rsync_bin"], *options, *paths]
+    return [*settings["ionice_prefix"], settings["rclone_bin"], "sync", origen, destino,
+            f"--config={settings['rclone_config']}", *settings["rclone_options"]]
+
+def run_job(job, settings, output_dir):
+    """Ejecuta un trabajo con reintentos y devuelve su resultado estructurado."""
+    result = {"kind": job["kind"], "origen": job["origen"], "destino": job["destino"],
+              "status": "error", "attempts": 0, "returncode": None, "duration": 0.0, "stats": {}}
+    start = time.monotonic()
+    # Con 'nofail', un disco desconectado deja su punto de montaje vacío en la tarjeta SD
+    problems = check_paths([job["origen"], job["destino"]] if job["kind"] == "rsync" else [job["local"]])
+    if problems:
+        for problem in problems:
+            logger.error(f"[{job['kind']}] '{job['origen']}' -> '{job['destino']}': {problem}")
+        result["error"] = "; ".join(problems)
+        return result
+    try:
+        command = build_command(job, settings)
+    except OSError as e:
+        logger.error(f"No se pudo preparar '{job['origen']}' -> '{job['destino']}': {e}")
+        command = None
+    if command is None:
+        result["status"] = "omitido"
+        return result
+
+    ok_codes = RSYNC_OK_CODES if job["kind"] == "rsync" else {0}
+    log_path = os.path.join(output_dir, f"{job['index']:02d}_{job['kind']}.log")
+    retries = max(1, settings["retries"])
+    for attempt in range(1, retries + 1):
+        result["attempts"] = attempt
+        logger.info(f"[{job['kind']}] Sincronizando '{job['origen']}' -> '{job['destino']}' (intento {attempt}/{retries})...")
+        with open(log_path, "a+") as log:
+            offset = log.tell()
+            try:
+                returncode = subprocess.run(command, stdout=log, stderr=subprocess.STDOUT).returncode
+            except OSError as e:
+                log.write(f"{e}\n")
+                returncode = 127
+            log.seek(offset)
+            output = log.read()
+        result["returncode"] = returncode
+        if returncode in ok_codes:
+            result["status"] = "ok"
+            parser = parse_rsync_stats if job["kind"] == "rsync" else parse_rclone_stats
+            result["stats"] = parser(output)
+            if returncode != 0:
+                logger.warning(f"[{job['kind']}] '{job['origen']}' terminó con código {returncode} (archivos desaparecidos).")
+            break
+        if attempt < retries:
+            delay = settings["backoff_seconds"] * settings["backoff_factor"] ** (attempt - 1)
+            logger.warning(
+                f"[{job['kind']}] Error {returncode} al sincronizar '{job['origen']}'. "
+                f"Reintentando en {delay:.0f} s ({attempt}/{retries})..."
+            )
+            time.sleep(delay)
+
+    result["duration"] = round(time.monotonic() - start, 2)
+    if result["status"] == "ok":
+        logger.info(f"[{job['kind']}] Sincronización completada para '{job['origen']}' en {result['duration']:.1f} s.")
+    else:
+        logger.error(f"[{job['kind']}] Sincronización fallida para '{job['origen']}' después de {result['attempts']} intentos.")
+    return result
+
+RESOURCE_LIMITS = {"remote": "per_remote", "read": "per_device_read", "write": "per_device_write"}
+
+def resource_limit(resource, settings):
+    return settings[RESOURCE_LIMITS[resource.split(":", 1)[0]]]
+
+def run_jobs(jobs, settings, output_dir):
+    """Ejecuta los trabajos en paralelo respetando los límites por disco y por remoto.
+
+    Los trabajos se lanzan en el orden de la configuración en cuanto todos sus recursos tienen plaza
+    libre, así que un trabajo bloqueado no retiene a los que van detrás.
+    """
+    in_use = {}
+    pending = list(jobs)
+    running = {}
+    results = {}
+
+    with ThreadPoolExecutor(max_workers=max(1, settings["max_workers"]), thread_name_prefix="copia") as executor:
+        while pending or running:
+            for job in list(pending):
+                if len(running) >= settings["max_workers"]:
+                    break
+                if all(in_use.get(r, 0) < resource_limit(r, settings) for r in job["resources"]):
+                    for r in job["resources"]:
+                        in_use[r] = in_use.get(r, 0) + 1
+                    running[executor.submit(run_job, job, settings, output_dir)] = job
+                    pending.remove(job)
+
+            if not running:
+                # Un trabajo cuyo límite es 0 nunca podrá ejecutarse
+                for job in pending:
+                    logger.error(f"'{job['origen']}' no se puede ejecutar: límite de concurrencia 0.")
+                break
+
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                job = running.pop(future)
+                for r in job["resources"]:
+                    in_use[r] -= 1
+                try:
+                    results[job["index"]] = future.result()
+                except Exception as e:
+                    logger.error(f"Error inesperado en '{job['origen']}': {e}")
+                    results[job["index"]] = {"kind": job["kind"], "origen": job["origen"],
+                                             "destino": job["destino"], "status": "error", "error": str(e)}
+
+    return [results[job["index"]] for job in jobs if job["index"] in results]
+
+def print_summary(results):
+    lines = [f"{'Tipo':<7} {'Estado':<8} {'Int.':>4} {'Tiempo':>8}  Origen"]
+    for r in results:
+        lines.append(f"{r['kind']:<7} {r['status']:<8} {r.get('attempts', 0):>4} {r.get('duration', 0):>8.1f}  {r['origen']}")
+    logger.info("Resumen de las copias:\n" + "\n".join(lines))
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Ejecuta en paralelo las copias de seguridad rsync y rclone.")
+    parser.add_argument("--only", choices=["rsync", "rclone"], help="Ejecuta solo un tipo de copia.")
+    parser.add_argument("--workers", type=int, help="Número máximo de copias simultáneas.")
+    parser.add_argument("--rsync-bin", help="Binario de rsync (por ejemplo, uno falso para pruebas).")
+    parser.add_argument("--rclone-bin", help="Binario de rclone (por ejemplo, uno falso para pruebas).")
+    parser.add_argument("--json", help="Ruta del resumen JSON (por defecto, en el directorio de logs).")
+    return parser.parse_args()
+
+def main():
+    args = parse_args()
+    run_id = datetime.now().strftime("%Y-%m-%d_%H-%M-%S")
+    setup_logging(run_id)
+
+    settings = dict(DEFAULTS)
+    settings.update(load_json(ORCHESTRATOR_CONFIG_FILE, required=False) or {})
+    if args.workers:
+        settings["max_workers"] = args.workers
+    if args.rsync_bin:
+        settings["rsync_bin"] = args.rsync_bin
+    if args.rclone_bin:
+        settings["rclone_bin"] = args.rclone_bin
+    settings["ionice_prefix"] = ionice_command() if settings["ionice"] else []
+    settings["pacing"] = load_pacing()
+    if not settings["pacing"]["enabled"]:
+        settings["pacing"] = None
+
+    rsync_config = load_json(RSYNC_CONFIG_FILE) if args.only in (None, "rsync") else None
+    rclone_config = load_json(RCLONE_CONFIG_FILE) if args.only in (None, "rclone") else None
+    jobs = build_jobs(rsync_config, rclone_config, args.only)
+    if not jobs:
+        logger.error("No hay copias definidas en los archivos de configuración.")
+        sys.exit(1)
+    for index, job in enumerate(jobs):
+        job["index"] = index
+
+    output_dir = os.path.join(LOG_DIR, f"backup_orchestrator_{run_id}")
+    os.makedirs(output_dir, exist_ok=True)
+    logger.info(f"Iniciando {len(jobs)} copias con hasta {settings['max_workers']} en paralelo...")
+
+    started = time.monotonic()
+    metrics.start()
+    results = run_jobs(jobs, settings, output_dir)
+    for r in results:
+        metrics.incr(f"{r['kind']}_{'ok' if r['status'] == 'ok' else 'failed'}")
+        metrics.add_span(r["kind"], r.get("duration", 0.0))
+        stats = r.get("stats", {})
+        metrics.incr("bytes_transferred", stats.get("transferred_size") or stats.get("bytes") or 0)
+    summary = {
+        "run": run_id,
+        "duration": round(time.monotonic() - started, 2),
+        "ok": sum(1 for r in results if r["status"] == "ok"),
+        "failed": sum(1 for r in results if r["status"] != "ok"),
+        "jobs": results,
+    }
+    json_path = args.json or os.path.join(LOG_DIR, f"backup_orchestrator_{run_id}.json")
+    with open(json_path, "w") as f:
+        json.dump(summary, f, indent=2, ensure_ascii=False)
+
+    metrics.finish("error" if summary["failed"] else "ok")
+    print_summary(results)
+    logger.info(f"Proceso de copia finalizado en {summary['duration']:.1f} s; resumen en '{json_path}'.")
+    sys.exit(1 if summary["failed"] else 0)
+
+if __name__ == "__main__":
+    main()
@@ -15,6 +15,10 @@ LOG_DIR="/opt/confiraspa/logs"
 LOG_FILE="$LOG_DIR/backup_rclone_simple_$(date +'%Y-%m-%d_%H-%M-%S').log"
 RCLONE_CONFIG="/home/pi/.config/rclone/rclone.conf"
 CONFIG_FILE="/opt/confiraspa/configs/backup_rclone_config.json"
+METRICS="/opt/confiraspa/lib/metrics.py"
+jobs_ok=0
+jobs_failed=0
+retries=0
 
 # Crear directorio de logs si no existe
 mkdir -p "$LOG_DIR"
@@ -26,6 +30,16 @@ log_message() {
     echo "$(date +'%Y-%m-%d %H:%M:%S') - [$level] - $message" | tee -a "$LOG_FILE"
 }
 
+# Métricas de la ejecución (logs/metrics.jsonl y textfile collector de node_exporter)
+finish_metrics() {
+    local rc=$?
+    python3 "$METRICS" finish backup_rclone --status "$rc" \
+        --counter jobs_ok="$jobs_ok" --counter jobs_failed="$jobs_failed" \
+        --counter retries="$retries" || true
+}
+python3 "$METRICS" start backup_rclone || true
+trap finish_metrics EXIT
+
 # Verificar que rclone está instalado
 if ! command -v rclone >/dev/null 2>&1; then
     log_message "ERROR" "'rclone' no está instalado. Por favor, instálalo antes de ejecutar este script."
@@ -88,16 +102,20 @@ for task in "${tasks[@]}"; do
         else
             log_message "WARN" "Error al sincronizar '$origen' hacia '$destino'. Reintentando ($((retry_count+1))/$max_retries)..."
             retry_count=$((retry_count+1))
+            retries=$((retries+1))
             sleep 5  # Espera 5 segundos antes del siguiente intento
         fi
     done
 
     if [ "$success" = true ]; then
         log_message "INFO" "Sincronización completada para '$origen' hacia '$destino'."
+        jobs_ok=$((jobs_ok+1))
     else
         log_message "ERROR" "Sincronización fallida para '$origen' hacia '$destino' después de $max_retries intentos."
+        jobs_failed=$((jobs_failed+1))
     fi
 done
 
 # Fin del proceso
-log_message "INFO" "Proceso de copia de seguridad con rclone finalizado."
+log_message "INFO" "Proceso de copia de seguridad con rclone finalizado: $jobs_ok correctas, $jobs_failed con error."
+[ "$jobs_failed" -eq 0 ]
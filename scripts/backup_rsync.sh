@@ -14,8 +14,13 @@ set -euo pipefail
 # Variables
 SCRIPT_DIR="$(cd "$(dirname "$0")" && pwd)"
 CONFIG_FILE="/opt/confiraspa/configs/backup_rsync_config.json"  # Asegúrate de que esta ruta es correcta
-LOG_DIR="$SCRIPT_DIR/logs"
+LOG_DIR="/opt/confiraspa/logs"
 LOG_FILE="$LOG_DIR/backup_rsync_$(date +'%Y-%m-%d_%H-%M-%S').log"
+METRICS="/opt/confiraspa/lib/metrics.py"
+PREFLIGHT="/opt/confiraspa/lib/preflight.py"
+jobs_ok=0
+jobs_failed=0
+jobs_skipped=0
 
 # Crear directorio de logs si no existe
 mkdir -p "$LOG_DIR"
@@ -27,6 +32,16 @@ log_message() {
     echo "$(date +'%Y-%m-%d %H:%M:%S') - [$level] - $message" | tee -a "$LOG_FILE"
 }
 
+# Métricas de la ejecución (logs/metrics.jsonl y textfile collector de node_exporter)
+finish_metrics() {
+    local rc=$?
+    python3 "$METRICS" finish backup_rsync --status "$rc" \
+        --counter jobs_ok="$jobs_ok" --counter jobs_failed="$jobs_failed" \
+        --counter jobs_skipped="$jobs_skipped" || true
+}
+python3 "$METRICS" start backup_rsync || true
+trap finish_metrics EXIT
+
 # Verificar que rsync está instalado
 if ! command -v rsync >/dev/null 2>&1; then
     log_message "ERROR" "'rsync' no está instalado. Por favor, instálalo antes de ejecutar este script."
@@ -39,6 +54,12 @@ if ! command -v jq >/dev/null 2>&1; then
     exit 1
 fi
 
+# rsync en la clase 'idle' de ionice: solo usa los discos cuando nadie más los necesita
+IONICE=""
+if command -v ionice >/dev/null 2>&1; then
+    IONICE="ionice -c 3"
+fi
+
 # Comenzar
 log_message "INFO" "Iniciando el proceso de copia de seguridad con rsync..."
 
@@ -58,7 +79,8 @@ fi
 #log_message "DEBUG" "Archivo de configuración: '$CONFIG_FILE'"
 
 # Procesar cada entrada en el array 'directorios' en el archivo de configuración JSON
-jq -c '.directorios[]' "$CONFIG_FILE" | while read -r entry; do
+# (sin tubería, para que los contadores no se pierdan en una subshell)
+while read -r entry; do
     # Imprimir la entrada JSON para depuración
     #log_message "DEBUG" "Entrada JSON: '$entry'"
 
@@ -75,15 +97,24 @@ jq -c '.directorios[]' "$CONFIG_FILE" | while read -r entry; do
         tipo="archivo"
     else
         log_message "ERROR" "El origen '$origen' no existe. Saltando..."
+        jobs_skipped=$((jobs_skipped + 1))
+        continue
+    fi
+
+    # Con 'nofail', un disco desconectado deja su punto de montaje vacío en la tarjeta SD:
+    # sin esta comprobación se crearía ahí el destino (o se borraría con --delete lo que falta en el origen)
+    if ! problems=$(python3 "$PREFLIGHT" check "$origen" "$destino" 2>&1); then
+        log_message "ERROR" "$problems Saltando..."
+        jobs_failed=$((jobs_failed + 1))
         continue
     fi
 
     # Crear el directorio de destino si no existe
     if [ ! -d "$destino" ]; then
         log_message "INFO" "El directorio de destino '$destino' no existe. Creando..."
-        mkdir -p "$destino"
-        if [ $? -ne 0 ]; then
+        if ! mkdir -p "$destino"; then
             log_message "ERROR" "No se pudo crear el directorio de destino '$destino'. Saltando..."
+            jobs_skipped=$((jobs_skipped + 1))
             continue
         fi
     fi
@@ -91,20 +122,29 @@ jq -c '.directorios[]' "$CONFIG_FILE" | while read -r entry; do
     # Ejecutar rsync dependiendo del tipo
     log_message "INFO" "Sincronizando '$origen' con '$destino' como $tipo..."
     rsync_options="-avh --delete --stats"
+    # Si otro proceso (Plex, Transmission) está usando los discos, la copia va a ritmo reducido
+    bwlimit=$(python3 "$PREFLIGHT" bwlimit "$origen" "$destino" 2>/dev/null || echo 0)
+    if [ "${bwlimit:-0}" -gt 0 ]; then
+        log_message "INFO" "Discos ocupados: copia limitada a $bwlimit KiB/s."
+        rsync_options="$rsync_options --bwlimit=$bwlimit"
+    fi
 
     if [ "$tipo" == "directorio" ]; then
-        rsync $rsync_options "$origen"/ "$destino"/ >> "$LOG_FILE" 2>&1
-    elif [ "$tipo" == "archivo" ]; then
-        rsync $rsync_options "$origen" "$destino"/ >> "$LOG_FILE" 2>&1
+        src="$origen"/
+    else
+        src="$origen"
     fi
 
-    # Verificar si rsync tuvo éxito
-    if [ $? -eq 0 ]; then
+    # Verificar si rsync tuvo éxito (con 'set -e', un fallo fuera del 'if' terminaría el script)
+    if $IONICE rsync $rsync_options "$src" "$destino"/ >> "$LOG_FILE" 2>&1; then
         log_message "INFO" "Sincronización completada para '$origen' con '$destino'."
+        jobs_ok=$((jobs_ok + 1))
     else
         log_message "ERROR" "Error al sincronizar '$origen' con '$destino'."
+        jobs_failed=$((jobs_failed + 1))
     fi
 
-done
+done < <(jq -c '.directorios[]' "$CONFIG_FILE")
 
-log_message "INFO" "Proceso de copia de seguridad con rsync finalizado."
+log_message "INFO" "Proceso de copia de seguridad con rsync finalizado: $jobs_ok correctas, $jobs_failed con error, $jobs_skipped omitidas."
+[ "$jobs_failed" -eq 0 ]
@@ -0,0 +1,263 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Script Name: change_permissions.py
+Description: Ajusta la propiedad y los permisos de los directorios de 'change_permissions_config.json'
+             cambiando solo las entradas que no los tienen ya (sustituye a change_permissions.sh).
+Version: 2.0.0
+License: GNU
+Usage: python3 change_permissions.py [--full] [--dry-run]
+Notes:
+    - A diferencia de 'chown -R' y 'chmod -R', solo se llama a chown/chmod cuando el uid, el gid o
+      el modo difieren, así que una pasada sin cambios no escribe metadatos ni altera el ctime (que
+      rsync y rclone usan para detectar cambios).
+    - Claves de la configuración:
+          "usuario": "pi",                  propietario (y grupo si no se indica "grupo")
+          "grupo": "pi",                    opcional
+          "permisos": "777",                modo para archivos y directorios
+          "permisos_archivos": "664",       opcional, sustituye a "permisos" en archivos
+          "permisos_directorios": "775",    opcional, sustituye a "permisos" en directorios
+          "full_every_runs": 24,            opcional, pasadas incrementales entre dos completas
+          "directorios": [...]
+    - Marca de agua: se guarda en 'data/change_permissions_state.json' el inicio de la última pasada
+      de cada directorio raíz. Los archivos de un directorio cuyo mtime y ctime no han cambiado desde
+      entonces (no se ha creado, borrado ni renombrado nada en él) no se examinan; los subdirectorios
+      se recorren siempre, porque un cambio en ellos no altera el mtime del padre. Se usa también el
+      ctime porque un directorio movido a una biblioteca (importación de Sonarr/Radarr, 'mv') o
+      copiado con rsync -a, unzip o 'cp -a' conserva un mtime antiguo, pero su ctime se actualiza y
+      no se puede fijar hacia atrás.
+    - Un cambio de permisos hecho a mano sobre un archivo existente no cambia el directorio; '--full'
+      revisa todo. También se hace una pasada completa si cambia la configuración y, cada
+      "full_every_runs" pasadas incrementales (24 por defecto: una vez al día con la tarea horaria).
+    - Los enlaces simbólicos no se siguen ni se modifican.
+"""
+
+import os
+import sys
+import grp
+import pwd
+import json
+import stat
+import time
+import logging
+import argparse
+
+INSTALL_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+CONFIG_DIR = os.path.join(INSTALL_DIR, "configs")
+DATA_DIR = os.path.join(INSTALL_DIR, "data")
+LOG_DIR = os.path.join(INSTALL_DIR, "logs")
+CONFIG_FILE = os.path.join(CONFIG_DIR, "change_permissions_config.json")
+STATE_FILE = os.path.join(DATA_DIR, "change_permissions_state.json")
+sys.path.insert(0, os.path.join(INSTALL_DIR, "lib"))
+
+from metrics import RunMetrics
+
+DEFAULT_PERMISSIONS = "755"
+# Margen para la granularidad del mtime y para los cambios durante la propia pasada
+HIGH_WATER_MARGIN_NS = 2 * 10**9
+# Pasadas incrementales seguidas antes de forzar una completa
+DEFAULT_FULL_EVERY_RUNS = 24
+
+os.makedirs(LOG_DIR, exist_ok=True)
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s [%(levelname)s] [%(filename)s]: %(message)s',
+    handlers=[
+        logging.FileHandler(os.path.join(LOG_DIR, "change_permissions.log")),
+        logging.StreamHandler()
+    ]
+)
+logger = logging.getLogger(__name__)
+metrics = RunMetrics("change_permissions")
+
+def load_config(config_file):
+    try:
+        with open(config_file, "r") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        logger.error(f"Archivo de configuración '{config_file}' no encontrado.")
+    except json.JSONDecodeError as e:
+        logger.error(f"El archivo de configuración '{config_file}' no es un JSON válido: {e}")
+    return None
+
+def load_state(state_file):
+    try:
+        with open(state_file, "r") as f:
+            return json.load(f)
+    except (OSError, json.JSONDecodeError):
+        return {}
+
+def save_state(state_file, state):
+    os.makedirs(os.path.dirname(state_file), exist_ok=True)
+    tmp_path = f"{state_file}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(state, f, indent=2, ensure_ascii=False)
+    os.replace(tmp_path, state_file)
+
+def resolve_target(config):
+    """Devuelve {'uid', 'gid', 'file_mode', 'dir_mode'} a partir de la configuración."""
+    user = config.get("usuario")
+    if not user:
+        raise ValueError("El usuario no está especificado en el archivo de configuración.")
+    group = config.get("grupo") or user
+    permissions = config.get("permisos") or DEFAULT_PERMISSIONS
+    return {
+        "uid": pwd.getpwnam(user).pw_uid,
+        "gid": grp.getgrnam(group).gr_gid,
+        "file_mode": int(config.get("permisos_archivos") or permissions, 8),
+        "dir_mode": int(config.get("permisos_directorios") or permissions, 8),
+    }
+
+def changed_ns(st):
+    """Último cambio de un directorio: el mayor de mtime y ctime."""
+    return max(st.st_mtime_ns, st.st_ctime_ns)
+
+class PermissionFixer:
+    """Recorre un árbol con os.scandir corrigiendo solo lo que difiere del objetivo."""
+
+    def __init__(self, target, dry_run=False):
+        self.target = target
+        self.dry_run = dry_run
+        self.stats = {"dirs": 0, "dirs_skipped": 0, "files": 0, "chown": 0, "chmod": 0, "errors": 0}
+
+    def fix(self, path, st, mode):
+        """Ajusta propietario y modo de una entrada si no coinciden."""
+        uid, gid = self.target["uid"], self.target["gid"]
+        try:
+            if st.st_uid != uid or st.st_gid != gid:
+                if not self.dry_run:
+                    os.chown(path, uid, gid, follow_symlinks=False)
+                self.stats["chown"] += 1
+                logger.debug(f"chown {uid}:{gid} '{path}'")
+            if stat.S_IMODE(st.st_mode) != mode:
+                if not self.dry_run:
+                    os.chmod(path, mode)
+                self.stats["chmod"] += 1
+                logger.debug(f"chmod {mode:o} '{path}'")
+        except OSError as e:
+            self.stats["errors"] += 1
+            logger.error(f"No se pudo ajustar '{path}': {e}")
+
+    def walk(self, root, high_water_ns=None):
+        """Recorre 'root'. Con 'high_water_ns' omite los archivos de directorios sin cambios."""
+        try:
+            root_stat = os.stat(root, follow_symlinks=False)
+        except OSError as e:
+            self.stats["errors"] += 1
+            logger.error(f"No se pudo acceder a '{root}': {e}")
+            return
+        if stat.S_ISDIR(root_stat.st_mode):
+            self.fix(root, root_stat, self.target["dir_mode"])
+            stack = [(root, changed_ns(root_stat))]
+        else:
+            self.stats["files"] += 1
+            self.fix(root, root_stat, self.target["file_mode"])
+            return
+
+        while stack:
+            directory, changed = stack.pop()
+            self.stats["dirs"] += 1
+            check_files = high_water_ns is None or changed > high_water_ns
+            if not check_files:
+                self.stats["dirs_skipped"] += 1
+            try:
+                with os.scandir(directory) as it:
+                    for entry in it:
+                        try:
+                            if entry.is_symlink():
+                                continue
+                            if entry.is_dir(follow_symlinks=False):
+                                st = entry.stat(follow_symlinks=False)
+                                self.fix(entry.path, st, self.target["dir_mode"])
+                                stack.append((entry.path, changed_ns(st)))
+                            elif check_files:
+                                self.stats["files"] += 1
+                                self.fix(entry.path, entry.stat(follow_symlinks=False), self.target["file_mode"])
+                        except OSError as e:
+                            self.stats["errors"] += 1
+                            logger.error(f"No se pudo examinar '{entry.path}': {e}")
+            except OSError as e:
+                self.stats["errors"] += 1
+                logger.error(f"No se pudo leer el directorio '{directory}': {e}")
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Ajusta propietario y permisos solo donde difieren.")
+    parser.add_argument("--full", action="store_true",
+                        help="Revisa todos los archivos, ignorando la marca de agua de la pasada anterior.")
+    parser.add_argument("--dry-run", action="store_true", help="Solo cuenta lo que se cambiaría.")
+    parser.add_argument("--state-file", default=STATE_FILE, help="Archivo con las marcas de agua.")
+    return parser.parse_args()
+
+def main():
+    args = parse_args()
+    if args.dry_run:
+        run(args)
+    else:
+        with metrics:
+            run(args)
+
+def run(args):
+    if os.geteuid() != 0 and not args.dry_run:
+        logger.error("Este script debe ejecutarse con privilegios de superusuario (sudo).")
+        sys.exit(1)
+
+    config = load_config(CONFIG_FILE)
+    if config is None:
+        sys.exit(1)
+    directories = config.get("directorios") or []
+    if not directories:
+        logger.error("No se han especificado directorios en el archivo de configuración.")
+        sys.exit(1)
+    try:
+        target = resolve_target(config)
+    except (ValueError, KeyError) as e:
+        logger.error(f"Configuración no válida: {e}")
+        sys.exit(1)
+
+    # La marca de agua solo vale para la misma configuración
+    signature = f"{target['uid']}:{target['gid']}:{target['file_mode']:o}:{target['dir_mode']:o}"
+    state = load_state(args.state_file)
+    full_every = int(config.get("full_every_runs", DEFAULT_FULL_EVERY_RUNS))
+    logger.info(
+        f"Usuario: {config['usuario']} (uid {target['uid']}, gid {target['gid']}); "
+        f"archivos {target['file_mode']:o}, directorios {target['dir_mode']:o}."
+    )
+
+    for directory in directories:
+        if not os.path.lexists(directory):
+            logger.error(f"El directorio '{directory}' no existe. Saltando...")
+            continue
+        previous = state.get(directory, {})
+        high_water_ns = None
+        incremental_runs = previous.get("incremental_runs", 0)
+        if not args.full and previous.get("signature") == signature and incremental_runs < full_every:
+            high_water_ns = previous.get("started_ns", 0) - HIGH_WATER_MARGIN_NS
+
+        started_ns = time.time_ns()
+        start = time.monotonic()
+        fixer = PermissionFixer(target, args.dry_run)
+        with metrics.span("walk"):
+            fixer.walk(directory, high_water_ns)
+        s = fixer.stats
+        for key, value in s.items():
+            metrics.incr(key, value)
+        if s["errors"]:
+            metrics.status = "error"
+        logger.info(
+            f"'{directory}' ({'completo' if high_water_ns is None else 'incremental'}): "
+            f"{s['dirs']} directorios ({s['dirs_skipped']} sin cambios), {s['files']} archivos revisados, "
+            f"{s['chown']} chown, {s['chmod']} chmod, {s['errors']} errores en {time.monotonic() - start:.1f} s."
+        )
+        if not args.dry_run and s["errors"] == 0:
+            state[directory] = {
+                "started_ns": started_ns,
+                "signature": signature,
+                "incremental_runs": 0 if high_water_ns is None else incremental_runs + 1,
+            }
+
+    if not args.dry_run:
+        save_state(args.state_file, state)
+    logger.info("Proceso completado.")
+
+if __name__ == "__main__":
+    main()
@@ -1,7 +1,8 @@
 #!/bin/bash
 ### Descripción: Configura tareas programadas (cron jobs) para root de forma segura e idempotente
 ###              basándose en un archivo JSON, con soporte para intérpretes específicos.
-### Versión: 2.1.0 (Añadido soporte para campo 'interpreter' en JSON)
+### Versión: 2.3.0 (Los jobs se lanzan a través de job_runner.py: bloqueos y espera por carga;
+###                 se eliminan las entradas de jobs que ya no están en el JSON)
 
 #~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
 # Carga de biblioteca de utilidades y configuración inicial
@@ -19,6 +20,9 @@ source "/opt/confiraspa/lib/utils.sh" || {
 declare -r CONFIG_FILE="${CONFIG_DIR}/scripts_and_crontab.json"
 declare -r SCRIPTS_BASE_DIR="${INSTALL_DIR}/scripts"
 declare -r CRON_JOB_TAG="# Confiraspa Job"
+# Lanzador con bloqueos por job y por disco (ver job_runner.py). Un job con "runner": false se lanza directamente.
+declare -r RUNNER_SCRIPT="${SCRIPTS_BASE_DIR}/job_runner.py"
+declare -r RUNNER_INTERPRETER="/usr/bin/python3"
 
 #~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
 # Funciones Auxiliares (validate_cron_schedule, check_exact_cron_entry - sin cambios)
@@ -45,7 +49,7 @@ main() {
     install_dependencies "jq" || exit 1
     # setup_paths || exit 1 # Descomentar si no se llama desde utils.sh
 
-    log "INFO" "== Iniciando configuración de Crontab v2.1.0 para root desde ${CONFIG_FILE} =="
+    log "INFO" "== Iniciando configuración de Crontab v2.3.0 para root desde ${CONFIG_FILE} =="
 
     if [[ ! -f "$CONFIG_FILE" ]]; then log "ERROR" "Archivo config no encontrado: ${CONFIG_FILE}"; exit 1; fi
 
@@ -64,8 +68,8 @@ main() {
     fi
 
     # --- Procesar JSON ---
-    local jobs_json added_jobs skipped_jobs failed_jobs total_jobs
-    added_jobs=0; skipped_jobs=0; failed_jobs=0; total_jobs=0
+    local jobs_json added_jobs skipped_jobs failed_jobs total_jobs removed_jobs
+    added_jobs=0; skipped_jobs=0; failed_jobs=0; total_jobs=0; removed_jobs=0
 
     # Validar que el archivo contiene un array JSON antes de procesar
     log "DEBUG" "Validando si ${CONFIG_FILE} contiene un array JSON..."
@@ -93,6 +97,7 @@ main() {
         script_name=$(jq -re '.script // empty' <<< "$job") || { log "WARN" "Job ${total_jobs}: Error parseando 'script'. Skipping."; ((skipped_jobs++)); continue; }
         schedule=$(jq -re '.schedule // empty' <<< "$job") || { log "WARN" "Job ${total_jobs} ('${script_name}'): Error parseando 'schedule'. Skipping."; ((skipped_jobs++)); continue; }
         interpreter=$(jq -re '.interpreter // empty' <<< "$job") || { log "WARN" "Job ${total_jobs} ('${script_name}'): Error parseando 'interpreter'. Asumiendo null/directo."; interpreter=""; } # Default a vacío si falla parseo
+        use_runner=$(jq -r 'if .runner == false then "false" else "true" end' <<< "$job")
 
         if [[ -z "$script_name" || -z "$schedule" ]]; then
             log "WARN" "Job ${total_jobs}: 'script' o 'schedule' vacíos en JSON. Skipping."
@@ -135,6 +140,15 @@ main() {
             fi
         fi
 
+        # Lanzar a través de job_runner.py (que lee intérprete y argumentos del mismo JSON)
+        if [[ "$use_runner" == "true" ]]; then
+            if [[ ! -r "$RUNNER_SCRIPT" || ! -x "$RUNNER_INTERPRETER" ]]; then
+                log "WARN" "Job '${script_name}': No se encuentra '${RUNNER_SCRIPT}' o '${RUNNER_INTERPRETER}'. Skipping."
+                ((skipped_jobs++)); continue
+            fi
+            command_to_run="${RUNNER_INTERPRETER} ${RUNNER_SCRIPT} run ${script_name}"
+        fi
+
         # Validar el schedule
         if ! validate_cron_schedule "$schedule"; then
             log "WARN" "Job '${script_name}': Schedule inválido. Skipping."
@@ -151,6 +165,12 @@ main() {
             ((skipped_jobs++)); continue
         fi
 
+        # --- Sustituir entradas anteriores del mismo job (otro horario o lanzadas sin job_runner.py) ---
+        if grep -Fq -- " ${cron_comment}" <<< "$new_crontab_content"; then
+            log "INFO" "Job '${script_name}': Sustituyendo la entrada anterior."
+            new_crontab_content=$(grep -Fv -- " ${cron_comment}" <<< "$new_crontab_content" || true)
+        fi
+
         # --- Preparar para Añadir ---
         log "INFO" "Job '${script_name}': Preparando para añadir entrada: ${schedule} $(basename "${command_to_run}")"
         if [[ -n "$new_crontab_content" && "${new_crontab_content: -1}" != $'\n' ]]; then new_crontab_content+=$'\n'; fi
@@ -160,6 +180,27 @@ main() {
 
     done <<< "$jobs_json"
 
+    # --- Eliminar entradas de jobs retirados del JSON (p. ej. backup_rsync.sh o change_permissions.sh) ---
+    # Si no, seguirían ejecutándose junto a los scripts que los sustituyen.
+    local listed_scripts cleaned_content="" line tagged_script
+    listed_scripts=$(jq -r '.[].script // empty' "$CONFIG_FILE")
+    if [[ -n "$new_crontab_content" ]]; then
+        while IFS= read -r line; do
+            if [[ "$line" == *" ${CRON_JOB_TAG} ("*")" ]]; then
+                tagged_script="${line##*" ${CRON_JOB_TAG} ("}"
+                tagged_script="${tagged_script%)}"
+                if ! grep -Fxq -- "$tagged_script" <<< "$listed_scripts"; then
+                    log "INFO" "Job '${tagged_script}': ya no está en ${CONFIG_FILE}. Eliminando su entrada: ${line}"
+                    ((++removed_jobs))
+                    modified=1
+                    continue
+                fi
+            fi
+            cleaned_content+="${line}"$'\n'
+        done <<< "${new_crontab_content%$'\n'}"
+        new_crontab_content="$cleaned_content"
+    fi
+
     # --- Cargar Nuevo Crontab ---
     if [[ "$modified" -eq 1 ]]; then
         log "INFO" "Se detectaron cambios. Cargando nuevo crontab..."
@@ -179,6 +220,7 @@ main() {
     log "INFO" "Total Jobs Definidos JSON : ${total_jobs}"
     log "INFO" "Jobs Añadidos Nuevos    : ${added_jobs}"
     log "INFO" "Jobs Skipped/Existentes : ${skipped_jobs}"
+    log "INFO" "Jobs Retirados Eliminados: ${removed_jobs}"
     [[ "$failed_jobs" -gt 0 ]] && log "ERROR" "Jobs Fallidos (Error Crítico): ${failed_jobs}"
     log "INFO" "========================================="
     log "INFO" "Verificar crontab: sudo crontab -l"
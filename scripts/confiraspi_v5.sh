@@ -125,7 +125,6 @@ main() {
         "install_amule.sh"
         "configure_crontab.sh"
         "install_rclone.sh"
-        "setup_logrotate_from_json.sh"
     )
 
     log "INFO" "Iniciando configuración de la Raspberry Pi..."
@@ -11,97 +11,1264 @@ License: MIT License
 Usage: Ejecutar el script manualmente o programarlo con cron para ejecución automática.
 Dependencies:
     - Python 3.x
-    - Módulos estándar de Python: os, json, hashlib, logging, shutil, pathlib
+    - Módulos estándar de Python: os, json, hashlib, logging, shutil, pathlib, sqlite3, argparse
 
 Notes:
-    - Asegúrate de que el archivo 'directories.json' esté en el mismo directorio que este script y que contenga las rutas correctas.
+    - Asegúrate de que el archivo 'directories.json' esté en 'configs/' dentro del directorio de instalación y que contenga las rutas correctas.
     - El script utiliza hashing SHA256 para comparar archivos y garantizar que son idénticos.
+    - La comparación es progresiva: tamaño, huella rápida (bloques inicial, central y final) y, solo
+      para los candidatos que superan la huella, SHA256 completo. La verificación completa se puede
+      desactivar con "full_hash_verification": false en 'directories.json'.
+    - Antes de leer contenido se comprueban los metadatos: un hardlink (mismo st_dev y st_ino) o
+      una copia reflink (mismas extensiones físicas según FIEMAP) coinciden sin leer ningún byte.
+    - Las descargas se comparan en paralelo con un pool de hilos ("hash_workers" en 'directories.json')
+      limitando las lecturas simultáneas por disco físico ("hash_workers_per_device"). Los borrados
+      se siguen haciendo de uno en uno desde el hilo principal.
+    - Con '--daemon' el script queda residente y vigila con inotify el directorio de descargas y las
+      bibliotecas, comparando solo los archivos nuevos o movidos poco después de que las apps *arr
+      los importen. Un diario ('data/downloadclean_journal.json') guarda la cola pendiente y el último
+      punto de control para que, al arrancar, una pasada de metadatos recupere los eventos perdidos.
+      Cada escritura en una descarga (IN_MODIFY) reinicia su espera: un archivo que el cliente de
+      torrent mantiene abierto no se compara hasta que lleva '--settle-seconds' sin cambiar.
+      Si se usa este modo, conviene quitar la tarea de cron de 'scripts_and_crontab.json'.
+    - Los hashes se guardan en un índice SQLite ('data/hash_index.db') indexado por
+      (dispositivo, inodo, tamaño, mtime_ns); los archivos que no han cambiado no se vuelven a leer.
+      Usa '--rebuild-index' para vaciar el índice y reconstruirlo en frío.
+    - Descargas y bibliotecas se recorren con 'lib/fswalk.py': solo se llama a stat() para los archivos
+      con extensión multimedia. "scan_workers" en 'directories.json' reparte los subdirectorios de primer
+      nivel de las bibliotecas entre varios hilos (por defecto 1).
+    - Antes de empezar se comprueba con 'lib/preflight.py' que los discos de las descargas y las
+      bibliotecas están montados. Las lecturas para comparar usan la clase 'idle' de ionice y bajan
+      de ritmo mientras otro proceso (Plex) usa el mismo disco ("io_pacing" en 'puntos_de_montaje.json').
+    - El borrado se hace en dos fases: primero se compara todo y se construye un plan (descargas
+      coincidentes agrupadas por directorio, con sus archivos asociados encontrados en una sola lectura
+      de cada directorio) y después se ejecuta por lotes. Solo se limpian los directorios vacíos que
+      el plan ha tocado. Con '--plan plan.json' se genera el plan para revisarlo sin borrar nada y
+      con '--execute-plan plan.json' se ejecuta más tarde; cada descarga se vuelve a comprobar
+      (tamaño, mtime e inodo) y se omite si ha cambiado.
+    - Con '--dedup' se buscan duplicados dentro de las bibliotecas y entre ellas: una pasada cuenta los
+      tamaños, otra guarda solo las rutas de los tamaños repetidos y después se comparan huella y
+      SHA256 (usando el índice de hashes). El informe ('--report', JSON o CSV) indica los bytes
+      recuperables y '--hardlink' sustituye los duplicados del mismo disco por hardlinks.
 """
 
 import os
+import sys
 import json
+import signal
+import time
+import fcntl
+import struct
 import hashlib
 import logging
+import sqlite3
+import argparse
+import threading
 import shutil
+import csv
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from contextlib import contextmanager
+from datetime import datetime
 from pathlib import Path
 
+INSTALL_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+CONFIG_DIR = os.path.join(INSTALL_DIR, "configs")
+DATA_DIR = os.path.join(INSTALL_DIR, "data")
+LOG_DIR = os.path.join(INSTALL_DIR, "logs")
+sys.path.insert(0, os.path.join(INSTALL_DIR, "lib"))
+
+from metrics import RunMetrics
+from fswalk import walk, walk_files
+from preflight import check_paths, IOPacer, load_pacing, set_idle_priority
+
+HASH_INDEX_FILE = os.path.join(DATA_DIR, "hash_index.db")
+# Las entradas que no se consultan durante este número de días se consideran obsoletas
+HASH_INDEX_MAX_AGE_DAYS = 30
+# Tamaño de cada uno de los bloques (inicio, centro y final) que forman la huella rápida
+FINGERPRINT_BLOCK_SIZE = 64 * 1024
+
+# Constantes de la ioctl FS_IOC_FIEMAP (linux/fiemap.h) para detectar copias reflink
+FS_IOC_FIEMAP = 0xC020660B
+FIEMAP_FLAG_SYNC = 0x1
+FIEMAP_HEADER = struct.Struct("=QQIIII")
+FIEMAP_EXTENT = struct.Struct("=QQQQQI12x")
+FIEMAP_EXTENT_LAST = 0x1
+# Extensiones cuya posición física no es fiable para comparar (desconocidas, diferidas, inline, cifradas)
+FIEMAP_EXTENT_UNRELIABLE = 0x2 | 0x4 | 0x8 | 0x80 | 0x200
+FIEMAP_MAX_EXTENTS = 64
+
+# Concurrencia por defecto de la comparación de archivos
+DEFAULT_HASH_WORKERS = 4
+DEFAULT_HASH_WORKERS_PER_DEVICE = 1
+# Hilos para recorrer las bibliotecas (por subdirectorio de primer nivel)
+DEFAULT_SCAN_WORKERS = 1
+# Descargas que se borran en cada lote al ejecutar el plan
+DEFAULT_BATCH_SIZE = 50
+# Con --dedup no se comparan archivos más pequeños (carátulas, pistas sueltas...)
+DEDUP_MIN_SIZE = 1024 * 1024
+
+# Extensiones de archivos multimedia
+MEDIA_EXTENSIONS = ['.mp4', '.mkv', '.avi', '.mp3', '.flac', '.epub', '.pdf', '.cbr', '.cbz']
+# Archivos asociados a una descarga (información, subtítulos, carátulas) y separadores tras el nombre base
+SIDECAR_EXTENSIONS = {'.nfo', '.srt', '.sub', '.idx', '.txt', '.jpg', '.jpeg', '.png'}
+SIDECAR_SEPARATORS = ".-_ "
+
+# Modo residente (inotify)
+JOURNAL_FILE = os.path.join(DATA_DIR, "downloadclean_journal.json")
+DAEMON_SETTLE_SECONDS = 60
+
 # Configurar el logger
+os.makedirs(LOG_DIR, exist_ok=True)
 logging.basicConfig(
     format='%(asctime)s %(levelname)s: %(message)s',
     level=logging.INFO,
     handlers=[
         logging.StreamHandler(),  # Muestra los mensajes en la consola
-        logging.FileHandler('downloadclean.py')  # Guarda los mensajes en un archivo de log
+        logging.FileHandler(os.path.join(LOG_DIR, "downloadclean.log"))  # Guarda los mensajes en un archivo de log
     ]
 )
 
 logger = logging.getLogger(__name__)
 
-def get_file_hash(file_path):
-    """Calcula y devuelve el hash SHA256 de un archivo."""
-    hasher = hashlib.sha256()
+# Contadores y tiempos por fase de la ejecución ('logs/metrics.jsonl' y textfile de node_exporter)
+metrics = RunMetrics("downloadclean")
+
+# El índice SQLite se comparte entre los hilos de comparación
+_index_lock = threading.Lock()
+
+class DeviceThrottle:
+    """Limita el número de lecturas simultáneas por dispositivo (st_dev) y, con 'pacer', su ritmo."""
+
+    def __init__(self, per_device, pacer=None):
+        self.per_device = max(1, per_device)
+        self.pacer = pacer
+        self._semaphores = {}
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def slot(self, dev):
+        with self._lock:
+            semaphore = self._semaphores.setdefault(dev, threading.BoundedSemaphore(self.per_device))
+        with semaphore:
+            yield
+
+    def consume(self, dev, nbytes):
+        """Anota una lectura; si el disco está atendiendo a otros procesos, espera."""
+        if self.pacer is not None:
+            self.pacer.consume(dev, nbytes)
+
+def make_throttle(config):
+    """Limitador de lecturas con los valores de 'directories.json' y el ritmo de 'puntos_de_montaje.json'."""
+    return DeviceThrottle(int(config.get("hash_workers_per_device", DEFAULT_HASH_WORKERS_PER_DEVICE)),
+                          IOPacer(load_pacing()))
+
+@contextmanager
+def _read_slot(throttle, dev):
+    """Reserva un hueco de lectura en el dispositivo si hay limitador."""
+    if throttle is None or dev is None:
+        yield
+    else:
+        with throttle.slot(dev):
+            yield
+
+def open_hash_index(db_path, rebuild=False):
+    """Abre (o crea) el índice persistente de hashes. Devuelve None si no es posible."""
+    try:
+        os.makedirs(os.path.dirname(db_path), exist_ok=True)
+        conn = sqlite3.connect(db_path, check_same_thread=False)
+        conn.execute(
+            """CREATE TABLE IF NOT EXISTS file_hashes (
+                   dev INTEGER NOT NULL,
+                   ino INTEGER NOT NULL,
+                   size INTEGER NOT NULL,
+                   mtime_ns INTEGER NOT NULL,
+                   path TEXT NOT NULL,
+                   digest TEXT NOT NULL,
+                   last_seen INTEGER NOT NULL,
+                   PRIMARY KEY (dev, ino, size, mtime_ns)
+               )"""
+        )
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_file_hashes_path ON file_hashes (path)")
+        if rebuild:
+            conn.execute("DELETE FROM file_hashes")
+            logger.info(f"Índice de hashes '{db_path}' vaciado para reconstrucción en frío.")
+        conn.commit()
+        return conn
+    except sqlite3.Error as e:
+        logger.error(f"No se pudo abrir el índice de hashes '{db_path}': {e}. Se calcularán todos los hashes.")
+        return None
+
+def _index_key(st):
+    """Clave del índice para un resultado de os.stat()."""
+    return (st.st_dev, st.st_ino, st.st_size, st.st_mtime_ns)
+
+def lookup_hash(index, st):
+    """Devuelve el hash guardado para un archivo sin cambios, o None."""
+    row = index.execute(
+        "SELECT digest FROM file_hashes WHERE dev = ? AND ino = ? AND size = ? AND mtime_ns = ?",
+        _index_key(st)
+    ).fetchone()
+    if row:
+        index.execute(
+            "UPDATE file_hashes SET last_seen = ? WHERE dev = ? AND ino = ? AND size = ? AND mtime_ns = ?",
+            (int(time.time()),) + _index_key(st)
+        )
+        return row[0]
+    return None
+
+def store_hash(index, file_path, st, digest):
+    """Guarda el hash de un archivo, sustituyendo entradas antiguas de la misma ruta."""
+    index.execute("DELETE FROM file_hashes WHERE path = ?", (file_path,))
+    index.execute(
+        "INSERT OR REPLACE INTO file_hashes (dev, ino, size, mtime_ns, path, digest, last_seen) "
+        "VALUES (?, ?, ?, ?, ?, ?, ?)",
+        _index_key(st) + (file_path, digest, int(time.time()))
+    )
+
+def prune_hash_index(index, max_age_days=HASH_INDEX_MAX_AGE_DAYS):
+    """Elimina del índice las entradas que no se han usado en 'max_age_days' días."""
+    cutoff = int(time.time()) - max_age_days * 86400
     try:
-        with open(file_path, 'rb') as f:
+        removed = index.execute("DELETE FROM file_hashes WHERE last_seen < ?", (cutoff,)).rowcount
+        index.commit()
+        if removed:
+            logger.info(f"Eliminadas {removed} entradas obsoletas del índice de hashes.")
+    except sqlite3.Error as e:
+        logger.error(f"Error al depurar el índice de hashes: {e}")
+
+def get_file_hash(file_path, index=None, throttle=None):
+    """Calcula y devuelve el hash SHA256 de un archivo, usando el índice si está disponible."""
+    try:
+        st = os.stat(file_path)
+        if index is not None:
+            with _index_lock:
+                digest = lookup_hash(index, st)
+            if digest:
+                metrics.incr("hash_index_hits")
+                return digest
+
+        hasher = hashlib.sha256()
+        with _read_slot(throttle, st.st_dev), open(file_path, 'rb') as f:
             for chunk in iter(lambda: f.read(65536), b""):
                 hasher.update(chunk)
-        return hasher.hexdigest()
+                if throttle is not None:
+                    throttle.consume(st.st_dev, len(chunk))
+        digest = hasher.hexdigest()
+        metrics.incr("files_hashed")
+        metrics.incr("bytes_hashed", st.st_size)
+
+        # Solo se guarda si el archivo no cambió mientras se leía
+        if index is not None and _index_key(os.stat(file_path)) == _index_key(st):
+            with _index_lock:
+                store_hash(index, file_path, st, digest)
+        return digest
     except Exception as e:
         logger.error(f"Error al calcular el hash del archivo '{file_path}': {e}")
         return None
 
-def find_matching_file(source_file, library_dirs):
-    """Busca un archivo que coincida en las bibliotecas de medios."""
-    source_hash = get_file_hash(source_file)
-    if not source_hash:
+def get_quick_fingerprint(file_path, size, dev=None, throttle=None):
+    """Calcula una huella SHA256 de los bloques inicial, central y final de un archivo."""
+    hasher = hashlib.sha256()
+    try:
+        with _read_slot(throttle, dev), open(file_path, 'rb') as f:
+            if size <= 3 * FINGERPRINT_BLOCK_SIZE:
+                # En archivos pequeños la huella cubre el archivo entero
+                hasher.update(f.read())
+            else:
+                for offset in (0, (size - FINGERPRINT_BLOCK_SIZE) // 2, size - FINGERPRINT_BLOCK_SIZE):
+                    f.seek(offset)
+                    hasher.update(f.read(FINGERPRINT_BLOCK_SIZE))
+        if throttle is not None:
+            throttle.consume(dev, min(size, 3 * FINGERPRINT_BLOCK_SIZE))
+        metrics.incr("bytes_fingerprinted", min(size, 3 * FINGERPRINT_BLOCK_SIZE))
+        return hasher.hexdigest()
+    except Exception as e:
+        logger.error(f"Error al calcular la huella rápida del archivo '{file_path}': {e}")
+        return None
+
+def get_physical_extents(file_path):
+    """Devuelve las extensiones físicas (lógico, físico, longitud) de un archivo mediante FIEMAP.
+
+    Devuelve None si el sistema de archivos no lo soporta o el resultado no es fiable.
+    """
+    request = bytearray(FIEMAP_HEADER.size + FIEMAP_EXTENT.size * FIEMAP_MAX_EXTENTS)
+    FIEMAP_HEADER.pack_into(request, 0, 0, 0xFFFFFFFFFFFFFFFF, FIEMAP_FLAG_SYNC, 0, FIEMAP_MAX_EXTENTS, 0)
+    try:
+        fd = os.open(file_path, os.O_RDONLY)
+        try:
+            fcntl.ioctl(fd, FS_IOC_FIEMAP, request)
+        finally:
+            os.close(fd)
+    except OSError:
+        return None
+
+    mapped = FIEMAP_HEADER.unpack_from(request, 0)[3]
+    extents = []
+    for i in range(mapped):
+        logical, physical, length, _, _, flags = FIEMAP_EXTENT.unpack_from(
+            request, FIEMAP_HEADER.size + i * FIEMAP_EXTENT.size)
+        if flags & FIEMAP_EXTENT_UNRELIABLE:
+            return None
+        extents.append((logical, physical, length))
+        if flags & FIEMAP_EXTENT_LAST:
+            return extents
+    # Sin extensiones (archivo vacío o totalmente disperso) o demasiado fragmentado para comparar
+    return extents if mapped == 0 else None
+
+def is_same_data(source, target, source_extents=None):
+    """Comprueba solo con metadatos si dos archivos comparten los mismos datos.
+
+    'source' y 'target' son tuplas (ruta, st_dev, st_ino). Un hardlink comparte inodo y una copia
+    reflink comparte todas sus extensiones físicas; en ambos casos no hace falta leer contenido.
+    """
+    source_path, source_dev, source_ino = source
+    target_path, target_dev, target_ino = target
+    if source_dev != target_dev:
+        return False
+    if source_ino == target_ino:
+        return True
+    if source_extents is None:
+        source_extents = get_physical_extents(source_path)
+    if not source_extents:
         return False
+    return source_extents == get_physical_extents(target_path)
 
-    for library_dir in library_dirs:
-        for root, _, files in os.walk(library_dir):
-            for file in files:
-                target_file = os.path.join(root, file)
-                if os.path.getsize(source_file) != os.path.getsize(target_file):
-                    continue
-                target_hash = get_file_hash(target_file)
-                if source_hash == target_hash:
-                    logger.info(f"Archivo '{source_file}' coincide con '{target_file}'")
-                    return True
-    return False
+def log_walk_error(error):
+    logger.error(f"Error al recorrer '{error.filename}': {error}")
+
+def scan_media(roots, workers=1):
+    """Devuelve (DirEntry) de los archivos multimedia bajo 'roots'; el resto no llega a examinarse."""
+    return walk_files(roots, extensions=MEDIA_EXTENSIONS, workers=workers, on_error=log_walk_error)
+
+def build_size_map(library_dirs, changed_since=None, changed_sizes=None, workers=1):
+    """Recorre las bibliotecas una sola vez y agrupa sus archivos multimedia por tamaño.
+
+    Cada tamaño se asocia a una lista de tuplas (ruta, st_dev, st_ino). Si se indican
+    'changed_since' y 'changed_sizes', se añaden a este conjunto los tamaños de los archivos
+    cuyo ctime es posterior a 'changed_since'. Con 'workers' > 1 los subdirectorios de primer
+    nivel de cada biblioteca se recorren en paralelo.
+    """
+    size_map = {}
+    total = 0
+    for entry in scan_media(library_dirs, workers):
+        try:
+            st = entry.stat()
+        except OSError as e:
+            logger.error(f"Error al obtener el tamaño de '{entry.path}': {e}")
+            continue
+        size_map.setdefault(st.st_size, []).append((entry.path, st.st_dev, st.st_ino))
+        if changed_sizes is not None and changed_since is not None and st.st_ctime > changed_since:
+            changed_sizes.add(st.st_size)
+        total += 1
+    logger.info(f"Bibliotecas indexadas: {total} archivos en {len(size_map)} tamaños distintos.")
+    metrics.set("library_files", total)
+    return size_map
+
+def find_matching_file(source_file, size_map, index=None, source_stat=None,
+                       verify_full_hash=True, fingerprint_cache=None, throttle=None):
+    """Busca un archivo que coincida en las bibliotecas de medios entre los del mismo tamaño.
+
+    La comparación es progresiva: tamaño, metadatos (hardlink o reflink), huella rápida y, si
+    'verify_full_hash' es True, SHA256 completo solo de los candidatos cuya huella coincide.
+    Devuelve la ruta del archivo de la biblioteca que coincide, o None.
+    """
+    if source_stat is None:
+        source_stat = os.stat(source_file)
+    source_size = source_stat.st_size
+    source = (source_file, source_stat.st_dev, source_stat.st_ino)
+    candidates = [c for c in size_map.get(source_size, []) if c[0] != source_file]
+    if not candidates:
+        return None
+
+    # Hardlinks y reflinks coinciden sin leer ningún byte
+    source_extents = None
+    if any(c[1] == source[1] and c[2] != source[2] for c in candidates):
+        source_extents = get_physical_extents(source_file) or []
+    for candidate in candidates:
+        if is_same_data(source, candidate, source_extents):
+            logger.info(f"Archivo '{source_file}' coincide con '{candidate[0]}' (mismos datos en disco)")
+            metrics.incr("matches_metadata")
+            return candidate[0]
+
+    if fingerprint_cache is None:
+        fingerprint_cache = {}
+
+    source_fingerprint = get_quick_fingerprint(source_file, source_size, source[1], throttle)
+    if not source_fingerprint:
+        return None
+
+    survivors = []
+    for target_file, target_dev, _ in candidates:
+        if target_file not in fingerprint_cache:
+            fingerprint_cache[target_file] = get_quick_fingerprint(target_file, source_size, target_dev, throttle)
+        if fingerprint_cache[target_file] == source_fingerprint:
+            survivors.append(target_file)
+    if not survivors:
+        return None
+
+    # Si la huella ya cubre todo el archivo, coincide byte a byte
+    if not verify_full_hash or source_size <= 3 * FINGERPRINT_BLOCK_SIZE:
+        logger.info(f"Archivo '{source_file}' coincide con '{survivors[0]}' (huella rápida)")
+        metrics.incr("matches_fingerprint")
+        return survivors[0]
+
+    source_hash = get_file_hash(source_file, index, throttle)
+    if not source_hash:
+        return None
+
+    for target_file in survivors:
+        target_hash = get_file_hash(target_file, index, throttle)
+        if source_hash == target_hash:
+            logger.info(f"Archivo '{source_file}' coincide con '{target_file}'")
+            metrics.incr("matches_hash")
+            return target_file
+    return None
+
+def is_sidecar(name, base_name):
+    """Indica si 'name' es un archivo asociado ('ep1.nfo', 'ep1.en.srt', 'ep1-poster.jpg') de 'base_name'."""
+    return (len(name) > len(base_name) and name.startswith(base_name)
+            and name[len(base_name)] in SIDECAR_SEPARATORS
+            and os.path.splitext(name)[1].lower() in SIDECAR_EXTENSIONS)
+
+def find_sidecars(directory, file_names):
+    """Busca con una sola lectura del directorio los archivos asociados de varias descargas.
+
+    Cada archivo asociado se asigna a la descarga del directorio con el nombre base más largo que
+    encaja (así 'ep1-extras.nfo' es de 'ep1-extras.mkv' y no de 'ep1.mkv'), aunque esa descarga no
+    esté en 'file_names'. Devuelve {nombre de descarga: [DirEntry de sus archivos asociados]}.
+    """
+    sidecars = {name: [] for name in file_names}
+    try:
+        with os.scandir(directory) as it:
+            entries = list(it)
+    except OSError as e:
+        logger.error(f"Error al leer el directorio '{directory}': {e}")
+        return sidecars
+    bases = {os.path.splitext(name)[0]: name for name in file_names}
+    bases.update((os.path.splitext(e.name)[0], e.name) for e in entries
+                 if os.path.splitext(e.name)[1].lower() in MEDIA_EXTENSIONS)
+    ordered = sorted(bases, key=len, reverse=True)
+    for entry in entries:
+        if os.path.splitext(entry.name)[1].lower() not in SIDECAR_EXTENSIONS:
+            continue
+        owner = next((bases[b] for b in ordered if is_sidecar(entry.name, b)), None)
+        if owner in sidecars:
+            sidecars[owner].append(entry)
+    return sidecars
+
+def remove_sidecar(path):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        return
+    except OSError as e:
+        logger.error(f"Error al eliminar '{path}': {e}")
+        return
+    logger.info(f"Archivo asociado eliminado: '{path}'")
+    metrics.incr("sidecars_deleted")
 
 def delete_associated_files(file_path):
     """Elimina archivos asociados como .nfo, subtítulos, etc."""
-    directory = os.path.dirname(file_path)
-    base_name = os.path.splitext(os.path.basename(file_path))[0]
-    associated_extensions = ['.nfo', '.srt', '.sub', '.idx', '.txt', '.jpg', '.jpeg', '.png']
-
-    for file in os.listdir(directory):
-        if file.startswith(base_name):
-            file_ext = os.path.splitext(file)[1].lower()
-            if file_ext in associated_extensions:
-                associated_file_path = os.path.join(directory, file)
-                try:
-                    os.remove(associated_file_path)
-                    logger.info(f"Archivo asociado eliminado: '{associated_file_path}'")
-                except Exception as e:
-                    logger.error(f"Error al eliminar '{associated_file_path}': {e}")
+    directory, name = os.path.split(file_path)
+    for entry in find_sidecars(directory, [name])[name]:
+        remove_sidecar(entry.path)
 
 def clean_empty_directories(root_dir):
-    """Elimina directorios vacíos recursivamente."""
-    for dirpath, dirnames, filenames in os.walk(root_dir, topdown=False):
-        if not dirnames and not filenames:
+    """Elimina recursivamente los directorios vacíos bajo 'root_dir' (sin incluirlo).
+
+    Un directorio que solo contenía directorios vacíos también se elimina en la misma pasada.
+    """
+    removed = set()
+    for dirpath, dirs, others in walk(root_dir, topdown=False, on_error=log_walk_error):
+        if dirpath == root_dir or others or any(d.path not in removed for d in dirs):
+            continue
+        try:
+            os.rmdir(dirpath)
+            removed.add(dirpath)
+            logger.info(f"Directorio vacío eliminado: '{dirpath}'")
+            metrics.incr("dirs_removed")
+        except Exception as e:
+            logger.error(f"Error al eliminar directorio '{dirpath}': {e}")
+
+def remove_empty_parents(path, stop_dir):
+    """Elimina los directorios vacíos desde el padre de 'path' hasta 'stop_dir' (sin incluirlo)."""
+    remove_empty_upwards(os.path.dirname(os.path.abspath(path)), stop_dir)
+
+def remove_empty_upwards(directory, stop_dir):
+    """Elimina 'directory' y sus padres mientras estén vacíos, sin llegar a 'stop_dir'."""
+    stop_dir = os.path.abspath(stop_dir)
+    directory = os.path.abspath(directory)
+    while directory != stop_dir and directory.startswith(stop_dir + os.sep):
+        try:
+            os.rmdir(directory)
+        except OSError:
+            break
+        logger.info(f"Directorio vacío eliminado: '{directory}'")
+        metrics.incr("dirs_removed")
+        directory = os.path.dirname(directory)
+
+def remove_download(file_path):
+    """Elimina una descarga ya presente en las bibliotecas junto con sus archivos asociados."""
+    try:
+        size = os.stat(file_path).st_size
+        os.remove(file_path)
+        logger.info(f"Archivo eliminado: '{file_path}'")
+        metrics.incr("files_deleted")
+        metrics.incr("bytes_freed", size)
+        delete_associated_files(file_path)
+        return True
+    except Exception as e:
+        logger.error(f"Error al eliminar '{file_path}': {e}")
+        return False
+
+def commit_index(index):
+    """Guarda los hashes calculados por si la ejecución se interrumpe."""
+    if index is not None:
+        with _index_lock:
+            index.commit()
+
+def load_journal(journal_file):
+    """Carga el diario del modo residente. Devuelve {} si no existe o está dañado."""
+    try:
+        with open(journal_file, 'r') as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+    except (OSError, json.JSONDecodeError) as e:
+        logger.warning(f"No se pudo leer el diario '{journal_file}': {e}. Se hará una pasada completa.")
+        return {}
+
+def save_journal(journal_file, checkpoint, pending):
+    """Guarda de forma atómica el punto de control y la cola pendiente del modo residente."""
+    tmp_file = f"{journal_file}.tmp"
+    try:
+        os.makedirs(os.path.dirname(journal_file), exist_ok=True)
+        with open(tmp_file, 'w') as f:
+            json.dump({"checkpoint": checkpoint, "pending": sorted(pending)}, f)
+        os.replace(tmp_file, journal_file)
+    except OSError as e:
+        logger.error(f"No se pudo guardar el diario '{journal_file}': {e}")
+
+def build_plan(config, download_dir, size_map, index):
+    """Fase 1: compara todas las descargas con las bibliotecas y devuelve el plan de borrado.
+
+    No se borra nada. Las descargas coincidentes se agrupan por directorio y los archivos asociados
+    de cada directorio se buscan con una sola lectura de este.
+    """
+    verify_full_hash = config.get("full_hash_verification", True)
+    if not verify_full_hash:
+        logger.warning("Verificación SHA256 completa desactivada: las coincidencias se basan en la huella rápida.")
+    fingerprint_cache = {}
+    hash_workers = max(1, int(config.get("hash_workers", DEFAULT_HASH_WORKERS)))
+    throttle = make_throttle(config)
+    logger.info(f"Comparando con {hash_workers} hilos y {throttle.per_device} lectura(s) simultánea(s) por disco.")
+    matches = {}   # directorio -> {nombre: registro}
+
+    def drain(pending):
+        """Espera comparaciones en curso y anota las descargas coincidentes."""
+        done, _ = wait(pending, return_when=FIRST_COMPLETED)
+        for future in done:
+            file_path, st = pending.pop(future)
             try:
-                os.rmdir(dirpath)
-                logger.info(f"Directorio vacío eliminado: '{dirpath}'")
+                match = future.result()
             except Exception as e:
-                logger.error(f"Error al eliminar directorio '{dirpath}': {e}")
+                logger.error(f"Error inesperado al comparar '{file_path}': {e}")
+                continue
+            if match:
+                directory, name = os.path.split(file_path)
+                matches.setdefault(directory, {})[name] = {
+                    "name": name, "size": st.st_size, "mtime_ns": st.st_mtime_ns, "ino": st.st_ino, "match": match,
+                }
+            else:
+                logger.info(f"El archivo '{file_path}' no se encontró en las bibliotecas. No se eliminará.")
+            commit_index(index)
+
+    # Recorrer los archivos en el directorio de descargas; como mucho hay 2 tareas por hilo en cola
+    pending = {}
+    with metrics.span("compare"), ThreadPoolExecutor(max_workers=hash_workers, thread_name_prefix="hash") as executor:
+        for entry in scan_media(download_dir):
+            file_path = entry.path
+            logger.info(f"Procesando archivo: '{file_path}'")
+            metrics.incr("downloads_scanned")
+            try:
+                file_stat = entry.stat()
+            except OSError as e:
+                logger.error(f"Error al obtener el tamaño de '{file_path}': {e}")
+                continue
+            future = executor.submit(find_matching_file, file_path, size_map, index, file_stat,
+                                     verify_full_hash, fingerprint_cache, throttle)
+            pending[future] = (file_path, file_stat)
+            if len(pending) >= 2 * hash_workers:
+                drain(pending)
+
+        while pending:
+            drain(pending)
+
+    directories = []
+    total_bytes = 0
+    total_sidecars = 0
+    with metrics.span("find_sidecars"):
+        for directory in sorted(matches):
+            files = matches[directory]
+            for name, sidecars in find_sidecars(directory, list(files)).items():
+                records = []
+                for entry in sidecars:
+                    try:
+                        size = entry.stat(follow_symlinks=False).st_size
+                    except OSError:
+                        continue
+                    records.append({"name": entry.name, "size": size})
+                    total_bytes += size
+                files[name]["sidecars"] = sorted(records, key=lambda r: r["name"])
+                total_sidecars += len(records)
+                total_bytes += files[name]["size"]
+            directories.append({"dir": directory, "files": [files[n] for n in sorted(files)]})
+
+    plan = {
+        "created": datetime.now().isoformat(timespec="seconds"),
+        "download_dir": os.path.abspath(download_dir),
+        "directories": directories,
+        "totals": {
+            "files": sum(len(d["files"]) for d in directories),
+            "sidecars": total_sidecars,
+            "bytes": total_bytes,
+        },
+    }
+    logger.info(
+        f"Plan: {plan['totals']['files']} descargas y {total_sidecars} archivos asociados en "
+        f"{len(directories)} directorios ({total_bytes / 1024 ** 3:.2f} GiB)."
+    )
+    return plan
+
+def save_plan(plan, plan_file):
+    """Escribe el plan en JSON ('-' para la salida estándar; el log va a la salida de errores)."""
+    if plan_file == "-":
+        json.dump(plan, sys.stdout, indent=2, ensure_ascii=False)
+        sys.stdout.write("\n")
+        return
+    tmp_file = f"{plan_file}.tmp"
+    with open(tmp_file, "w") as f:
+        json.dump(plan, f, indent=2, ensure_ascii=False)
+    os.replace(tmp_file, plan_file)
+    logger.info(f"Plan de borrado guardado en '{plan_file}'.")
+
+def load_plan(plan_file):
+    try:
+        with open(plan_file, "r") as f:
+            return json.load(f)
+    except (OSError, json.JSONDecodeError) as e:
+        logger.error(f"No se pudo leer el plan '{plan_file}': {e}")
+        return None
+
+def is_plan_path(path, root):
+    """Un plan editado a mano no puede borrar nada fuera del directorio de descargas."""
+    path = os.path.normpath(os.path.abspath(path))
+    return path != root and os.path.commonpath([root, path]) == root
+
+def execute_plan(plan, download_dir, batch_size=DEFAULT_BATCH_SIZE):
+    """Fase 2: borra por lotes lo que indica el plan.
+
+    Antes de borrar cada descarga se comprueba que sigue siendo el mismo archivo (tamaño, mtime e
+    inodo); si ha cambiado desde que se hizo el plan, se omite con sus archivos asociados. Al final
+    solo se limpian los directorios vacíos que el plan ha tocado.
+    """
+    root = os.path.abspath(download_dir)
+    if plan.get("download_dir") != root:
+        logger.error(f"El plan es del directorio '{plan.get('download_dir')}', no de '{root}'. No se ejecutará.")
+        return False
+    items = [(d["dir"], f) for d in plan.get("directories", []) for f in d.get("files", [])]
+    batches = [items[i:i + batch_size] for i in range(0, len(items), max(1, batch_size))]
+    touched = set()
+
+    for number, batch in enumerate(batches, 1):
+        deleted = 0
+        freed = 0
+        with metrics.span("delete"):
+            for directory, record in batch:
+                file_path = os.path.join(directory, record["name"])
+                if not is_plan_path(file_path, root):
+                    logger.error(f"'{file_path}' está fuera de '{root}'. Se omite.")
+                    continue
+                try:
+                    st = os.stat(file_path)
+                except FileNotFoundError:
+                    logger.warning(f"'{file_path}' ya no existe. Se omite.")
+                    continue
+                if (st.st_size, st.st_mtime_ns, st.st_ino) != (record["size"], record["mtime_ns"], record["ino"]):
+                    logger.warning(f"'{file_path}' ha cambiado desde que se generó el plan. Se omite.")
+                    continue
+                try:
+                    os.remove(file_path)
+                except OSError as e:
+                    logger.error(f"Error al eliminar '{file_path}': {e}")
+                    continue
+                logger.info(f"Archivo eliminado: '{file_path}' (coincide con '{record.get('match')}')")
+                metrics.incr("files_deleted")
+                metrics.incr("bytes_freed", st.st_size)
+                deleted += 1
+                freed += st.st_size
+                for sidecar in record.get("sidecars", []):
+                    sidecar_path = os.path.join(directory, sidecar["name"])
+                    if is_plan_path(sidecar_path, root):
+                        remove_sidecar(sidecar_path)
+                touched.add(directory)
+        logger.info(f"Lote {number}/{len(batches)}: {deleted} descargas eliminadas ({freed / 1024 ** 2:.1f} MiB).")
+
+    # Eliminar directorios vacíos, solo en lo que el plan ha tocado y de dentro hacia fuera
+    with metrics.span("clean_empty_directories"):
+        for directory in sorted(touched, key=lambda d: d.count(os.sep), reverse=True):
+            if directory != root and os.path.isdir(directory):
+                clean_empty_directories(directory)
+                remove_empty_upwards(directory, root)
+    return True
+
+# --- Duplicados en las bibliotecas (--dedup) -----------------------------------------------------
+
+def count_sizes(library_dirs, min_size, workers=1):
+    """Pasada 1: cuenta cuántos archivos hay de cada tamaño (sin guardar rutas)."""
+    counts = {}
+    for entry in scan_media(library_dirs, workers):
+        try:
+            size = entry.stat().st_size
+        except OSError as e:
+            logger.error(f"Error al obtener el tamaño de '{entry.path}': {e}")
+            continue
+        if size >= min_size:
+            counts[size] = counts.get(size, 0) + 1
+    return counts
+
+def collect_candidates(library_dirs, sizes, workers=1):
+    """Pasada 2: guarda (ruta, st_dev, st_ino, st_mtime_ns, st_ctime_ns) solo de los archivos cuyo tamaño se repite."""
+    candidates = {}
+    for entry in scan_media(library_dirs, workers):
+        try:
+            st = entry.stat()
+        except OSError:
+            continue
+        if st.st_size in sizes:
+            candidates.setdefault(st.st_size, []).append(
+                (entry.path, st.st_dev, st.st_ino, st.st_mtime_ns, st.st_ctime_ns))
+    return candidates
+
+def find_size_duplicates(size, files, index=None, throttle=None):
+    """Agrupa por contenido los archivos de un mismo tamaño.
+
+    Los hardlinks (mismo st_dev y st_ino) cuentan como un solo archivo y no se leen dos veces. Se
+    compara la huella rápida y, entre los que coinciden, el SHA256 completo (siempre, porque el
+    resultado puede acabar en un hardlink). Devuelve una lista de grupos de duplicados.
+
+    El mtime y el ctime de cada inodo se toman antes de leerlo, para que --hardlink pueda descartar
+    los archivos modificados después (por ejemplo, etiquetas reescritas en el sitio con el mismo tamaño).
+    """
+    inodes = {}
+    stamps = {}
+    for path, dev, ino, mtime_ns, ctime_ns in files:
+        inodes.setdefault((dev, ino), []).append(path)
+        stamps[(dev, ino)] = {"mtime_ns": mtime_ns, "ctime_ns": ctime_ns}
+    if len(inodes) < 2:
+        return []
+
+    by_fingerprint = {}
+    for (dev, ino), paths in inodes.items():
+        fingerprint = get_quick_fingerprint(paths[0], size, dev, throttle)
+        if fingerprint:
+            by_fingerprint.setdefault(fingerprint, []).append((dev, ino))
+
+    groups = []
+    for fingerprint, keys in by_fingerprint.items():
+        if len(keys) < 2:
+            continue
+        by_digest = {}
+        if size <= 3 * FINGERPRINT_BLOCK_SIZE:
+            # La huella ya cubre el archivo entero
+            by_digest[fingerprint] = keys
+        else:
+            for key in keys:
+                digest = get_file_hash(inodes[key][0], index, throttle)
+                if digest:
+                    by_digest.setdefault(digest, []).append(key)
+        for digest, same in by_digest.items():
+            if len(same) < 2:
+                continue
+            # Se conserva el inodo con más rutas (el que ya está enlazado) y, a igualdad, la primera ruta
+            same.sort(key=lambda k: (-len(inodes[k]), sorted(inodes[k])[0]))
+            groups.append({
+                "size": size,
+                "sha256": digest,
+                "reclaimable": size * (len(same) - 1),
+                "keep": sorted(inodes[same[0]]),
+                "keep_inode": {"device": same[0][0], "inode": same[0][1], **stamps[same[0]]},
+                "duplicates": [{"device": k[0], "inode": k[1], **stamps[k], "paths": sorted(inodes[k])}
+                               for k in same[1:]],
+            })
+    return groups
+
+def find_library_duplicates(config, library_dirs, index, min_size):
+    """Busca duplicados en todas las bibliotecas en dos pasadas de metadatos y una de contenido.
+
+    La memoria depende del número de tamaños distintos (pasada 1) y de los archivos cuyo tamaño se
+    repite (pasada 2), no del total de archivos. Los grupos de cada tamaño se comparan en paralelo
+    con los mismos límites de lectura por disco que la comparación de descargas.
+    """
+    workers = int(config.get("scan_workers", DEFAULT_SCAN_WORKERS))
+    with metrics.span("count_sizes"):
+        counts = count_sizes(library_dirs, min_size, workers)
+    sizes = {size for size, count in counts.items() if count > 1}
+    logger.info(f"{sum(counts.values())} archivos en {len(counts)} tamaños distintos; {len(sizes)} tamaños repetidos.")
+    del counts
+    with metrics.span("collect_candidates"):
+        candidates = collect_candidates(library_dirs, sizes, workers)
+
+    hash_workers = max(1, int(config.get("hash_workers", DEFAULT_HASH_WORKERS)))
+    throttle = make_throttle(config)
+    groups = []
+    pending = {}
+
+    def drain(pending):
+        done, _ = wait(pending, return_when=FIRST_COMPLETED)
+        for future in done:
+            size = pending.pop(future)
+            try:
+                groups.extend(future.result())
+            except Exception as e:
+                logger.error(f"Error inesperado al comparar los archivos de {size} bytes: {e}")
+            commit_index(index)
+
+    with metrics.span("compare"), ThreadPoolExecutor(max_workers=hash_workers, thread_name_prefix="hash") as executor:
+        # Los tamaños grandes primero: son los que más espacio pueden liberar
+        for size in sorted(candidates, reverse=True):
+            pending[executor.submit(find_size_duplicates, size, candidates.pop(size), index, throttle)] = size
+            if len(pending) >= 2 * hash_workers:
+                drain(pending)
+        while pending:
+            drain(pending)
+
+    groups.sort(key=lambda g: (-g["reclaimable"], g["keep"][0]))
+    metrics.incr("dup_groups", len(groups))
+    metrics.incr("dup_files", sum(len(d["paths"]) for g in groups for d in g["duplicates"]))
+    metrics.incr("reclaimable_bytes", sum(g["reclaimable"] for g in groups))
+    return groups
+
+def save_dedup_report(groups, library_dirs, report_file):
+    """Guarda el informe de duplicados en JSON o, si el archivo termina en '.csv', en CSV."""
+    os.makedirs(os.path.dirname(os.path.abspath(report_file)), exist_ok=True)
+    tmp_file = f"{report_file}.tmp"
+    with open(tmp_file, "w", newline="") as f:
+        if report_file.lower().endswith(".csv"):
+            writer = csv.writer(f)
+            writer.writerow(["grupo", "tamaño", "sha256", "acción", "dispositivo", "inodo", "ruta"])
+            for number, group in enumerate(groups, 1):
+                for path in group["keep"]:
+                    writer.writerow([number, group["size"], group["sha256"], "conservar", "", "", path])
+                for duplicate in group["duplicates"]:
+                    for path in duplicate["paths"]:
+                        writer.writerow([number, group["size"], group["sha256"], "duplicado",
+                                         duplicate["device"], duplicate["inode"], path])
+        else:
+            json.dump({
+                "created": datetime.now().isoformat(timespec="seconds"),
+                "library_dirs": library_dirs,
+                "totals": {
+                    "groups": len(groups),
+                    "duplicates": sum(len(g["duplicates"]) for g in groups),
+                    "reclaimable_bytes": sum(g["reclaimable"] for g in groups),
+                },
+                "groups": groups,
+            }, f, indent=2, ensure_ascii=False)
+    os.replace(tmp_file, report_file)
+    logger.info(f"Informe de duplicados guardado en '{report_file}'.")
+
+def unchanged(st, expected, size):
+    """Indica si un os.stat() coincide con el inodo, tamaño, mtime y ctime anotados en la comparación.
+
+    El ctime no se puede fijar hacia atrás: cualquier escritura, utime o cambio de metadatos lo mueve.
+    """
+    return (st.st_dev, st.st_ino, st.st_size, st.st_mtime_ns, st.st_ctime_ns) == (
+        expected["device"], expected["inode"], size, expected["mtime_ns"], expected["ctime_ns"])
+
+def link_temporary(keep_path, path, attempts=10):
+    """Crea un hardlink de 'keep_path' junto a 'path' con un nombre temporal único y lo devuelve.
+
+    El nombre lleva un sufijo aleatorio para que un '.dedup-tmp' que haya quedado de una ejecución
+    interrumpida no bloquee el enlace.
+    """
+    for _ in range(attempts):
+        tmp_path = f"{path}.{os.urandom(4).hex()}.dedup-tmp"
+        try:
+            os.link(keep_path, tmp_path)
+            return tmp_path
+        except FileExistsError:
+            continue
+    raise FileExistsError(f"no hay un nombre temporal libre junto a '{path}'")
+
+def hardlink_duplicates(groups):
+    """Sustituye cada duplicado por un hardlink al archivo que se conserva (solo en el mismo disco).
+
+    El cambio es atómico (enlace temporal y rename). Antes se comprueba que ni el original ni las
+    rutas del duplicado han cambiado desde la comparación (inodo, tamaño, mtime y ctime); si el
+    original ha cambiado se omite el grupo entero. Tras el enlace, el duplicado comparte propietario,
+    permisos y mtime con el original. Devuelve los bytes liberados.
+    """
+    freed = 0
+    for group in groups:
+        keep_path = group["keep"][0]
+        try:
+            keep_stat = os.stat(keep_path)
+        except OSError as e:
+            logger.error(f"No se puede acceder a '{keep_path}': {e}")
+            continue
+        if not unchanged(keep_stat, group["keep_inode"], group["size"]):
+            logger.warning(f"'{keep_path}' ha cambiado desde la comparación. Se omite su grupo.")
+            continue
+        for duplicate in group["duplicates"]:
+            if duplicate["device"] != keep_stat.st_dev:
+                logger.info(f"'{duplicate['paths'][0]}' está en otro disco que '{keep_path}'; no se puede enlazar.")
+                continue
+            # Todas las rutas del inodo se comprueban antes de enlazar ninguna: al sustituir la
+            # primera baja el número de enlaces del inodo y su ctime cambia
+            try:
+                changed = [p for p in duplicate["paths"] if not unchanged(os.stat(p), duplicate, group["size"])]
+            except OSError as e:
+                logger.error(f"No se puede acceder a una copia de '{keep_path}': {e}")
+                continue
+            if changed:
+                logger.warning(f"'{changed[0]}' ha cambiado desde la comparación. Se omite.")
+                continue
+            linked = 0
+            for path in duplicate["paths"]:
+                try:
+                    tmp_path = link_temporary(keep_path, path)
+                except OSError as e:
+                    logger.error(f"No se pudo enlazar '{path}' con '{keep_path}': {e}")
+                    continue
+                try:
+                    os.replace(tmp_path, path)
+                except OSError as e:
+                    logger.error(f"No se pudo enlazar '{path}' con '{keep_path}': {e}")
+                    try:
+                        os.unlink(tmp_path)
+                    except OSError as unlink_error:
+                        logger.warning(f"No se pudo eliminar el enlace temporal '{tmp_path}': {unlink_error}")
+                    continue
+                linked += 1
+                metrics.incr("files_linked")
+                logger.info(f"'{path}' es ahora un hardlink de '{keep_path}'.")
+            # El espacio solo se libera cuando ya no queda ninguna ruta del inodo duplicado
+            if linked == len(duplicate["paths"]):
+                freed += group["size"]
+    metrics.incr("bytes_linked", freed)
+    return freed
+
+def run_dedup(args, config, library_dirs, index):
+    groups = find_library_duplicates(config, library_dirs, index, args.min_size)
+    reclaimable = sum(g["reclaimable"] for g in groups)
+    logger.info(
+        f"{len(groups)} grupos de duplicados, {sum(len(g['duplicates']) for g in groups)} copias sobrantes: "
+        f"{reclaimable / 1024 ** 3:.2f} GiB recuperables."
+    )
+    report_file = args.report or os.path.join(
+        LOG_DIR, f"downloadclean_dedup_{datetime.now():%Y-%m-%d_%H-%M-%S}.json")
+    save_dedup_report(groups, library_dirs, report_file)
+    if args.hardlink:
+        with metrics.span("hardlink"):
+            freed = hardlink_duplicates(groups)
+        logger.info(f"Duplicados sustituidos por hardlinks: {freed / 1024 ** 3:.2f} GiB liberados.")
+
+class CleanupDaemon:
+    """Modo residente: vigila descargas y bibliotecas con inotify y compara solo lo que cambia."""
+
+    def __init__(self, config, download_dir, library_dirs, index, journal_file, settle_seconds):
+        import inotify_shim
+        self.ino_mod = inotify_shim
+        self.config = config
+        self.download_dir = os.path.abspath(download_dir)
+        self.library_dirs = [os.path.abspath(d) for d in library_dirs]
+        self.index = index
+        self.journal_file = journal_file
+        self.settle_seconds = settle_seconds
+        self.verify_full_hash = config.get("full_hash_verification", True)
+        self.fingerprint_cache = {}
+        self.throttle = make_throttle(config)
+        self.size_map = {}
+        self.library_sizes = {}    # ruta de biblioteca -> tamaño (su entrada en size_map)
+        self.download_sizes = {}   # tamaño -> conjunto de descargas conocidas
+        self.download_paths = {}   # ruta de descarga -> tamaño (su entrada en download_sizes)
+        self.queue = {}            # ruta de descarga -> instante a partir del cual se procesa
+        self.watches = {}          # wd -> (directorio, es_biblioteca)
+        self.needs_rescan = False
+        self.running = True
+        self.watch_mask = (
+            inotify_shim.IN_CLOSE_WRITE | inotify_shim.IN_MOVED_TO | inotify_shim.IN_MOVED_FROM |
+            inotify_shim.IN_CREATE | inotify_shim.IN_DELETE | inotify_shim.IN_MODIFY |
+            inotify_shim.IN_ONLYDIR | inotify_shim.IN_EXCL_UNLINK
+        )
+
+    def stop(self, signum=None, frame=None):
+        logger.info("Señal de parada recibida. Guardando el diario y terminando...")
+        self.running = False
+
+    def add_watch_tree(self, root_dir, is_library):
+        """Vigila 'root_dir' y todos sus subdirectorios."""
+        for current, dirs, _ in walk(root_dir, on_error=log_walk_error):
+            try:
+                wd = self.inotify.add_watch(current, self.watch_mask)
+            except OSError as e:
+                logger.error(f"No se pudo vigilar '{current}': {e}. "
+                             "Si el error es ENOSPC, aumenta fs.inotify.max_user_watches.")
+                dirs.clear()
+                continue
+            self.watches[wd] = (current, is_library)
+
+    def track_download(self, file_path, size, due=None):
+        self.download_sizes.setdefault(size, set()).add(file_path)
+        self.download_paths[file_path] = size
+        if due is not None:
+            self.queue[file_path] = due
+
+    def forget_download(self, file_path):
+        self.queue.pop(file_path, None)
+        size = self.download_paths.pop(file_path, None)
+        if size is None:
+            return
+        paths = self.download_sizes[size]
+        paths.discard(file_path)
+        if not paths:
+            del self.download_sizes[size]
+
+    def add_library_file(self, file_path):
+        """Añade (o actualiza) un archivo de biblioteca y reencola las descargas del mismo tamaño."""
+        try:
+            st = os.stat(file_path)
+        except OSError:
+            return
+        self.remove_library_file(file_path)
+        self.size_map.setdefault(st.st_size, []).append((file_path, st.st_dev, st.st_ino))
+        self.library_sizes[file_path] = st.st_size
+        due = time.time() + self.settle_seconds
+        for download in self.download_sizes.get(st.st_size, ()):
+            self.queue[download] = min(self.queue.get(download, due), due)
+
+    def remove_library_file(self, file_path):
+        self.fingerprint_cache.pop(file_path, None)
+        size = self.library_sizes.pop(file_path, None)
+        if size is None:
+            return
+        # Solo se toca el grupo de su tamaño, no toda la biblioteca
+        remaining = [e for e in self.size_map[size] if e[0] != file_path]
+        if remaining:
+            self.size_map[size] = remaining
+        else:
+            del self.size_map[size]
+
+    def forget_tree(self, root_dir, is_library):
+        """Olvida un directorio movido fuera de la vigilancia junto con sus archivos."""
+        prefix = root_dir + os.sep
+        for wd, (directory, _) in list(self.watches.items()):
+            if directory == root_dir or directory.startswith(prefix):
+                self.inotify.rm_watch(wd)
+                self.watches.pop(wd, None)
+        if is_library:
+            for file_path in [p for p in self.library_sizes if p.startswith(prefix)]:
+                self.remove_library_file(file_path)
+        else:
+            for file_path in [p for p in self.download_paths if p.startswith(prefix)]:
+                self.forget_download(file_path)
+
+    def catch_up(self, checkpoint, pending):
+        """Reconstruye el estado y encola lo que cambió desde 'checkpoint' (o todo si no hay diario)."""
+        if checkpoint is None:
+            logger.info("No hay diario previo: se comparará todo el directorio de descargas.")
+        changed_sizes = set()
+        self.size_map = build_size_map(self.library_dirs, checkpoint, changed_sizes,
+                                       int(self.config.get("scan_workers", DEFAULT_SCAN_WORKERS)))
+        self.library_sizes = {e[0]: size for size, entries in self.size_map.items() for e in entries}
+        self.fingerprint_cache.clear()
+        self.download_sizes.clear()
+        self.download_paths.clear()
+        pending = set(pending)
+        queued = 0
+        for entry in scan_media(self.download_dir):
+            try:
+                st = entry.stat()
+            except OSError:
+                continue
+            self.download_sizes.setdefault(st.st_size, set()).add(entry.path)
+            self.download_paths[entry.path] = st.st_size
+            if (checkpoint is None or st.st_ctime > checkpoint or st.st_size in changed_sizes
+                    or entry.path in pending):
+                self.queue[entry.path] = 0
+                queued += 1
+        logger.info(f"Recuperación inicial: {queued} descarga(s) pendientes de comparar.")
+
+    def handle_event(self, wd, mask, name):
+        ino = self.ino_mod
+        if mask & ino.IN_Q_OVERFLOW:
+            logger.warning("Cola de inotify desbordada: se hará una nueva pasada de recuperación.")
+            self.needs_rescan = True
+            return
+        if mask & ino.IN_IGNORED:
+            self.watches.pop(wd, None)
+            return
+        if wd not in self.watches or not name:
+            return
+
+        directory, is_library = self.watches[wd]
+        path = os.path.join(directory, name)
+        created = mask & (ino.IN_CLOSE_WRITE | ino.IN_MOVED_TO | ino.IN_CREATE)
+        removed = mask & (ino.IN_DELETE | ino.IN_MOVED_FROM)
+
+        if mask & ino.IN_ISDIR:
+            if mask & (ino.IN_CREATE | ino.IN_MOVED_TO):
+                self.add_watch_tree(path, is_library)
+                # Un directorio movido llega ya lleno: se registran sus archivos
+                for entry in scan_media(path):
+                    self.handle_new_file(entry.path, is_library)
+            elif mask & ino.IN_MOVED_FROM:
+                self.forget_tree(path, is_library)
+            return
+
+        if mask & ino.IN_MODIFY:
+            # Solo se retrasa la espera (sin stat): IN_MODIFY llega con cada escritura. El tamaño se
+            # actualiza al cerrar el archivo o al compararlo. En las bibliotecas basta con IN_CLOSE_WRITE.
+            if not is_library:
+                if path in self.download_paths:
+                    self.queue[path] = time.time() + self.settle_seconds
+                else:
+                    self.handle_new_file(path, False)
+            return
+
+        if created:
+            self.handle_new_file(path, is_library)
+        elif removed:
+            if is_library:
+                self.remove_library_file(path)
+            else:
+                self.forget_download(path)
+
+    def handle_new_file(self, path, is_library):
+        if os.path.splitext(path)[1].lower() not in MEDIA_EXTENSIONS:
+            return
+        if is_library:
+            self.add_library_file(path)
+        else:
+            try:
+                size = os.path.getsize(path)
+            except OSError:
+                return
+            self.forget_download(path)
+            self.track_download(path, size, time.time() + self.settle_seconds)
+
+    def process_due(self):
+        """Compara las descargas cuya espera ha terminado. Devuelve True si se procesó alguna."""
+        now = time.time()
+        due = [p for p, t in self.queue.items() if t <= now]
+        for file_path in due:
+            if not self.running:
+                break
+            self.queue.pop(file_path, None)
+            try:
+                st = os.stat(file_path)
+            except FileNotFoundError:
+                self.forget_download(file_path)
+                continue
+            if self.download_paths.get(file_path) != st.st_size:
+                # Creció sin cerrarse: se pasa al grupo de su tamaño actual
+                self.forget_download(file_path)
+                self.track_download(file_path, st.st_size)
+            logger.info(f"Procesando archivo: '{file_path}'")
+            if find_matching_file(file_path, self.size_map, self.index, st,
+                                  self.verify_full_hash, self.fingerprint_cache, self.throttle):
+                if remove_download(file_path):
+                    self.forget_download(file_path)
+                    remove_empty_parents(file_path, self.download_dir)
+            else:
+                logger.info(f"El archivo '{file_path}' no se encontró en las bibliotecas. No se eliminará.")
+            commit_index(self.index)
+        return bool(due)
+
+    def run(self):
+        signal.signal(signal.SIGTERM, self.stop)
+        signal.signal(signal.SIGINT, self.stop)
+
+        journal = load_journal(self.journal_file)
+        with self.ino_mod.Inotify() as self.inotify:
+            # Las vigilancias se crean antes de la recuperación para no perder eventos intermedios
+            self.add_watch_tree(self.download_dir, False)
+            for library_dir in self.library_dirs:
+                self.add_watch_tree(library_dir, True)
+            logger.info(f"Modo residente: {len(self.watches)} directorios vigilados.")
+
+            checkpoint = time.time()
+            self.catch_up(journal.get("checkpoint"), journal.get("pending", []))
+            save_journal(self.journal_file, checkpoint, self.queue)
+
+            while self.running:
+                checkpoint = time.time()
+                queue_before = len(self.queue)
+                for wd, mask, _, name in self.inotify.read_events(timeout=1.0):
+                    self.handle_event(wd, mask, name)
+                if self.needs_rescan:
+                    self.needs_rescan = False
+                    self.catch_up(checkpoint - self.settle_seconds, list(self.queue))
+                processed = self.process_due()
+                if processed or len(self.queue) != queue_before:
+                    save_journal(self.journal_file, checkpoint, self.queue)
+
+            save_journal(self.journal_file, checkpoint, self.queue)
+
+def parse_args():
+    """Analiza los argumentos de línea de comandos."""
+    parser = argparse.ArgumentParser(description="Elimina descargas que ya están en las bibliotecas de medios.")
+    parser.add_argument("--rebuild-index", action="store_true",
+                        help="Vacía el índice de hashes y lo reconstruye desde cero.")
+    parser.add_argument("--index-file", default=HASH_INDEX_FILE,
+                        help=f"Ruta del índice de hashes (por defecto: {HASH_INDEX_FILE}).")
+    parser.add_argument("--daemon", action="store_true",
+                        help="Queda residente y vigila descargas y bibliotecas con inotify.")
+    parser.add_argument("--journal-file", default=JOURNAL_FILE,
+                        help=f"Diario del modo residente (por defecto: {JOURNAL_FILE}).")
+    parser.add_argument("--settle-seconds", type=int, default=DAEMON_SETTLE_SECONDS,
+                        help=f"Espera tras el último evento antes de comparar un archivo (por defecto: {DAEMON_SETTLE_SECONDS}).")
+    mode = parser.add_mutually_exclusive_group()
+    mode.add_argument("--plan", metavar="ARCHIVO",
+                      help="Solo genera el plan de borrado en JSON ('-' para la salida estándar); no borra nada.")
+    mode.add_argument("--execute-plan", metavar="ARCHIVO",
+                      help="Ejecuta un plan generado con --plan, sin volver a comparar.")
+    mode.add_argument("--dedup", action="store_true",
+                      help="Busca archivos duplicados en las bibliotecas (no toca las descargas).")
+    parser.add_argument("--batch-size", type=int, default=DEFAULT_BATCH_SIZE,
+                        help=f"Descargas borradas por lote (por defecto: {DEFAULT_BATCH_SIZE}).")
+    parser.add_argument("--report", metavar="ARCHIVO",
+                        help="Informe de --dedup en JSON o, si termina en '.csv', en CSV (por defecto, en logs/).")
+    parser.add_argument("--hardlink", action="store_true",
+                        help="Con --dedup, sustituye los duplicados del mismo disco por hardlinks.")
+    parser.add_argument("--min-size", type=int, default=DEDUP_MIN_SIZE,
+                        help=f"Con --dedup, tamaño mínimo en bytes de los archivos a comparar (por defecto: {DEDUP_MIN_SIZE}).")
+    args = parser.parse_args()
+    if args.daemon and (args.plan or args.execute_plan or args.dedup):
+        parser.error("--plan, --execute-plan y --dedup no se pueden usar con --daemon.")
+    if (args.hardlink or args.report) and not args.dedup:
+        parser.error("--report y --hardlink solo se usan con --dedup.")
+    return args
 
 def main():
+    args = parse_args()
+    if args.daemon:
+        metrics.job = "downloadclean_daemon"
+    elif args.dedup:
+        metrics.job = "downloadclean_dedup"
+    with metrics:
+        run(args)
+
+def run(args):
     # Cargar directorios desde el archivo JSON
-    config_file = os.path.join(os.path.dirname(os.path.abspath(__file__)), "configs", "directories.json")
+    config_file = os.path.join(CONFIG_DIR, "directories.json")
     try:
         with open(config_file, 'r') as f:
             config = json.load(f)
     except Exception as e:
         logger.error(f"Error al cargar el archivo de configuración: {e}")
+        metrics.status = "error"
         return
 
     download_dir = config.get("download_dir")
@@ -112,41 +1279,54 @@ def main():
         config.get("comics_dir")
     ]
 
+    # Con 'nofail', un disco desconectado deja un directorio vacío en la tarjeta SD en su lugar
+    problems = check_paths(library_dirs + ([] if args.dedup else [download_dir]))
+    if problems:
+        for problem in problems:
+            logger.error(problem)
+        metrics.status = "error"
+        return
+    if set_idle_priority():
+        logger.info("Prioridad de E/S 'idle': las lecturas ceden el disco a Plex y a las descargas.")
+
     # Verificar que los directorios existen
-    if not download_dir or not os.path.isdir(download_dir):
+    if not args.dedup and (not download_dir or not os.path.isdir(download_dir)):
         logger.error(f"El directorio de descargas no es válido: '{download_dir}'")
+        metrics.status = "error"
         return
 
     library_dirs = [d for d in library_dirs if d and os.path.isdir(d)]
     if not library_dirs:
         logger.error("No se encontraron bibliotecas de medios válidas en la configuración.")
+        metrics.status = "error"
         return
 
-    # Extensiones de archivos multimedia
-    media_extensions = ['.mp4', '.mkv', '.avi', '.mp3', '.flac', '.epub', '.pdf', '.cbr', '.cbz']
+    if args.execute_plan:
+        plan = load_plan(args.execute_plan)
+        if plan is None or not execute_plan(plan, download_dir, args.batch_size):
+            metrics.status = "error"
+        return
 
-    # Recorrer los archivos en el directorio de descargas
-    for root, dirs, files in os.walk(download_dir):
-        for file in files:
-            file_path = os.path.join(root, file)
-            file_ext = os.path.splitext(file)[1].lower()
+    index = open_hash_index(args.index_file, rebuild=args.rebuild_index)
 
-            if file_ext in media_extensions:
-                logger.info(f"Procesando archivo: '{file_path}'")
-                if find_matching_file(file_path, library_dirs):
-                    try:
-                        os.remove(file_path)
-                        logger.info(f"Archivo eliminado: '{file_path}'")
-                        delete_associated_files(file_path)
-                    except Exception as e:
-                        logger.error(f"Error al eliminar '{file_path}': {e}")
-                else:
-                    logger.info(f"El archivo '{file_path}' no se encontró en las bibliotecas. No se eliminará.")
-            else:
-                logger.debug(f"Omitiendo archivo no multimedia: '{file_path}'")
+    if args.dedup:
+        run_dedup(args, config, library_dirs, index)
+    elif args.daemon:
+        CleanupDaemon(config, download_dir, library_dirs, index,
+                      args.journal_file, args.settle_seconds).run()
+    else:
+        # Las bibliotecas se recorren una sola vez; cada descarga solo se compara con los archivos de su tamaño
+        with metrics.span("build_size_map"):
+            size_map = build_size_map(library_dirs, workers=int(config.get("scan_workers", DEFAULT_SCAN_WORKERS)))
+        plan = build_plan(config, download_dir, size_map, index)
+        if args.plan:
+            save_plan(plan, args.plan)
+        else:
+            execute_plan(plan, download_dir, args.batch_size)
 
-    # Eliminar directorios vacíos
-    clean_empty_directories(download_dir)
+    if index is not None:
+        prune_hash_index(index)
+        index.close()
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
@@ -0,0 +1,321 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Script Name: job_runner.py
+Description: Lanza los trabajos de cron de 'scripts_and_crontab.json' evitando solapamientos: un bloqueo por
+             trabajo, un bloqueo por disco compartido con los demás trabajos y espera mientras el sistema
+             o los discos están ocupados. Guarda la duración de cada ejecución.
+Version: 1.0
+License: GNU
+Usage:
+    python3 job_runner.py run rotabackup.py      Lo que ejecuta cron (configure_crontab.sh)
+    python3 job_runner.py status                 Duraciones registradas y posibles solapamientos
+Notes:
+    - Claves opcionales de cada trabajo en 'configs/scripts_and_crontab.json':
+          "args": ["--full"],                             argumentos del script
+          "resources": ["/media/WDElements", ...],        rutas que usa; se bloquea el disco de cada una
+          "io_heavy": true,                               espera si la carga o el disco están altos
+          "max_load": 1.0,                                carga (1 min) por núcleo a partir de la que espera
+          "max_disk_busy": 50,                            % de ocupación de los discos a partir del que espera
+          "max_defer_minutes": 60,                        espera máxima por carga; después se ejecuta igualmente
+          "max_wait_minutes": 180                         espera máxima por los discos; después se omite
+    - Si el mismo trabajo sigue en marcha (el de la hora anterior, por ejemplo) la nueva ejecución se omite.
+    - Los trabajos que comparten disco se ejecutan uno detrás de otro; los que no, en paralelo. Los
+      discos se identifican por st_dev, así que dos rutas del mismo disco comparten bloqueo. La
+      ocupación de un montaje FUSE (ntfs-3g) se mide en su dispositivo de bloques de origen.
+    - Los bloqueos son flock sobre 'data/locks/*.lock': el kernel los libera aunque el proceso muera.
+    - El historial está en 'data/job_runner_history.json' (últimas ejecuciones de cada trabajo).
+"""
+
+import os
+import sys
+import json
+import time
+import fcntl
+import logging
+import argparse
+import subprocess
+from datetime import datetime
+
+INSTALL_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+CONFIG_DIR = os.path.join(INSTALL_DIR, "configs")
+SCRIPTS_DIR = os.path.join(INSTALL_DIR, "scripts")
+DATA_DIR = os.path.join(INSTALL_DIR, "data")
+LOG_DIR = os.path.join(INSTALL_DIR, "logs")
+LOCK_DIR = os.path.join(DATA_DIR, "locks")
+CRONTAB_CONFIG_FILE = os.path.join(CONFIG_DIR, "scripts_and_crontab.json")
+HISTORY_FILE = os.path.join(DATA_DIR, "job_runner_history.json")
+sys.path.insert(0, os.path.join(INSTALL_DIR, "lib"))
+
+from fsutil import device_of
+from preflight import diskstats_key
+
+DEFAULTS = {
+    "max_load": 1.0,
+    "max_disk_busy": 50,
+    "max_defer_minutes": 60,
+    "max_wait_minutes": 180,
+}
+POLL_SECONDS = 60
+LOCK_POLL_SECONDS = 5
+DISK_SAMPLE_SECONDS = 2
+HISTORY_LENGTH = 30
+
+os.makedirs(LOG_DIR, exist_ok=True)
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s [%(levelname)s] [%(filename)s]: %(message)s',
+    handlers=[
+        logging.FileHandler(os.path.join(LOG_DIR, "job_runner.log")),
+        logging.StreamHandler()
+    ]
+)
+logger = logging.getLogger(__name__)
+
+def load_jobs(config_file):
+    try:
+        with open(config_file, "r") as f:
+            return {job["script"]: job for job in json.load(f) if job.get("script")}
+    except FileNotFoundError:
+        logger.error(f"Archivo de configuración '{config_file}' no encontrado.")
+    except (json.JSONDecodeError, TypeError) as e:
+        logger.error(f"El archivo de configuración '{config_file}' no es válido: {e}")
+    return None
+
+def load_history(history_file):
+    try:
+        with open(history_file, "r") as f:
+            return json.load(f)
+    except (OSError, json.JSONDecodeError):
+        return {}
+
+def record_run(history_file, script, run):
+    """Añade una ejecución al historial (con el historial bloqueado, por si terminan dos a la vez)."""
+    os.makedirs(os.path.dirname(history_file), exist_ok=True)
+    with open(f"{history_file}.lock", "a") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        history = load_history(history_file)
+        runs = history.setdefault(script, [])
+        runs.append(run)
+        del runs[:-HISTORY_LENGTH]
+        tmp_path = f"{history_file}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(history, f, indent=2, ensure_ascii=False)
+        os.replace(tmp_path, history_file)
+
+# --- Discos ---------------------------------------------------------------------------------------
+
+def read_io_ticks():
+    """Devuelve {(major, minor): milisegundos con E/S en curso} de /proc/diskstats."""
+    ticks = {}
+    try:
+        with open("/proc/diskstats", "r") as f:
+            for line in f:
+                fields = line.split()
+                if len(fields) >= 13:
+                    ticks[(int(fields[0]), int(fields[1]))] = int(fields[12])
+    except OSError:
+        pass
+    return ticks
+
+def disk_busy(devices, interval=DISK_SAMPLE_SECONDS):
+    """Porcentaje de tiempo con E/S en curso del disco más ocupado de 'devices' durante 'interval'."""
+    keys = [diskstats_key(d) for d in devices]
+    before = read_io_ticks()
+    start = time.monotonic()
+    time.sleep(interval)
+    after = read_io_ticks()
+    elapsed_ms = (time.monotonic() - start) * 1000
+    busy = [100 * (after[k] - before[k]) / elapsed_ms for k in keys if k in before and k in after]
+    return max(busy, default=0.0)
+
+def normalized_load():
+    return os.getloadavg()[0] / (os.cpu_count() or 1)
+
+# --- Bloqueos -------------------------------------------------------------------------------------
+
+def try_lock(name):
+    """Intenta tomar 'data/locks/<name>.lock' sin esperar. Devuelve el archivo abierto o None."""
+    os.makedirs(LOCK_DIR, exist_ok=True)
+    f = open(os.path.join(LOCK_DIR, f"{name}.lock"), "a")
+    try:
+        fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except BlockingIOError:
+        f.close()
+        return None
+    return f
+
+def lock_devices(devices, max_wait):
+    """Toma los bloqueos de todos los discos o ninguno. Devuelve la lista de bloqueos o None si se agota la espera.
+
+    Se toman en orden y, si alguno está ocupado, se sueltan los ya tomados antes de volver a intentarlo,
+    para no retener un disco mientras se espera por otro.
+    """
+    deadline = time.monotonic() + max_wait
+    names = [f"dev_{d}" for d in sorted(devices)]
+    announced = False
+    while True:
+        held = []
+        for name in names:
+            f = try_lock(name)
+            if f is None:
+                break
+            held.append(f)
+        if len(held) == len(names):
+            return held
+        for f in held:
+            f.close()
+        if time.monotonic() >= deadline:
+            return None
+        if not announced:
+            logger.info("Otro trabajo está usando alguno de los discos. Esperando...")
+            announced = True
+        time.sleep(LOCK_POLL_SECONDS)
+
+def wait_for_quiet(devices, settings):
+    """Espera a que la carga y la ocupación de los discos bajen de los umbrales. Devuelve los segundos esperados."""
+    start = time.monotonic()
+    deadline = start + settings["max_defer_minutes"] * 60
+    while True:
+        load = normalized_load()
+        busy = disk_busy(devices) if devices else 0.0
+        if load <= settings["max_load"] and busy <= settings["max_disk_busy"]:
+            return time.monotonic() - start
+        if time.monotonic() >= deadline:
+            logger.warning(
+                f"El sistema sigue ocupado (carga {load:.2f} por núcleo, discos al {busy:.0f} %) después de "
+                f"{settings['max_defer_minutes']} minutos. Ejecutando igualmente."
+            )
+            return time.monotonic() - start
+        logger.info(f"Sistema ocupado (carga {load:.2f} por núcleo, discos al {busy:.0f} %). Aplazando {POLL_SECONDS} s...")
+        time.sleep(POLL_SECONDS)
+
+# --- Ejecución ------------------------------------------------------------------------------------
+
+def build_command(job):
+    script_path = os.path.join(SCRIPTS_DIR, job["script"])
+    interpreter = job.get("interpreter")
+    command = [interpreter, script_path] if interpreter else [script_path]
+    return command + [str(arg) for arg in job.get("args", [])]
+
+def expected_duration(runs):
+    durations = [r["duration"] for r in runs if r.get("returncode") == 0]
+    return sum(durations) / len(durations) if durations else None
+
+def run(args):
+    jobs = load_jobs(args.config)
+    if jobs is None:
+        return 1
+    job = jobs.get(args.script)
+    if job is None:
+        logger.error(f"El trabajo '{args.script}' no está en '{args.config}'.")
+        return 1
+    settings = {key: job.get(key, value) for key, value in DEFAULTS.items()}
+    script = job["script"]
+
+    job_lock = try_lock(f"job_{script}")
+    if job_lock is None:
+        logger.warning(f"'{script}' sigue en ejecución desde la vez anterior. Se omite esta ejecución.")
+        return 0
+
+    devices = {d for d in (device_of(p) for p in job.get("resources", [])) if d is not None}
+    wait_start = time.monotonic()
+    device_locks = lock_devices(devices, settings["max_wait_minutes"] * 60)
+    if device_locks is None:
+        logger.error(f"Los discos de '{script}' siguen ocupados después de {settings['max_wait_minutes']} minutos. Se omite.")
+        job_lock.close()
+        return 1
+    waited = time.monotonic() - wait_start
+    deferred = wait_for_quiet(devices, settings) if job.get("io_heavy") else 0.0
+
+    expected = expected_duration(load_history(args.history_file).get(script, []))
+    logger.info(
+        f"Ejecutando '{script}'"
+        + (f" (duración habitual {expected / 60:.1f} min)" if expected is not None else "") + "..."
+    )
+    started = time.time()
+    start = time.monotonic()
+    try:
+        returncode = subprocess.run(build_command(job)).returncode
+    except OSError as e:
+        logger.error(f"No se pudo ejecutar '{script}': {e}")
+        returncode = 127
+    finally:
+        for f in device_locks:
+            f.close()
+        job_lock.close()
+    duration = time.monotonic() - start
+
+    record_run(args.history_file, script, {
+        "start": datetime.fromtimestamp(started).isoformat(timespec="seconds"),
+        "duration": round(duration, 1),
+        "waited": round(waited, 1),
+        "deferred": round(deferred, 1),
+        "returncode": returncode,
+    })
+    log = logger.info if returncode == 0 else logger.error
+    log(f"'{script}' terminó con código {returncode} en {duration / 60:.1f} min "
+        f"(esperó {waited / 60:.1f} min por los discos y {deferred / 60:.1f} min por carga).")
+    return returncode
+
+# --- Estado ---------------------------------------------------------------------------------------
+
+def daily_start_minute(schedule):
+    """Minuto del día de un horario 'M H * * *' con números fijos, o None."""
+    fields = schedule.split()
+    if len(fields) != 5 or fields[2:] != ["*", "*", "*"] or not (fields[0].isdigit() and fields[1].isdigit()):
+        return None
+    return int(fields[1]) * 60 + int(fields[0])
+
+def status(args):
+    jobs = load_jobs(args.config)
+    if jobs is None:
+        return 1
+    history = load_history(args.history_file)
+
+    header = f"{'Trabajo':<26} {'Horario':<12} {'Ejec.':>5} {'Última':>8} {'Media':>8} {'Máx.':>8} {'Espera':>8}"
+    print(header)
+    print("-" * len(header))
+    windows = []
+    for script, job in jobs.items():
+        runs = history.get(script, [])
+        durations = [r["duration"] for r in runs]
+        if durations:
+            last, mean, longest = durations[-1], sum(durations) / len(durations), max(durations)
+            wait = sum(r.get("waited", 0) + r.get("deferred", 0) for r in runs) / len(runs)
+            print(f"{script:<26} {job.get('schedule', ''):<12} {len(runs):>5} {last / 60:>7.1f}m "
+                  f"{mean / 60:>7.1f}m {longest / 60:>7.1f}m {wait / 60:>7.1f}m")
+        else:
+            print(f"{script:<26} {job.get('schedule', ''):<12} {0:>5} {'-':>8} {'-':>8} {'-':>8} {'-':>8}")
+            longest = None
+        begin = daily_start_minute(job.get("schedule", ""))
+        if begin is not None and longest is not None:
+            devices = {d for d in (device_of(p) for p in job.get("resources", [])) if d is not None}
+            windows.append((begin, begin + longest / 60, script, devices))
+
+    # Trabajos diarios cuya ejecución más larga invade la hora de otro que usa los mismos discos
+    for begin, end, script, devices in windows:
+        for other_begin, _, other, other_devices in windows:
+            if other != script and begin < other_begin < end and devices & other_devices:
+                print(f"Aviso: '{script}' ({end - begin:.0f} min en su peor ejecución) llega a la hora de "
+                      f"'{other}'; este esperará por los discos compartidos.")
+    return 0
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Ejecuta los trabajos de cron con bloqueos y esperas por carga.")
+    parser.add_argument("--config", default=CRONTAB_CONFIG_FILE, help="Archivo con los trabajos.")
+    parser.add_argument("--history-file", default=HISTORY_FILE, help="Historial de ejecuciones.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    run_parser = subparsers.add_parser("run", help="Ejecuta un trabajo.")
+    run_parser.add_argument("script", help="Nombre del script tal como aparece en el archivo de trabajos.")
+    subparsers.add_parser("status", help="Muestra las duraciones registradas.")
+    return parser.parse_args()
+
+def main():
+    args = parse_args()
+    if args.command == "run":
+        sys.exit(run(args))
+    sys.exit(status(args))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,481 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Script Name: logmanager.py
+Description: Rota, comprime y poda los logs de '/opt/confiraspa/logs' según 'logrotate_jobs_config.json',
+             manteniendo el directorio por debajo de un presupuesto total de bytes
+             (sustituye a setup_logrotate_from_json.sh y a los archivos de /etc/logrotate.d que genera).
+Version: 1.0
+License: MIT License
+Usage: python3 logmanager.py [--dry-run] [--config archivo.json]
+Notes:
+    - Claves generales de la configuración:
+          "log_dir": "/opt/confiraspa/logs",    directorio sobre el que se aplica el presupuesto
+          "max_total_bytes": "200M",            presupuesto total (admite sufijos K, M y G)
+          "compression": "zstd",                "zstd" (si está el binario 'zstd') o "gzip"
+          "workers": 2,                         procesos que comprimen en paralelo
+          "jobs": [...]
+    - Claves de cada trabajo (las de logrotate que tienen sentido aquí):
+          "name", "path", "rotate" (copias que se conservan), "daily"/"weekly"/"monthly", "max_size",
+          "max_age_days", "compress", "missingok", "notifempty", "copytruncate", "create", "postrotate",
+          "rotate_each".
+    - Si "path" lleva comodines, cada archivo es el log de una ejecución (backup_rsync_<fecha>.log):
+      no se renombra; se comprime en su sitio cuando lleva "min_age_minutes" (60 por defecto) sin
+      escribirse y se conservan las "rotate" ejecuciones más recientes.
+    - Si "path" es fijo, es un log al que los scripts añaden líneas: se rota al superar "max_size" o al
+      cumplirse el periodo desde la última copia, renombrándolo a '<log>-AAAAMMDD-HHMMSS'. Para logs que
+      un proceso residente mantiene abiertos (downloadclean --daemon) se usa "copytruncate".
+    - Con "rotate_each": true, cada archivo que coincide con una "path" con comodines es un log fijo y
+      se rota por separado (los logs por aplicación 'restore_apps_<app>.log' de restaurarr.py).
+    - La compresión se hace en un pool de procesos con prioridad baja (nice 10), y se programa en cron
+      después de las copias de seguridad para no competir con ellas por la CPU.
+    - Si tras rotar el directorio supera "max_total_bytes", se borran los archivos más antiguos primero.
+      Nunca se borran los logs activos (rutas fijas de los trabajos) ni los escritos en la última hora.
+    - Los logs que escribe este script van a 'logs/logmanager.log'.
+    - Al empezar se borran los archivos '/etc/logrotate.d/<name>' (y sus copias '<name>.<fecha>.bak')
+      que generaba setup_logrotate_from_json.sh para los trabajos configurados, para que logrotate no
+      rote los mismos logs otra vez. Solo se borran si rotan logs de "log_dir"; hace falta ser root.
+"""
+
+import os
+import sys
+import glob
+import gzip
+import json
+import time
+import shutil
+import logging
+import argparse
+import subprocess
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+from datetime import datetime
+
+INSTALL_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+CONFIG_DIR = os.path.join(INSTALL_DIR, "configs")
+LOG_DIR = os.path.join(INSTALL_DIR, "logs")
+CONFIG_FILE = os.path.join(CONFIG_DIR, "logrotate_jobs_config.json")
+LEGACY_LOGROTATE_DIR = "/etc/logrotate.d"
+sys.path.insert(0, os.path.join(INSTALL_DIR, "lib"))
+
+from metrics import RunMetrics
+from fswalk import walk
+from fsutil import format_size, parse_size
+
+DEFAULT_WORKERS = 2
+DEFAULT_MIN_AGE_MINUTES = 60
+# Prioridad de los procesos que comprimen
+COMPRESS_NICE = 10
+COMPRESSED_SUFFIXES = {"zstd": ".zst", "gzip": ".gz"}
+ROTATED_DATE_FORMAT = "%Y%m%d-%H%M%S"
+PERIOD_DAYS = {"daily": 1, "weekly": 7, "monthly": 30}
+
+os.makedirs(LOG_DIR, exist_ok=True)
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s [%(levelname)s] [%(filename)s]: %(message)s',
+    handlers=[
+        logging.FileHandler(os.path.join(LOG_DIR, "logmanager.log")),
+        logging.StreamHandler()
+    ]
+)
+logger = logging.getLogger(__name__)
+metrics = RunMetrics("logmanager")
+
+def load_config(config_file):
+    try:
+        with open(config_file, "r") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        logger.error(f"Archivo de configuración '{config_file}' no encontrado.")
+    except json.JSONDecodeError as e:
+        logger.error(f"El archivo de configuración '{config_file}' no es un JSON válido: {e}")
+    return None
+
+def resolve_compression(name):
+    """Método de compresión disponible: zstd requiere el binario 'zstd'; si no está se usa gzip."""
+    if name == "zstd" and shutil.which("zstd") is None:
+        logger.warning("No se encontró el binario 'zstd'; se comprimirá con gzip.")
+        return "gzip"
+    if name not in COMPRESSED_SUFFIXES:
+        logger.warning(f"Compresión '{name}' desconocida; se usará gzip.")
+        return "gzip"
+    return name
+
+def is_compressed(path):
+    return path.endswith(tuple(COMPRESSED_SUFFIXES.values()))
+
+def lower_priority():
+    """Inicializador de los procesos del pool."""
+    try:
+        os.nice(COMPRESS_NICE)
+    except OSError:
+        pass
+
+def compress_file(path, method):
+    """Comprime 'path' junto a sí mismo, conserva permisos y mtime, y borra el original.
+
+    Se ejecuta en un proceso del pool. Devuelve (ruta, ruta comprimida, tamaño original, tamaño final).
+    """
+    target = path + COMPRESSED_SUFFIXES[method]
+    tmp_path = f"{target}.tmp"
+    original_size = os.path.getsize(path)
+    try:
+        if method == "zstd":
+            subprocess.run(["zstd", "-q", "-f", "-T1", "-o", tmp_path, path], check=True)
+        else:
+            with open(path, "rb") as src, gzip.open(tmp_path, "wb") as dst:
+                shutil.copyfileobj(src, dst, 1024 * 1024)
+        shutil.copystat(path, tmp_path)
+        os.replace(tmp_path, target)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    os.remove(path)
+    return path, target, original_size, os.path.getsize(target)
+
+def compress_all(paths, method, workers, dry_run=False):
+    """Comprime los archivos en un pool de procesos. Devuelve el número de errores."""
+    if not paths:
+        return 0
+    if dry_run:
+        for path in paths:
+            logger.info(f"[dry-run] Se comprimiría '{path}'.")
+        return 0
+
+    errors = 0
+    pending = set()
+    paths = iter(paths)
+    with ProcessPoolExecutor(max_workers=workers, initializer=lower_priority) as executor:
+        # Solo 'workers' tareas en vuelo, como en el resto de scripts
+        for path in paths:
+            pending.add(executor.submit(compress_file, path, method))
+            if len(pending) >= workers:
+                break
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                try:
+                    path, target, before, after = future.result()
+                except Exception as e:
+                    errors += 1
+                    logger.error(f"No se pudo comprimir un log: {e}")
+                    continue
+                metrics.incr("files_compressed")
+                metrics.incr("bytes_before_compression", before)
+                metrics.incr("bytes_after_compression", after)
+                logger.info(f"'{path}' comprimido: {format_size(before)} -> {format_size(after)}.")
+            for path in paths:
+                pending.add(executor.submit(compress_file, path, method))
+                if len(pending) >= workers:
+                    break
+    return errors
+
+def remove_file(path, reason, dry_run=False):
+    """Borra un log. Devuelve los bytes liberados."""
+    try:
+        size = os.path.getsize(path)
+        if dry_run:
+            logger.info(f"[dry-run] Se borraría '{path}' ({reason}).")
+            return size
+        os.remove(path)
+    except OSError as e:
+        logger.error(f"No se pudo borrar '{path}': {e}")
+        return 0
+    metrics.incr("files_deleted")
+    metrics.incr("bytes_deleted", size)
+    logger.info(f"'{path}' borrado ({reason}, {format_size(size)}).")
+    return size
+
+def apply_create(path, create):
+    """Crea el log vacío con "modo usuario grupo" tras rotarlo (clave "create" de logrotate)."""
+    parts = create.split()
+    with open(path, "a"):
+        pass
+    if parts:
+        os.chmod(path, int(parts[0], 8))
+    if len(parts) >= 3:
+        shutil.chown(path, parts[1], parts[2])
+
+def rotated_copies(path):
+    """Copias rotadas de un log fijo ('<log>-AAAAMMDD-HHMMSS[.gz|.zst]'), de la más reciente a la más antigua."""
+    copies = []
+    for candidate in glob.glob(glob.escape(path) + "-*"):
+        stamp = os.path.basename(candidate)[len(os.path.basename(path)) + 1:]
+        for suffix in COMPRESSED_SUFFIXES.values():
+            if stamp.endswith(suffix):
+                stamp = stamp[:-len(suffix)]
+        try:
+            copies.append((datetime.strptime(stamp, ROTATED_DATE_FORMAT), candidate))
+        except ValueError:
+            continue
+    copies.sort(reverse=True)
+    return copies
+
+def rotation_due(job, path, st, copies, now):
+    """Motivo por el que hay que rotar el log fijo 'path', o None."""
+    max_size = parse_size(job.get("max_size"))
+    if max_size is not None and st.st_size > max_size:
+        return f"supera {format_size(max_size)}"
+    for key, days in PERIOD_DAYS.items():
+        if job.get(key):
+            if not copies:
+                return "primera rotación"
+            if (now - copies[0][0]).total_seconds() >= days * 86400:
+                return f"periodo '{key}' cumplido"
+    return None
+
+def rotate_fixed(job, path, now, dry_run=False):
+    """Rota un log de ruta fija si toca. Devuelve la copia rotada (para comprimirla) o None."""
+    try:
+        st = os.stat(path)
+    except FileNotFoundError:
+        if not job.get("missingok"):
+            logger.warning(f"Trabajo '{job['name']}': el log '{path}' no existe.")
+        return None
+    if st.st_size == 0 and job.get("notifempty"):
+        return None
+    reason = rotation_due(job, path, st, rotated_copies(path), now)
+    if reason is None:
+        return None
+
+    target = f"{path}-{now.strftime(ROTATED_DATE_FORMAT)}"
+    if dry_run:
+        logger.info(f"[dry-run] Se rotaría '{path}' a '{target}' ({reason}).")
+        return None
+    if job.get("copytruncate"):
+        shutil.copy2(path, target)
+        with open(path, "r+") as f:
+            f.truncate(0)
+    else:
+        os.rename(path, target)
+        if job.get("create"):
+            apply_create(path, job["create"])
+    metrics.incr("files_rotated")
+    logger.info(f"'{path}' rotado a '{target}' ({reason}).")
+    return target
+
+def prune_copies(job, copies, now, protected, dry_run=False):
+    """Conserva las 'rotate' copias más recientes y borra las que superan 'max_age_days'.
+
+    'copies' es una lista de (mtime, ruta) de la más reciente a la más antigua. Devuelve las que quedan.
+    """
+    keep = job.get("rotate")
+    max_age_days = job.get("max_age_days")
+    remaining = []
+    for position, (mtime, candidate) in enumerate(copies):
+        if candidate not in protected:
+            if keep is not None and position >= keep:
+                remove_file(candidate, f"más de {keep} copias de '{job['name']}'", dry_run)
+                continue
+            if max_age_days is not None and now.timestamp() - mtime > max_age_days * 86400:
+                remove_file(candidate, f"más de {max_age_days} días", dry_run)
+                continue
+        remaining.append(candidate)
+    return remaining
+
+def fixed_logs(job):
+    """Logs que los scripts mantienen abiertos: la ruta fija o, con "rotate_each", cada coincidencia."""
+    path = job["path"]
+    if not glob.has_magic(path):
+        return [path]
+    return sorted(glob.glob(path)) if job.get("rotate_each") else []
+
+def process_job(job, now, min_age, dry_run=False):
+    """Rota y poda un trabajo. Devuelve (archivos que hay que comprimir, rotado algo)."""
+    path = job["path"]
+    to_compress = []
+    if glob.has_magic(path) and not job.get("rotate_each"):
+        # Un archivo por ejecución: el log de una ejecución en curso se escribe todavía
+        matches = glob.glob(path) + [c for s in COMPRESSED_SUFFIXES.values() for c in glob.glob(path + s)]
+        if not matches and not job.get("missingok"):
+            logger.warning(f"Trabajo '{job['name']}': ningún archivo coincide con '{path}'.")
+        copies = []
+        for candidate in matches:
+            try:
+                st = os.stat(candidate)
+            except OSError:
+                continue
+            if now.timestamp() - st.st_mtime < min_age:
+                continue
+            if st.st_size == 0 and job.get("notifempty") and not is_compressed(candidate):
+                continue
+            copies.append((st.st_mtime, candidate))
+        copies.sort(reverse=True)
+        remaining = prune_copies(job, copies, now, set(), dry_run)
+        if job.get("compress"):
+            to_compress = [c for c in remaining if not is_compressed(c)]
+        return to_compress, False
+
+    paths = fixed_logs(job)
+    if not paths and not job.get("missingok"):
+        logger.warning(f"Trabajo '{job['name']}': ningún archivo coincide con '{path}'.")
+    any_rotated = False
+    for path in paths:
+        rotated = rotate_fixed(job, path, now, dry_run)
+        if rotated and job.get("compress"):
+            to_compress.append(rotated)
+        copies = []
+        for _, candidate in rotated_copies(path):
+            try:
+                copies.append((os.path.getmtime(candidate), candidate))
+            except OSError:
+                continue
+        remaining = prune_copies(job, copies, now, {rotated}, dry_run)
+        if job.get("compress"):
+            to_compress.extend(c for c in remaining if not is_compressed(c) and c != rotated)
+        any_rotated = any_rotated or rotated is not None
+    return to_compress, any_rotated
+
+def run_postrotate(job, dry_run=False):
+    command = job.get("postrotate")
+    if not command:
+        return
+    if dry_run:
+        logger.info(f"[dry-run] Se ejecutaría el postrotate de '{job['name']}': {command}")
+        return
+    result = subprocess.run(command, shell=True)
+    if result.returncode != 0:
+        metrics.status = "error"
+        logger.error(f"El postrotate de '{job['name']}' terminó con código {result.returncode}.")
+
+def remove_legacy_logrotate(jobs, log_dir, dry_run=False):
+    """Borra los archivos de /etc/logrotate.d que generaba setup_logrotate_from_json.sh para 'jobs'."""
+    marker = log_dir.rstrip("/") + "/"
+    for job in jobs:
+        name = job.get("name")
+        if not name or os.path.basename(name) != name:
+            continue
+        base = os.path.join(LEGACY_LOGROTATE_DIR, name)
+        # create_backup (lib/utils.sh) dejaba copias '<name>.<fecha>.bak', que logrotate también lee
+        for path in [base] + sorted(glob.glob(f"{glob.escape(base)}.*.bak")):
+            try:
+                with open(path, "r") as f:
+                    content = f.read()
+            except FileNotFoundError:
+                continue
+            except OSError as e:
+                logger.error(f"No se pudo leer '{path}': {e}")
+                continue
+            # Un archivo con el mismo nombre que no rota nuestros logs no es de ese script
+            if marker not in content:
+                continue
+            if dry_run:
+                logger.info(f"[dry-run] Se borraría la configuración antigua de logrotate '{path}'.")
+                continue
+            try:
+                os.remove(path)
+            except OSError as e:
+                metrics.status = "error"
+                logger.error(f"No se pudo borrar la configuración antigua de logrotate '{path}': {e}")
+                continue
+            logger.info(f"Configuración antigua de logrotate '{path}' borrada.")
+
+def enforce_budget(log_dir, max_total_bytes, active, min_age, dry_run=False):
+    """Borra los archivos más antiguos de 'log_dir' hasta quedar por debajo de 'max_total_bytes'."""
+    now = time.time()
+    total = 0
+    candidates = []
+    for dirpath, dirs, files in walk(log_dir):
+        for entry in files:
+            try:
+                st = entry.stat(follow_symlinks=False)
+            except OSError:
+                continue
+            total += st.st_size
+            if entry.path not in active and now - st.st_mtime >= min_age:
+                candidates.append((st.st_mtime, entry.path, st.st_size))
+    metrics.set("log_dir_bytes", total)
+    if total <= max_total_bytes:
+        logger.info(f"'{log_dir}' ocupa {format_size(total)} de {format_size(max_total_bytes)}.")
+        return
+
+    logger.warning(f"'{log_dir}' ocupa {format_size(total)}, por encima de {format_size(max_total_bytes)}.")
+    for _, path, size in sorted(candidates):
+        if total <= max_total_bytes:
+            break
+        if remove_file(path, "presupuesto del directorio de logs", dry_run):
+            total -= size
+    if total > max_total_bytes:
+        metrics.status = "error"
+        logger.error(
+            f"'{log_dir}' sigue ocupando {format_size(total)}: el resto son logs activos o recientes."
+        )
+    metrics.set("log_dir_bytes", total)
+
+def remove_empty_dirs(log_dir, min_age, dry_run=False):
+    """Borra los subdirectorios de ejecución (backup_orchestrator_<id>) que se han quedado vacíos."""
+    now = time.time()
+    for dirpath, dirs, files in walk(log_dir, topdown=False):
+        if dirpath == log_dir or files or any(os.path.isdir(d.path) for d in dirs):
+            continue
+        try:
+            if now - os.stat(dirpath).st_mtime < min_age:
+                continue
+            if dry_run:
+                logger.info(f"[dry-run] Se borraría el directorio vacío '{dirpath}'.")
+            else:
+                os.rmdir(dirpath)
+                logger.info(f"Directorio vacío '{dirpath}' borrado.")
+        except OSError as e:
+            logger.error(f"No se pudo borrar el directorio '{dirpath}': {e}")
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Rota, comprime y poda los logs de confiraspa.")
+    parser.add_argument("--config", default=CONFIG_FILE, help="Archivo de configuración.")
+    parser.add_argument("--dry-run", action="store_true", help="Solo informa de lo que se haría.")
+    return parser.parse_args()
+
+def main():
+    args = parse_args()
+    if args.dry_run:
+        run(args)
+    else:
+        with metrics:
+            run(args)
+
+def run(args):
+    config = load_config(args.config)
+    if config is None:
+        sys.exit(1)
+    jobs = config.get("jobs") or []
+    log_dir = config.get("log_dir", LOG_DIR)
+    method = resolve_compression(config.get("compression", "gzip"))
+    workers = max(1, config.get("workers", DEFAULT_WORKERS))
+    now = datetime.now()
+    remove_legacy_logrotate(jobs, log_dir, args.dry_run)
+
+    to_compress = []
+    active = set()
+    with metrics.span("rotate"):
+        for job in jobs:
+            if "name" not in job or "path" not in job:
+                logger.error(f"Trabajo sin 'name' o 'path' en la configuración: {job}")
+                metrics.status = "error"
+                continue
+            min_age = job.get("min_age_minutes", DEFAULT_MIN_AGE_MINUTES) * 60
+            active.update(fixed_logs(job))
+            try:
+                files, rotated = process_job(job, now, min_age, args.dry_run)
+            except OSError as e:
+                logger.error(f"Error en el trabajo '{job['name']}': {e}")
+                metrics.status = "error"
+                continue
+            to_compress.extend(files)
+            if rotated:
+                run_postrotate(job, args.dry_run)
+
+    with metrics.span("compress"):
+        if compress_all(to_compress, method, workers, args.dry_run):
+            metrics.status = "error"
+
+    max_total_bytes = parse_size(config.get("max_total_bytes"))
+    if max_total_bytes is not None and os.path.isdir(log_dir):
+        with metrics.span("budget"):
+            enforce_budget(log_dir, max_total_bytes, active, DEFAULT_MIN_AGE_MINUTES * 60, args.dry_run)
+    if os.path.isdir(log_dir):
+        remove_empty_dirs(log_dir, DEFAULT_MIN_AGE_MINUTES * 60, args.dry_run)
+    logger.info("Proceso completado.")
+
+if __name__ == "__main__":
+    main()
@@ -9,41 +9,89 @@ Version: 2.1.1
 Date: 2023-10-30
 License: GNU
 Usage: Ejecuta el script manualmente o programa su ejecución en crontab.
-Dependencies: Python 3, json, os, shutil, tarfile, zipfile, subprocess, time, logging.
+       python3 restaurarr.py [--workers N] [--apps radarr sonarr ...]
+       python3 restaurarr.py --snapshot radarr_2024-05-26_03-15-22 [...]
+Dependencies: Python 3, json, os, shutil, tarfile, zipfile, subprocess, time, logging, threading, concurrent.futures.
 Notes:
 - Asegúrate de que las rutas de origen y destino estén montadas antes de ejecutar este script.
 - Es recomendable reiniciar el sistema después de la restauración para que las aplicaciones reconozcan los cambios.
 - Este script debe ejecutarse con permisos adecuados (por ejemplo, como root) para poder detener/iniciar servicios y modificar archivos en directorios del sistema.
+- Con '--workers N' se restauran varias aplicaciones en paralelo. El campo opcional 'depends_on' de
+  'restore_apps.json' obliga a esperar a otras aplicaciones (por ejemplo, prowlarr antes que las *arr).
+  Solo fija el orden: si una dependencia falla, la aplicación dependiente se restaura igualmente con un
+  aviso. Con '"require": true' en la aplicación dependiente, no se restaura si falla alguna dependencia.
+- Cada aplicación deja además su propio log ('restore_apps_<app>.log') y al final se muestra una tabla
+  resumen con el resultado y los tiempos de cada fase.
+- De los backups ZIP/TAR solo se extraen los archivos de 'files_to_restore', en streaming y directamente a su destino.
+- Durante la misma lectura se calculan CRC32 y SHA256 de cada archivo y se comparan con el tamaño y el CRC
+  del backup; las bases de datos SQLite pasan además un 'PRAGMA quick_check' antes de sustituir al archivo
+  en uso. El resultado se guarda en 'restore_manifest.json' (junto a 'backup_orig'), que permite que la
+  siguiente restauración omita los archivos que ya son idénticos (backups ZIP y directorios).
+- La extracción se hace en un directorio de preparación ('.restore_staging') dentro de 'restore_dir'
+  mientras la aplicación sigue en marcha. El servicio solo se detiene para el intercambio, que se hace
+  con renombrados atómicos: los archivos en uso pasan a 'backup_orig' y los preparados ocupan su lugar.
+  Si algo falla durante el intercambio se deshacen los renombrados y el servicio vuelve a arrancar.
+- Con '--snapshot <ID>' la aplicación de la instantánea se restaura desde el almacén deduplicado de
+  'arr_snapshot.py' en lugar de desde su último ZIP. Los bloques se copian sin pasar por espacio de
+  usuario, así que no hay CRC que comprobar en el flujo: se verifican el tamaño y, en las bases de
+  datos SQLite, 'PRAGMA quick_check'. 'arr_snapshot.py verify' comprueba el SHA256 de los bloques.
 """
 
 import json
 import os
+import sys
 import shutil
+import sqlite3
+import zlib
+import hashlib
 import tarfile
 import zipfile
 import subprocess
 import time
 import logging
+import argparse
+import threading
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from datetime import datetime
 from logging.handlers import RotatingFileHandler
 
 # Configuración global
+INSTALL_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(INSTALL_DIR, "lib"))
+
+from backup_catalog import BackupCatalog
+from snapshot_store import SnapshotStore, DEFAULT_CHUNK_SIZE
+from metrics import RunMetrics
+
 CONFIG_DIR = "/opt/confiraspa/configs"
 CONFIG_FILE = os.path.join(CONFIG_DIR, "restore_apps.json")
-LOG_FILE = "restore_apps.log"
+SNAPSHOT_CONFIG_FILE = os.path.join(CONFIG_DIR, "arr_snapshot.json")
+LOG_DIR = os.path.join(INSTALL_DIR, "logs")
+LOG_FILE = os.path.join(LOG_DIR, "restore_apps.log")
 MAX_LOG_SIZE = 5 * 1024 * 1024  # 5 MB
 BACKUP_ORIG_DIR_NAME = "backup_orig"
+STAGING_DIR_NAME = ".restore_staging"
+STREAM_CHUNK_SIZE = 1024 * 1024  # 1 MB por bloque al extraer
+MANIFEST_FILE_NAME = "restore_manifest.json"
+SQLITE_HEADER = b"SQLite format 3\x00"
+# Fases de una restauración, en el orden en que se muestran en el resumen
+RESTORE_PHASES = ["buscar", "extraer", "permisos", "detener", "renombrar", "iniciar"]
 
 # Definir el logger a nivel global
 logger = logging.getLogger("RestoreApps")
+# Métricas de la ejecución: tiempo acumulado por fase y volumen restaurado
+metrics = RunMetrics("restaurarr")
 
 def setup_logging():
     """Configura el sistema de logging."""
     logger.setLevel(logging.INFO)
+    os.makedirs(LOG_DIR, exist_ok=True)
 
     # Crear handler para archivo de log con rotación
     handler = RotatingFileHandler(LOG_FILE, maxBytes=MAX_LOG_SIZE, backupCount=3)
     formatter = logging.Formatter(
-        "%(asctime)s - %(name)s - %(levelname)s - %(message)s"
+        "%(asctime)s - %(name)s - [%(threadName)s] - %(levelname)s - %(message)s"
     )
     handler.setFormatter(formatter)
     logger.addHandler(handler)
@@ -53,6 +101,43 @@ def setup_logging():
     console_handler.setFormatter(formatter)
     logger.addHandler(console_handler)
 
+class VerificationError(Exception):
+    """Un archivo restaurado no coincide con el backup o está dañado."""
+
+class AppLogFilter(logging.Filter):
+    """Deja pasar solo los mensajes emitidos por el hilo que restaura una aplicación."""
+
+    def __init__(self, app):
+        super().__init__()
+        self.app = app
+
+    def filter(self, record):
+        return record.threadName == self.app
+
+@contextmanager
+def app_log(app):
+    """Envía a 'restore_apps_<app>.log' los mensajes del hilo actual mientras se restaura 'app'."""
+    threading.current_thread().name = app
+    handler = logging.FileHandler(os.path.join(LOG_DIR, f"restore_apps_{app}.log"))
+    handler.setFormatter(logging.Formatter("%(asctime)s - %(levelname)s - %(message)s"))
+    handler.addFilter(AppLogFilter(app))
+    logger.addHandler(handler)
+    try:
+        yield
+    finally:
+        logger.removeHandler(handler)
+        handler.close()
+
+@contextmanager
+def phase(result, name):
+    """Mide la duración de una fase de la restauración y la guarda en 'result'."""
+    start = time.monotonic()
+    try:
+        yield
+    finally:
+        result["phases"][name] = time.monotonic() - start
+        metrics.add_span(name, result["phases"][name])
+
 def load_config(config_file):
     """Carga el contenido de un archivo JSON y lo devuelve como diccionario."""
     if not os.path.exists(config_file):
@@ -67,33 +152,24 @@ def load_config(config_file):
         logger.error(f"Error al parsear el archivo JSON: {e}")
         return None
 
-def get_latest_backup(backup_dir, backup_ext):
-    """Devuelve la ruta completa del backup más reciente (archivo o directorio)."""
+def get_latest_backup(backup_dir, backup_ext, catalog):
+    """Devuelve la ruta completa del backup más reciente (archivo o directorio).
+
+    El orden lo da el catálogo de backups: fecha del nombre (patrón *arr) o, si no tiene, mtime.
+    """
     if not os.path.exists(backup_dir):
         logger.error(f"El directorio de backup '{backup_dir}' no existe.")
         return None
 
-    if backup_ext:
-        backup_items = [
-            f for f in os.listdir(backup_dir)
-            if f.endswith(backup_ext) and os.path.isfile(os.path.join(backup_dir, f))
-        ]
-    else:
-        # Incluir archivos y directorios cuando backup_ext está vacío
-        backup_items = [
-            f for f in os.listdir(backup_dir)
-            if os.path.isfile(os.path.join(backup_dir, f)) or os.path.isdir(os.path.join(backup_dir, f))
-        ]
-
-    if not backup_items:
+    catalog.refresh(backup_dir)
+    # Con extensión solo se consideran archivos; sin ella, también directorios
+    latest = catalog.latest(backup_dir, ext=backup_ext or None, include_dirs=not backup_ext)
+
+    if latest is None:
         logger.error(f"No se encontraron backups en '{backup_dir}'.")
         return None
 
-    backup_items.sort(
-        key=lambda f: os.path.getmtime(os.path.join(backup_dir, f)),
-        reverse=True
-    )
-    latest_backup = os.path.join(backup_dir, backup_items[0])
+    latest_backup = latest.path
     logger.info(f"Último backup encontrado: '{latest_backup}'.")
     return latest_backup
 
@@ -127,82 +203,317 @@ def start_app(app):
         logger.error(f"Error al iniciar la aplicación '{app}': {e.stderr.decode().strip()}")
         # No levantar excepción
 
-def backup_original_files(files, restore_dir, backup_orig_dir):
-    """Realiza una copia de seguridad de los archivos originales."""
-    if not os.path.exists(backup_orig_dir):
-        os.makedirs(backup_orig_dir)
-        logger.info(f"Directorio '{backup_orig_dir}' creado para el backup de archivos originales.")
-
-    for file in files:
-        src_path = os.path.join(restore_dir, file)
-        dst_path = os.path.join(backup_orig_dir, file)
-        if os.path.exists(src_path):
-            os.makedirs(os.path.dirname(dst_path), exist_ok=True)
-            shutil.copy2(src_path, dst_path)
-            logger.info(f"Archivo '{src_path}' copiado a '{dst_path}'.")
-        else:
-            logger.warning(f"Archivo original '{src_path}' no encontrado; no se pudo hacer backup.")
-
 def is_within_directory(directory, target):
     """Verifica si 'target' está dentro de 'directory'."""
     abs_directory = os.path.abspath(directory)
     abs_target = os.path.abspath(target)
-    return os.path.commonprefix([abs_directory, abs_target]) == abs_directory
-
-def safe_extract_tar(tar, path=".", members=None):
-    """Extrae archivos de manera segura desde un archivo TAR."""
-    for member in tar.getmembers():
-        member_path = os.path.join(path, member.name)
-        if not is_within_directory(path, member_path):
-            logger.error(f"Intento de extracción inseguro detectado en '{member.name}'.")
-            raise Exception("Intento de Path Traversal en el archivo TAR.")
-    tar.extractall(path, members)
-
-def safe_extract_zip(zip_file, path):
-    """Extrae archivos de manera segura desde un archivo ZIP."""
-    for member in zip_file.namelist():
-        member_path = os.path.realpath(os.path.join(path, member))
-        if not member_path.startswith(os.path.realpath(path)):
-            logger.error(f"Intento de extracción inseguro detectado en '{member}'.")
-            raise Exception("Intento de Path Traversal en el archivo ZIP.")
-    zip_file.extractall(path)
-
-def extract_backup(backup_file, backup_ext, files, restore_dir):
-    """Extrae los archivos especificados desde el backup al directorio de restauración."""
+    return os.path.commonpath([abs_directory, abs_target]) == abs_directory
+
+def normalize_member_name(name):
+    """Normaliza el nombre de un miembro de un archivo comprimido ('./a/b' -> 'a/b')."""
+    return os.path.normpath(name.replace("\\", "/")).lstrip("/")
+
+def check_sqlite_database(path):
+    """Ejecuta 'PRAGMA quick_check' sobre una base de datos SQLite en modo solo lectura."""
+    conn = sqlite3.connect(f"file:{path}?mode=ro&immutable=1", uri=True)
+    try:
+        result = conn.execute("PRAGMA quick_check").fetchone()[0]
+    finally:
+        conn.close()
+    if result != "ok":
+        summary = "; ".join(result.splitlines()[:3])
+        raise VerificationError(f"'PRAGMA quick_check' ha fallado: {summary}")
+    return result
+
+def stream_to_file(src, dst_path, expected_size=None, expected_crc=None):
+    """Copia un flujo a 'dst_path' por bloques verificándolo en la misma pasada.
+
+    Se escribe en un temporal que solo sustituye al destino si el tamaño y el CRC32 coinciden con
+    lo esperado y, si es una base de datos SQLite, si pasa 'PRAGMA quick_check'. Devuelve un
+    diccionario con sha256, crc32, size y el resultado de la comprobación SQLite.
+    """
+    os.makedirs(os.path.dirname(dst_path), exist_ok=True)
+    tmp_path = f"{dst_path}.restoring"
+    hasher = hashlib.sha256()
+    crc = 0
+    size = 0
+    header = b""
+    try:
+        with open(tmp_path, "wb") as dst:
+            for chunk in iter(lambda: src.read(STREAM_CHUNK_SIZE), b""):
+                if size == 0:
+                    header = chunk[:len(SQLITE_HEADER)]
+                hasher.update(chunk)
+                crc = zlib.crc32(chunk, crc)
+                size += len(chunk)
+                dst.write(chunk)
+
+        if expected_size is not None and size != expected_size:
+            raise VerificationError(f"tamaño {size} distinto del esperado {expected_size}")
+        if expected_crc is not None and crc != expected_crc:
+            raise VerificationError(f"CRC32 {crc:08x} distinto del esperado {expected_crc:08x}")
+        sqlite_check = check_sqlite_database(tmp_path) if header == SQLITE_HEADER else None
+
+        os.replace(tmp_path, dst_path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    return {"sha256": hasher.hexdigest(), "crc32": crc, "size": size, "sqlite_check": sqlite_check}
+
+def verify_restored_file(path, expected_size):
+    """Verifica un archivo ya escrito: tamaño y, si es una base de datos SQLite, 'PRAGMA quick_check'."""
+    size = os.path.getsize(path)
+    if size != expected_size:
+        raise VerificationError(f"tamaño {size} distinto del esperado {expected_size}")
+    with open(path, "rb") as f:
+        header = f.read(len(SQLITE_HEADER))
+    return check_sqlite_database(path) if header == SQLITE_HEADER else None
+
+def load_manifest(restore_dir):
+    """Carga el manifiesto de la última restauración (o uno vacío)."""
+    try:
+        with open(os.path.join(restore_dir, MANIFEST_FILE_NAME), "r") as f:
+            manifest = json.load(f)
+        if isinstance(manifest.get("files"), dict):
+            return manifest
+    except (OSError, json.JSONDecodeError, AttributeError):
+        pass
+    return {"files": {}}
+
+def save_manifest(restore_dir, manifest):
+    """Guarda el manifiesto de forma atómica."""
+    manifest_path = os.path.join(restore_dir, MANIFEST_FILE_NAME)
+    tmp_path = f"{manifest_path}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    os.replace(tmp_path, manifest_path)
+    logger.info(f"Manifiesto de restauración guardado en '{manifest_path}'.")
+
+def is_already_restored(manifest, name, dst_path, source):
+    """Comprueba si 'dst_path' sigue siendo el archivo que se restauró desde un origen idéntico."""
+    record = manifest["files"].get(name)
+    if not record or record.get("source") != source:
+        return False
+    try:
+        st = os.stat(dst_path)
+    except OSError:
+        return False
+    return st.st_size == record.get("size") and st.st_mtime_ns == record.get("mtime_ns")
+
+def record_restored(manifest, name, dst_path, source, result):
+    """Añade al manifiesto el resultado de restaurar 'name'."""
+    st = os.stat(dst_path)
+    manifest["files"][name] = dict(result, source=source, mtime_ns=st.st_mtime_ns)
+
+def resolve_destinations(files, restore_dir, staging_dir):
+    """Devuelve {nombre normalizado: (ruta en uso, ruta preparada)} descartando rutas inseguras."""
+    destinations = {}
+    for file in files:
+        live_path = os.path.join(restore_dir, file)
+        if not is_within_directory(restore_dir, live_path):
+            logger.error(f"Ruta de restauración insegura ignorada: '{file}'.")
+            continue
+        name = normalize_member_name(file)
+        destinations[name] = (live_path, os.path.join(staging_dir, name))
+    return destinations
+
+def extract_zip_members(backup_file, destinations, manifest):
+    """Prepara desde un ZIP solo los miembros indicados, en streaming.
+
+    Devuelve (preparados, sin cambios): los nombres extraídos al directorio de preparación y los que
+    se omiten porque el archivo en uso ya es idéntico.
+    """
+    staged, unchanged = [], []
+    with zipfile.ZipFile(backup_file, "r") as zf:
+        # infolist() solo lee el directorio central, no el contenido
+        members = {normalize_member_name(i.filename): i for i in zf.infolist() if not i.is_dir()}
+        for name, (live_path, staged_path) in destinations.items():
+            info = members.get(name)
+            if info is None:
+                logger.warning(f"Archivo '{name}' no encontrado en el backup '{backup_file}'.")
+                continue
+            source = {"crc32": info.CRC, "size": info.file_size}
+            if is_already_restored(manifest, name, live_path, source):
+                logger.info(f"Archivo '{name}' ya es idéntico al del backup; no se extrae.")
+                unchanged.append(name)
+                continue
+            with zf.open(info) as src:
+                result = stream_to_file(src, staged_path, info.file_size, info.CRC)
+            record_restored(manifest, name, staged_path, source, result)
+            logger.info(f"Archivo '{name}' extraído y verificado en '{staged_path}' (SHA256 {result['sha256']}).")
+            staged.append(name)
+    return staged, unchanged
+
+def extract_tar_members(backup_file, destinations, manifest):
+    """Prepara desde un TAR solo los miembros indicados en una única pasada hacia delante."""
+    pending = dict(destinations)
+    staged = []
+    # Modo 'r|*': lectura secuencial sin getmembers() ni retrocesos
+    with tarfile.open(backup_file, "r|*") as tf:
+        for member in tf:
+            name = normalize_member_name(member.name)
+            if name not in pending or not member.isfile():
+                continue
+            _, staged_path = pending.pop(name)
+            src = tf.extractfile(member)
+            # TAR no guarda CRC de los datos: solo se puede comprobar el tamaño
+            result = stream_to_file(src, staged_path, member.size)
+            record_restored(manifest, name, staged_path, {"size": member.size, "mtime": member.mtime}, result)
+            logger.info(f"Archivo '{name}' extraído y verificado en '{staged_path}' (SHA256 {result['sha256']}).")
+            staged.append(name)
+            if not pending:
+                break
+    for name in pending:
+        logger.warning(f"Archivo '{name}' no encontrado en el backup '{backup_file}'.")
+    return staged, []
+
+def copy_backup_files(backup_dir, destinations, manifest):
+    """Prepara los archivos indicados desde un backup sin comprimir (directorio)."""
+    staged, unchanged = [], []
+    for name, (live_path, staged_path) in destinations.items():
+        src_path = os.path.join(backup_dir, name)
+        try:
+            src_stat = os.stat(src_path)
+        except FileNotFoundError:
+            logger.warning(f"Archivo '{src_path}' no encontrado en el backup.")
+            continue
+        source = {"path": src_path, "size": src_stat.st_size, "mtime_ns": src_stat.st_mtime_ns}
+        if is_already_restored(manifest, name, live_path, source):
+            logger.info(f"Archivo '{name}' ya es idéntico al del backup; no se copia.")
+            unchanged.append(name)
+            continue
+        with open(src_path, "rb") as src:
+            result = stream_to_file(src, staged_path, src_stat.st_size)
+        shutil.copystat(src_path, staged_path)
+        record_restored(manifest, name, staged_path, source, result)
+        logger.info(f"Archivo '{src_path}' copiado y verificado en '{staged_path}'.")
+        staged.append(name)
+    return staged, unchanged
+
+def extract_snapshot_members(store, snapshot, destinations, manifest):
+    """Prepara desde una instantánea del almacén deduplicado los archivos indicados."""
+    staged, unchanged = [], []
+    for name, (live_path, staged_path) in destinations.items():
+        record = snapshot["files"].get(name)
+        if record is None:
+            logger.warning(f"Archivo '{name}' no encontrado en la instantánea '{snapshot['id']}'.")
+            continue
+        source = {"sha256": record["sha256"], "size": record["size"]}
+        if is_already_restored(manifest, name, live_path, source):
+            logger.info(f"Archivo '{name}' ya es idéntico al de la instantánea; no se restaura.")
+            unchanged.append(name)
+            continue
+        os.makedirs(os.path.dirname(staged_path), exist_ok=True)
+        tmp_path = f"{staged_path}.restoring"
+        try:
+            # Se calcula el SHA256 de lo escrito: el manifiesto no puede dar por bueno un bloque dañado
+            sha256 = store.restore_file(record, tmp_path, verify=True)
+            if sha256 != record["sha256"]:
+                raise VerificationError(f"SHA256 {sha256} distinto del esperado {record['sha256']}")
+            sqlite_check = verify_restored_file(tmp_path, record["size"])
+            os.replace(tmp_path, staged_path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        result = {"sha256": sha256, "crc32": None, "size": record["size"], "sqlite_check": sqlite_check}
+        record_restored(manifest, name, staged_path, source, result)
+        logger.info(f"Archivo '{name}' restaurado y verificado desde la instantánea en '{staged_path}' (SHA256 {sha256}).")
+        staged.append(name)
+    return staged, unchanged
+
+def open_snapshot(snapshot_id):
+    """Abre el almacén deduplicado y carga una instantánea. Devuelve (almacén, instantánea) o None."""
+    snapshot_config = load_config(SNAPSHOT_CONFIG_FILE)
+    if snapshot_config is None:
+        return None
+    store = SnapshotStore(snapshot_config["store_dir"], snapshot_config.get("chunk_size", DEFAULT_CHUNK_SIZE))
+    try:
+        return store, store.load(snapshot_id)
+    except (OSError, json.JSONDecodeError) as e:
+        logger.error(f"No se pudo cargar la instantánea '{snapshot_id}': {e}")
+        return None
+
+def extract_backup(backup_file, backup_ext, files, restore_dir, staging_dir, snapshot_source=None):
+    """Prepara en 'staging_dir' los archivos especificados del backup sin tocar los que están en uso.
+
+    Con 'snapshot_source' = (almacén, instantánea) se restaura desde el almacén deduplicado y
+    'backup_file' solo se usa en los mensajes.
+
+    Devuelve (manifiesto, preparados, sin cambios), o None si la extracción falla o no se encuentra
+    ninguno de los archivos. El manifiesto se guarda después del intercambio.
+    """
     logger.info(f"Extrayendo archivos desde el backup '{backup_file}'...")
-    if backup_ext == ".zip":
-        with zipfile.ZipFile(backup_file, "r") as zf:
-            try:
-                safe_extract_zip(zf, restore_dir)
-                logger.info(f"Archivos extraídos exitosamente desde '{backup_file}'.")
-            except Exception as e:
-                logger.error(f"Error durante la extracción del archivo ZIP: {e}")
-                return False
-    elif backup_ext in [".tar", ".tar.gz", ".tgz"]:
-        with tarfile.open(backup_file, "r:*") as tf:
+    manifest = load_manifest(restore_dir)
+    destinations = resolve_destinations(files, restore_dir, staging_dir)
+    try:
+        if snapshot_source is not None:
+            store, snapshot = snapshot_source
+            staged, unchanged = extract_snapshot_members(store, snapshot, destinations, manifest)
+        elif backup_ext == ".zip":
+            staged, unchanged = extract_zip_members(backup_file, destinations, manifest)
+        elif backup_ext in [".tar", ".tar.gz", ".tgz"]:
+            staged, unchanged = extract_tar_members(backup_file, destinations, manifest)
+        else:
+            # Asumimos que el backup es un directorio o un archivo sin comprimir
+            staged, unchanged = copy_backup_files(backup_file, destinations, manifest)
+    except VerificationError as e:
+        logger.error(f"Verificación fallida al restaurar desde '{backup_file}': {e}. El archivo en uso no se ha modificado.")
+        return None
+    except Exception as e:
+        logger.error(f"Error durante la extracción del backup '{backup_file}': {e}")
+        return None
+
+    if not staged and not unchanged:
+        logger.error(f"No se encontró ninguno de los archivos a restaurar en '{backup_file}'.")
+        return None
+
+    manifest["backup_file"] = backup_file
+    metrics.incr("files_restored", len(staged))
+    metrics.incr("files_unchanged", len(unchanged))
+    metrics.incr("bytes_restored", sum(manifest["files"][name]["size"] for name in staged))
+    logger.info(
+        f"{len(staged)} archivos preparados y {len(unchanged)} sin cambios de {len(files)} "
+        f"desde '{backup_file}'."
+    )
+    return manifest, staged, unchanged
+
+def swap_into_place(names, restore_dir, staging_dir, backup_orig_dir):
+    """Sustituye los archivos en uso por los preparados mediante renombrados atómicos.
+
+    Cada archivo en uso se mueve a 'backup_orig_dir' (sustituyendo la copia anterior) y el preparado
+    ocupa su lugar. Todo está en el mismo sistema de archivos, así que no se copia ningún dato. Si un
+    renombrado falla se deshacen los ya hechos, en orden inverso, y se relanza la excepción.
+    """
+    done = []  # (origen, destino) de cada renombrado completado
+    try:
+        for name in names:
+            live_path = os.path.join(restore_dir, name)
+            staged_path = os.path.join(staging_dir, name)
+            orig_path = os.path.join(backup_orig_dir, name)
+            if os.path.lexists(live_path):
+                os.makedirs(os.path.dirname(orig_path), exist_ok=True)
+                os.replace(live_path, orig_path)
+                done.append((live_path, orig_path))
+            os.makedirs(os.path.dirname(live_path), exist_ok=True)
+            os.replace(staged_path, live_path)
+            done.append((staged_path, live_path))
+            logger.info(f"Archivo '{live_path}' sustituido; el anterior se conserva en '{orig_path}'.")
+    except OSError as e:
+        logger.error(f"Error durante el intercambio de archivos: {e}. Deshaciendo cambios...")
+        for src, dst in reversed(done):
             try:
-                safe_extract_tar(tf, restore_dir)
-                logger.info(f"Archivos extraídos exitosamente desde '{backup_file}'.")
-            except Exception as e:
-                logger.error(f"Error durante la extracción del archivo TAR: {e}")
-                return False
-    else:
-        # Asumimos que el backup es un directorio o un archivo sin comprimir
-        for file in files:
-            src_path = os.path.join(backup_file, file)
-            dst_path = os.path.join(restore_dir, file)
-            if os.path.exists(src_path):
-                os.makedirs(os.path.dirname(dst_path), exist_ok=True)
-                shutil.copy2(src_path, dst_path)
-                logger.info(f"Archivo '{src_path}' copiado a '{dst_path}'.")
-            else:
-                logger.warning(f"Archivo '{src_path}' no encontrado en el backup.")
-        logger.info(f"Archivos copiados exitosamente desde '{backup_file}'.")
-    return True
+                os.replace(dst, src)
+            except OSError as rollback_error:
+                logger.error(f"No se pudo deshacer el renombrado '{src}' -> '{dst}': {rollback_error}")
+        raise
 
-def change_permissions(permissions, restore_dir, ownerships=None):
-    """Cambia los permisos y propiedad de los archivos restaurados."""
+def change_permissions(permissions, restore_dir, ownerships=None, only=None):
+    """Cambia los permisos y propiedad de los archivos restaurados (solo los de 'only', si se indica)."""
     for file, perm in permissions.items():
+        if only is not None and normalize_member_name(file) not in only:
+            continue
         file_path = os.path.join(restore_dir, file)
         if os.path.exists(file_path):
             try:
@@ -227,13 +538,27 @@ def validate_config(app_config):
             return False
     return True
 
-def restore_app(app, app_config):
-    """Restaura una aplicación según su configuración."""
+def restore_app(app, app_config, catalog):
+    """Restaura una aplicación según su configuración. 'catalog' es el catálogo de backups compartido.
+
+    Devuelve un diccionario con el estado ('ok', 'error' u 'omitida') y la duración de cada fase.
+    """
+    result = {"app": app, "status": "error", "phases": {}, "error": None}
+    start = time.monotonic()
+    try:
+        with app_log(app):
+            _restore_app(app, app_config, catalog, result)
+    finally:
+        result["phases"]["total"] = time.monotonic() - start
+    return result
+
+def _restore_app(app, app_config, catalog, result):
     logger.info(f"--- Iniciando restauración de '{app}' ---")
 
     # Validar configuración
     if not validate_config(app_config):
         logger.error(f"Configuración inválida para la aplicación '{app}'. Saltando.")
+        result["error"] = "configuración inválida"
         return
 
     backup_dir = app_config.get("backup_dir")
@@ -250,47 +575,162 @@ def restore_app(app, app_config):
     # Validar rutas
     if not os.path.isabs(backup_dir) or not os.path.isabs(restore_dir):
         logger.error(f"Las rutas 'backup_dir' y 'restore_dir' deben ser absolutas.")
+        result["error"] = "rutas no absolutas"
         return
 
-    # Detener la aplicación si no es 'rclone' (no es un servicio)
-    if app.lower() != "rclone":
-        stop_app(app)
-    else:
-        logger.info(f"La aplicación '{app}' no es un servicio; no se requiere detener.")
-
-    # Crear directorio de restauración si no existe
-    os.makedirs(restore_dir, exist_ok=True)
-
-    # Realizar backup de archivos originales
-    backup_orig_dir = os.path.join(restore_dir, BACKUP_ORIG_DIR_NAME)
-    backup_original_files(files, restore_dir, backup_orig_dir)
+    is_service = app.lower() != "rclone"  # rclone no es un servicio
 
-    # Obtener el último backup disponible
-    backup_file = get_latest_backup(backup_dir, backup_ext)
+    # Obtener el último backup disponible, o la instantánea pedida (la aplicación sigue en marcha)
+    snapshot_source = None
+    with phase(result, "buscar"):
+        if app_config.get("snapshot_id"):
+            snapshot_source = open_snapshot(app_config["snapshot_id"])
+            backup_file = f"instantánea {app_config['snapshot_id']}" if snapshot_source else None
+        else:
+            backup_file = get_latest_backup(backup_dir, backup_ext, catalog)
     if not backup_file:
         logger.error(f"No se pudo encontrar un backup válido para '{app}'.")
+        result["error"] = "sin backup"
         return
 
-    # Restaurar archivos desde el backup
-    success = extract_backup(backup_file, backup_ext, files, restore_dir)
-    if not success:
-        logger.error(f"Error durante la extracción de archivos para '{app}'.")
-        return
-
-    # Cambiar permisos y propiedad de archivos restaurados
-    change_permissions(permissions, restore_dir, ownerships)
-
-    # Iniciar la aplicación si no es 'rclone'
-    if app.lower() != "rclone":
-        start_app(app)
-    else:
-        logger.info(f"La aplicación '{app}' no es un servicio; no se requiere iniciar.")
+    # Preparar los archivos en un directorio del mismo sistema de archivos que 'restore_dir'
+    os.makedirs(restore_dir, exist_ok=True)
+    staging_dir = os.path.join(restore_dir, STAGING_DIR_NAME)
+    shutil.rmtree(staging_dir, ignore_errors=True)
+    try:
+        with phase(result, "extraer"):
+            extracted = extract_backup(backup_file, backup_ext, files, restore_dir, staging_dir, snapshot_source)
+        if not extracted:
+            logger.error(f"Error durante la extracción de archivos para '{app}'.")
+            result["error"] = "fallo en la extracción"
+            return
+        manifest, staged, unchanged = extracted
+
+        # Permisos y propiedad se aplican antes del intercambio, sobre los archivos preparados
+        with phase(result, "permisos"):
+            change_permissions(permissions, staging_dir, ownerships, only=set(staged))
+
+        if not staged:
+            logger.info(f"Todos los archivos de '{app}' son idénticos al backup; no se detiene el servicio.")
+        else:
+            # El servicio solo está detenido durante los renombrados
+            with phase(result, "detener"):
+                if is_service:
+                    stop_app(app)
+                else:
+                    logger.info(f"La aplicación '{app}' no es un servicio; no se requiere detener.")
+            try:
+                with phase(result, "renombrar"):
+                    backup_orig_dir = os.path.join(restore_dir, BACKUP_ORIG_DIR_NAME)
+                    swap_into_place(staged, restore_dir, staging_dir, backup_orig_dir)
+            except OSError:
+                result["error"] = "fallo en el intercambio (revertido)"
+                return
+            finally:
+                with phase(result, "iniciar"):
+                    if is_service:
+                        start_app(app)
+                    else:
+                        logger.info(f"La aplicación '{app}' no es un servicio; no se requiere iniciar.")
+
+        manifest["restored_at"] = datetime.now().isoformat(timespec="seconds")
+        try:
+            save_manifest(restore_dir, manifest)
+        except OSError as e:
+            logger.warning(f"No se pudo guardar el manifiesto de restauración: {e}")
+    finally:
+        shutil.rmtree(staging_dir, ignore_errors=True)
 
+    result["status"] = "ok"
     logger.info(f"Restauración de '{app}' completada exitosamente.")
     logger.info(f"--- Fin de restauración de '{app}' ---\n")
 
+def get_dependencies(config):
+    """Devuelve {app: [dependencias]} ignorando dependencias desconocidas."""
+    dependencies = {}
+    for app, app_config in config.items():
+        deps = app_config.get("depends_on", []) if isinstance(app_config, dict) else []
+        if isinstance(deps, str):
+            deps = [deps]
+        unknown = [d for d in deps if d not in config]
+        for dep in unknown:
+            logger.warning(f"La dependencia '{dep}' de '{app}' no se restaura en esta ejecución; se ignora.")
+        dependencies[app] = [d for d in deps if d in config and d != app]
+    return dependencies
+
+def skipped_result(app, reason):
+    logger.error(f"No se restaurará '{app}': {reason}.")
+    return {"app": app, "status": "omitida", "phases": {}, "error": reason}
+
+def run_restores(config, workers, catalog):
+    """Restaura las aplicaciones con hasta 'workers' en paralelo respetando 'depends_on'.
+
+    Todas comparten 'catalog', que es seguro entre hilos.
+    """
+    dependencies = get_dependencies(config)
+    remaining = list(config)
+    results = {}
+    running = {}
+
+    with ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix="restore") as executor:
+        while remaining or running:
+            # Lanzar (en el orden del JSON) las aplicaciones cuyas dependencias han terminado
+            for app in list(remaining):
+                deps = dependencies[app]
+                if not all(d in results for d in deps):
+                    continue
+                remaining.remove(app)
+                failed = [d for d in deps if results[d]["status"] != "ok"]
+                if failed and config[app].get("require"):
+                    results[app] = skipped_result(app, f"falló la dependencia {', '.join(failed)}")
+                    continue
+                if failed:
+                    logger.warning(f"'{app}' se restaura aunque falló la dependencia {', '.join(failed)}.")
+                running[executor.submit(restore_app, app, config[app], catalog)] = app
+
+            if not running:
+                # Lo que queda depende de algo que nunca terminará: ciclo de dependencias
+                for app in remaining:
+                    results[app] = skipped_result(app, "ciclo en 'depends_on'")
+                break
+
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                app = running.pop(future)
+                try:
+                    results[app] = future.result()
+                except Exception as e:
+                    logger.error(f"Error inesperado al restaurar '{app}': {e}")
+                    results[app] = {"app": app, "status": "error", "phases": {}, "error": str(e)}
+
+    return [results[app] for app in config if app in results]
+
+def print_summary(results):
+    """Muestra una tabla resumen con el estado y la duración (s) de cada fase por aplicación."""
+    columns = RESTORE_PHASES + ["total"]
+    header = f"{'Aplicación':<12} {'Estado':<8} " + " ".join(f"{c:>10}" for c in columns) + "  Detalle"
+    lines = [header, "-" * len(header)]
+    for r in results:
+        times = " ".join(
+            f"{r['phases'][c]:>10.2f}" if c in r["phases"] else f"{'-':>10}" for c in columns
+        )
+        lines.append(f"{r['app']:<12} {r['status']:<8} {times}  {r['error'] or ''}")
+    logger.info("Resumen de la restauración:\n" + "\n".join(lines))
+
+def parse_args():
+    """Analiza los argumentos de línea de comandos."""
+    parser = argparse.ArgumentParser(description="Restaura aplicaciones desde sus backups.")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="Número de aplicaciones a restaurar en paralelo (por defecto: 1).")
+    parser.add_argument("--apps", nargs="+",
+                        help="Restaura solo estas aplicaciones (por defecto: todas las de la configuración).")
+    parser.add_argument("--snapshot", nargs="+", metavar="ID",
+                        help="Restaura desde estas instantáneas de 'arr_snapshot.py' (solo sus aplicaciones).")
+    return parser.parse_args()
+
 def main():
     """Función principal."""
+    args = parse_args()
     setup_logging()
 
     logger.info("Iniciando proceso de restauración de aplicaciones.")
@@ -301,12 +741,35 @@ def main():
         logger.error("No se pudo cargar la configuración. Terminando el proceso.")
         return
 
-    # Restaurar cada aplicación
-    for app, app_config in config.items():
-        try:
-            restore_app(app, app_config)
-        except Exception as e:
-            logger.error(f"Error inesperado al restaurar '{app}': {e}")
+    if args.apps:
+        unknown = [a for a in args.apps if a not in config]
+        if unknown:
+            logger.error(f"Aplicaciones no encontradas en la configuración: {', '.join(unknown)}")
+        config = {app: app_config for app, app_config in config.items() if app in args.apps}
+
+    if args.snapshot:
+        # El ID de la instantánea empieza por el nombre de la aplicación ('radarr_2024-05-26_03-15-22')
+        snapshots = {}
+        for snapshot_id in args.snapshot:
+            app = snapshot_id.split("_", 1)[0]
+            if app not in config:
+                logger.error(f"La instantánea '{snapshot_id}' es de '{app}', que no está en la configuración.")
+                continue
+            snapshots[app] = snapshot_id
+        config = {app: dict(config[app], snapshot_id=snapshot_id) for app, snapshot_id in snapshots.items()}
+
+    # Restaurar las aplicaciones
+    catalog = BackupCatalog()
+    try:
+        with metrics:
+            results = run_restores(config, args.workers, catalog)
+            for status in ("ok", "error", "omitida"):
+                metrics.incr(f"apps_{status}", sum(1 for r in results if r["status"] == status))
+            if any(r["status"] != "ok" for r in results):
+                metrics.status = "error"
+    finally:
+        catalog.close()
+    print_summary(results)
 
     logger.info("Proceso de restauración completado.")
     logger.info("Es recomendable reiniciar el sistema para que los cambios surtan efecto.")
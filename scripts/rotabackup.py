@@ -24,20 +24,44 @@ Instrucciones:
        }
     2. Ejecuta el script con el comando 'python3 backup_cleanup.py' o dale permisos
        de ejecución y ejecútalo directamente como un ejecutable en sistemas Unix/Linux.
+    3. Los backups se ordenan con el catálogo compartido 'lib/backup_catalog.py', que usa la
+       fecha del nombre del archivo (patrón de las apps *arr) y solo hace stat() de los nuevos.
+    4. Además de 'num_copies_to_keep' (las N copias más recientes), cada ruta admite una política
+       abuelo-padre-hijo opcional:
+           "keep_daily": 7,        último backup de cada uno de los 7 días más recientes con backup
+           "keep_weekly": 4,       ídem por semana ISO
+           "keep_monthly": 6,      ídem por mes
+           "keep_yearly": 2,       ídem por año
+           "max_total_bytes": "20G"  tamaño máximo de lo conservado (bytes o con sufijo K/M/G/T)
+       Se conserva la unión de todas las reglas. Si se supera 'max_total_bytes' se descartan los
+       conservados más antiguos, pero nunca el más reciente.
+    5. Los subdirectorios de la carpeta también son backups (por ejemplo, copias sin comprimir) y
+       se eliminan completos.
+    6. Con '--dry-run' solo se informa de lo que se eliminaría y del espacio que se liberaría.
 """
 
 import os
-import glob
+import sys
 import json
+import shutil
 import logging
+import argparse
 from pathlib import Path
 from datetime import datetime
 
 INSTALL_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 CONFIG_DIR = os.path.join(INSTALL_DIR, "configs")
+LOG_DIR = os.path.join(INSTALL_DIR, "logs")
+sys.path.insert(0, os.path.join(INSTALL_DIR, "lib"))
+
+from backup_catalog import BackupCatalog
+from metrics import RunMetrics
+from fsutil import format_size, parse_size
+from preflight import check_paths
 
 # Configuración del logger
-LOG_FILE = 'rotabackup.log'
+LOG_FILE = os.path.join(LOG_DIR, "rotabackup.log")
+os.makedirs(LOG_DIR, exist_ok=True)
 logging.basicConfig(
     level=logging.INFO,
     format='%(asctime)s [%(levelname)s] [%(filename)s]: %(message)s',
@@ -47,6 +71,7 @@ logging.basicConfig(
     ]
 )
 logger = logging.getLogger(__name__)
+metrics = RunMetrics("rotabackup")
 
 # Lee las rutas de las carpetas de backup de las aplicaciones desde el archivo JSON
 def read_app_paths(json_file):
@@ -61,54 +86,174 @@ def read_app_paths(json_file):
         logger.error(f"Error al parsear el archivo JSON: {e}")
         exit(1)
 
-# Encuentra los archivos en la carpeta y devuelve los más recientes según su fecha de modificación
-def get_latest_backups(folder, num_copies_to_keep):
-    all_files = sorted(
-        glob.glob(os.path.join(folder, "*")),
-        key=os.path.getmtime,
-        reverse=True
+# Devuelve las rutas de los backups más recientes según el catálogo (fecha del nombre o mtime)
+def get_latest_backups(folder, num_copies_to_keep, catalog):
+    catalog.refresh(folder, checksum=True)
+    return [entry.path for entry in catalog.newest(folder, num_copies_to_keep)]
+
+# Construye la política de retención de una ruta a partir de su configuración
+def policy_from_config(app_config):
+    return {
+        "keep_last": app_config.get("num_copies_to_keep", 3),
+        "keep_daily": app_config.get("keep_daily", 0),
+        "keep_weekly": app_config.get("keep_weekly", 0),
+        "keep_monthly": app_config.get("keep_monthly", 0),
+        "keep_yearly": app_config.get("keep_yearly", 0),
+        "max_total_bytes": parse_size(app_config.get("max_total_bytes")),
+    }
+
+# Claves de periodo para cada regla abuelo-padre-hijo
+PERIOD_KEYS = {
+    "keep_daily": lambda dt: dt.strftime("%Y-%m-%d"),
+    "keep_weekly": lambda dt: "%d-W%02d" % dt.isocalendar()[:2],
+    "keep_monthly": lambda dt: dt.strftime("%Y-%m"),
+    "keep_yearly": lambda dt: dt.strftime("%Y"),
+}
+
+# Decide qué backups conservar. 'entries' va del más nuevo al más antiguo.
+# Devuelve {ruta: [motivos]} de los que se conservan.
+def select_backups_to_keep(entries, policy):
+    keep = {}
+    for entry in entries[:max(0, policy["keep_last"])]:
+        keep.setdefault(entry.path, []).append("últimas")
+
+    for rule, period_key in PERIOD_KEYS.items():
+        count = policy.get(rule) or 0
+        seen_periods = set()
+        for entry in entries:
+            if len(seen_periods) >= count:
+                break
+            period = period_key(datetime.fromtimestamp(entry.timestamp))
+            if period in seen_periods:
+                continue
+            # El primero de cada periodo es el más reciente de ese periodo
+            seen_periods.add(period)
+            keep.setdefault(entry.path, []).append(f"{rule[5:]} {period}")
+
+    max_total = policy.get("max_total_bytes")
+    if max_total is not None:
+        kept = [e for e in entries if e.path in keep]
+        total = sum(e.size for e in kept)
+        # Se descartan los más antiguos, pero nunca el más reciente
+        for entry in reversed(kept[1:]):
+            if total <= max_total:
+                break
+            del keep[entry.path]
+            total -= entry.size
+            logger.warning(f"'{entry.path}' no se conserva por superar 'max_total_bytes' ({format_size(max_total)}).")
+    return keep
+
+# Elimina un backup (archivo o directorio)
+def delete_backup(entry):
+    if entry.is_dir:
+        shutil.rmtree(entry.path)
+    else:
+        os.remove(entry.path)
+
+# Aplica la política de retención a una carpeta. Devuelve (número de eliminados, bytes liberados).
+def apply_retention(folder, policy, catalog, dry_run=False):
+    catalog.refresh(folder, checksum=not dry_run)
+    entries = catalog.entries(folder)
+    keep = select_backups_to_keep(entries, policy)
+
+    deleted = 0
+    freed = 0
+    for entry in entries:
+        if entry.path in keep:
+            if dry_run:
+                logger.info(f"[dry-run] Se conserva: {entry.path} ({', '.join(keep[entry.path])})")
+            continue
+        if dry_run:
+            logger.info(f"[dry-run] Se eliminaría: {entry.path} ({format_size(entry.size)})")
+            deleted += 1
+            freed += entry.size
+            continue
+        try:
+            delete_backup(entry)
+            logger.info(f"Eliminado: {entry.path} ({format_size(entry.size)})")
+            deleted += 1
+            freed += entry.size
+            catalog.forget(folder, entry.name)
+        except FileNotFoundError:
+            catalog.forget(folder, entry.name)
+        except Exception as e:
+            logger.error(f"Error al eliminar '{entry.path}': {e}")
+
+    kept_bytes = sum(e.size for e in entries if e.path in keep)
+    if not dry_run:
+        metrics.incr("backups_deleted", deleted)
+        metrics.incr("bytes_freed", freed)
+        metrics.incr("backups_kept", len(keep))
+        metrics.incr("bytes_kept", kept_bytes)
+    prefix = "[dry-run] Se eliminarían" if dry_run else "Eliminados"
+    logger.info(
+        f"{folder}: {prefix} {deleted} backups ({format_size(freed)}); "
+        f"se conservan {len(keep)} ({format_size(kept_bytes)})."
     )
-    return all_files[:num_copies_to_keep]
-
-# Elimina todos los archivos que no estén en la lista latest_backups si aún existen
-def remove_old_backups(folder, latest_backups):
-    for file in glob.glob(os.path.join(folder, "*")):
-        if file not in latest_backups and os.path.isfile(file):
-            try:
-                os.remove(file)
-                logger.info(f"Eliminado: {file}")
-            except Exception as e:
-                logger.error(f"Error al eliminar '{file}': {e}")
+    return deleted, freed
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Elimina los backups antiguos según la política de retención.")
+    parser.add_argument("--dry-run", action="store_true",
+                        help="Solo informa de lo que se eliminaría y del espacio que se liberaría.")
+    return parser.parse_args()
 
 def main():
+    args = parse_args()
+    if args.dry_run:
+        run(args)
+    else:
+        with metrics:
+            run(args)
+
+def run(args):
     # Ruta al archivo de configuración
     CONFIG_FILE = os.path.join(CONFIG_DIR, "app_backup_paths.json")
 
     app_paths = read_app_paths(CONFIG_FILE)
+    catalog = BackupCatalog()
+    total_deleted = 0
+    total_freed = 0
 
-    for app_config in app_paths:
-        app_path = app_config.get("path")
-        num_copies_to_keep = app_config.get("num_copies_to_keep", 3)
-
-        if not app_path:
-            logger.error("No se especificó la ruta 'path' en la configuración.")
-            continue
+    try:
+        for app_config in app_paths:
+            app_path = app_config.get("path")
 
-        folder = Path(app_path)
+            if not app_path:
+                logger.error("No se especificó la ruta 'path' en la configuración.")
+                continue
 
-        if not folder.exists():
-            logger.info(f"La ruta '{app_path}' no existe. Creando la carpeta.")
-            try:
-                folder.mkdir(parents=True, exist_ok=True)
-            except Exception as e:
-                logger.error(f"No se pudo crear la carpeta '{app_path}': {e}")
+            # Con 'nofail', un disco desconectado deja su punto de montaje vacío en la tarjeta SD
+            problems = check_paths([app_path])
+            if problems:
+                for problem in problems:
+                    logger.error(f"Se omite '{app_path}': {problem}")
+                metrics.status = "error"
                 continue
 
-        if folder.is_dir():
-            latest_backups = get_latest_backups(app_path, num_copies_to_keep)
-            remove_old_backups(app_path, latest_backups)
-        else:
-            logger.error(f"La ruta '{app_path}' no es un directorio. Comprueba las rutas de las aplicaciones.")
+            folder = Path(app_path)
+
+            if not folder.exists() and not args.dry_run:
+                logger.info(f"La ruta '{app_path}' no existe. Creando la carpeta.")
+                try:
+                    folder.mkdir(parents=True, exist_ok=True)
+                except Exception as e:
+                    logger.error(f"No se pudo crear la carpeta '{app_path}': {e}")
+                    continue
+
+            if folder.is_dir():
+                with metrics.span("retention"):
+                    deleted, freed = apply_retention(app_path, policy_from_config(app_config), catalog,
+                                                     args.dry_run)
+                total_deleted += deleted
+                total_freed += freed
+            elif folder.exists() or not args.dry_run:
+                logger.error(f"La ruta '{app_path}' no es un directorio. Comprueba las rutas de las aplicaciones.")
+    finally:
+        catalog.close()
+
+    prefix = "[dry-run] Total que se eliminaría" if args.dry_run else "Total eliminado"
+    logger.info(f"{prefix}: {total_deleted} backups, {format_size(total_freed)} liberados.")
 
 if __name__ == "__main__":
     main()
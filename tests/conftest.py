@@ -0,0 +1,61 @@
+"""Configuración común de las pruebas.
+
+Los scripts calculan INSTALL_DIR a partir de su propia ruta y, al importarse, abren su log en
+'INSTALL_DIR/logs'. Para que las pruebas no escriban en el repositorio se importan desde una
+instalación temporal cuyos 'lib', 'scripts' y 'configs' son enlaces simbólicos al repositorio
+(os.path.abspath no resuelve enlaces) y cuyos 'logs' y 'data' son directorios temporales. Además,
+cada prueba apunta los logs, los datos, el catálogo y las métricas a su propio 'tmp_path'.
+"""
+
+import os
+import sys
+import shutil
+import atexit
+import tempfile
+
+import pytest
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+TEST_INSTALL_DIR = tempfile.mkdtemp(prefix="confiraspa-tests-")
+atexit.register(shutil.rmtree, TEST_INSTALL_DIR, True)
+for name in ("lib", "scripts", "configs"):
+    os.symlink(os.path.join(REPO_DIR, name), os.path.join(TEST_INSTALL_DIR, name))
+sys.path.insert(0, os.path.join(TEST_INSTALL_DIR, "lib"))
+sys.path.insert(0, os.path.join(TEST_INSTALL_DIR, "scripts"))
+# Las pruebas no deben publicar nada en el textfile collector de node_exporter de la máquina
+os.environ["CONFIRASPA_TEXTFILE_DIR"] = os.path.join(TEST_INSTALL_DIR, "textfile")
+
+# Atributos de módulo con rutas de escritura que se redirigen en cada prueba
+REDIRECTED_PATHS = {
+    "LOG_DIR": "logs",
+    "DATA_DIR": "data",
+    "LOCK_DIR": os.path.join("data", "locks"),
+    "HISTORY_FILE": os.path.join("data", "job_runner_history.json"),
+    "JOURNAL_FILE": os.path.join("data", "downloadclean_journal.json"),
+    "HASH_INDEX_FILE": os.path.join("data", "hash_index.db"),
+    "CATALOG_FILE": os.path.join("data", "backup_catalog.db"),
+    "METRICS_FILE": os.path.join("logs", "metrics.jsonl"),
+}
+
+@pytest.fixture(autouse=True)
+def isolated_paths(tmp_path, monkeypatch):
+    """Redirige a 'tmp_path' las rutas de escritura de los módulos del proyecto ya importados."""
+    from metrics import RunMetrics
+    for directory in ("logs", os.path.join("data", "locks")):
+        os.makedirs(tmp_path / directory, exist_ok=True)
+    for module in list(sys.modules.values()):
+        module_file = getattr(module, "__file__", None) or ""
+        if not module_file.startswith(TEST_INSTALL_DIR):
+            continue
+        for attr, relative in REDIRECTED_PATHS.items():
+            if hasattr(module, attr):
+                monkeypatch.setattr(module, attr, str(tmp_path / relative))
+        # Las instancias de RunMetrics se crean al importar el script, con la ruta ya fijada
+        instance = getattr(module, "metrics", None)
+        if isinstance(instance, RunMetrics):
+            monkeypatch.setattr(instance, "metrics_file", str(tmp_path / REDIRECTED_PATHS["METRICS_FILE"]))
+    # BackupCatalog() sin argumentos usa el valor por defecto fijado al definir la clase
+    import backup_catalog
+    monkeypatch.setattr(backup_catalog.BackupCatalog.__init__, "__defaults__",
+                        (str(tmp_path / REDIRECTED_PATHS["CATALOG_FILE"]),))
+    return tmp_path
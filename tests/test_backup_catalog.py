@@ -0,0 +1,55 @@
+"""Pruebas del catálogo de backups."""
+
+import os
+
+import pytest
+
+from backup_catalog import BackupCatalog, file_checksum
+
+@pytest.fixture
+def catalog(tmp_path):
+    catalog = BackupCatalog(str(tmp_path / "catalog.db"))
+    yield catalog
+    catalog.close()
+
+def write(path, data, mtime):
+    path.write_bytes(data)
+    os.utime(path, (mtime, mtime))
+    return str(path)
+
+def test_latest_uses_timestamp_from_name(tmp_path, catalog):
+    backups = tmp_path / "backups"
+    backups.mkdir()
+    # El mtime del más nuevo es el más antiguo, como tras un rsync sin '-t'
+    write(backups / "radarr_backup_v5_2024.05.26_03.15.22.zip", b"new", 1000)
+    write(backups / "radarr_backup_v5_2024.05.19_03.15.22.zip", b"old", 2000)
+    assert catalog.refresh(str(backups)) == 2
+    assert catalog.latest(str(backups), ext=".zip").name == "radarr_backup_v5_2024.05.26_03.15.22.zip"
+
+def test_refresh_skips_unchanged_entries(tmp_path, catalog):
+    backups = tmp_path / "backups"
+    backups.mkdir()
+    write(backups / "radarr_2024.05.26_03.15.22.zip", b"data", 1000)
+    assert catalog.refresh(str(backups), checksum=True) == 1
+    assert catalog.refresh(str(backups), checksum=True) == 0
+
+def test_refresh_records_overwritten_backup(tmp_path, catalog):
+    backups = tmp_path / "backups"
+    backups.mkdir()
+    path = write(backups / "radarr_2024.05.26_03.15.22.zip", b"data", 1000)
+    catalog.refresh(str(backups), checksum=True)
+    # Mismo nombre, otro contenido: se vuelve a registrar con su nuevo tamaño y SHA256
+    write(backups / "radarr_2024.05.26_03.15.22.zip", b"other data", 2000)
+    assert catalog.refresh(str(backups), checksum=True) == 1
+    entry = catalog.latest(str(backups))
+    assert entry.size == len(b"other data")
+    assert entry.checksum == file_checksum(path)
+
+def test_refresh_forgets_removed_backups(tmp_path, catalog):
+    backups = tmp_path / "backups"
+    backups.mkdir()
+    path = write(backups / "radarr_2024.05.26_03.15.22.zip", b"data", 1000)
+    catalog.refresh(str(backups))
+    os.remove(path)
+    catalog.refresh(str(backups))
+    assert catalog.entries(str(backups)) == []
@@ -0,0 +1,227 @@
+"""Pruebas de run_jobs con binarios falsos de rsync y rclone (lo mismo que '--rsync-bin'/'--rclone-bin')."""
+
+import os
+import sys
+import json
+import stat
+import time
+import threading
+
+import pytest
+
+import backup_orchestrator as bo
+
+# Binario falso: la conducta de cada trabajo se lee de '<stub_dir>/<nombre>.json', donde <nombre> es
+# el directorio 'src_<nombre>' que aparece en los argumentos. Anota los intentos y cuándo empieza y
+# termina cada ejecución.
+STUB = """#!{python}
+import os, sys, json, time
+stub_dir = {stub_dir!r}
+name = next(os.path.basename(a.rstrip("/"))[4:] for a in sys.argv[1:] if "src_" in a)
+with open(os.path.join(stub_dir, name + ".json")) as f:
+    behaviour = json.load(f)
+attempts_file = os.path.join(stub_dir, name + ".attempts")
+attempt = int(open(attempts_file).read()) + 1 if os.path.exists(attempts_file) else 1
+with open(attempts_file, "w") as f:
+    f.write(str(attempt))
+with open(os.path.join(stub_dir, name + ".times"), "a") as f:
+    f.write(f"start {{time.monotonic()}}\\n")
+time.sleep(behaviour.get("sleep", 0))
+sys.stdout.write(behaviour.get("output", ""))
+with open(os.path.join(stub_dir, name + ".times"), "a") as f:
+    f.write(f"end {{time.monotonic()}}\\n")
+sys.exit(behaviour["fail_code"] if attempt <= behaviour.get("fail", 0) else behaviour.get("code", 0))
+"""
+
+RSYNC_STATS = """
+Number of files: 1,234 (reg: 1,200, dir: 34)
+Number of created files: 5
+Number of deleted files: 2
+Number of regular files transferred: 7
+Total file size: 52,428,800 bytes
+Total transferred file size: 1,048,576 bytes
+Literal data: 1,048,576 bytes
+Total bytes sent: 1,050,000
+Total bytes received: 200
+"""
+
+RCLONE_LOG = (
+    '{"level":"info","msg":"Copied (new)","object":"a.epub"}\n'
+    '{"level":"info","msg":"stats","stats":{"bytes":100,"checks":3,"errors":0,"transfers":1}}\n'
+    '{"level":"info","msg":"stats","stats":{"bytes":4096,"checks":10,"deletes":1,"errors":0,'
+    '"transfers":2,"elapsedTime":1.5}}\n'
+)
+
+@pytest.fixture
+def stub_dir(tmp_path):
+    directory = tmp_path / "stub"
+    directory.mkdir()
+    for binary in ("rsync", "rclone"):
+        path = directory / binary
+        path.write_text(STUB.format(python=sys.executable, stub_dir=str(directory)))
+        path.chmod(path.stat().st_mode | stat.S_IXUSR)
+    return directory
+
+@pytest.fixture
+def settings(stub_dir):
+    settings = dict(bo.DEFAULTS)
+    settings.update(rsync_bin=str(stub_dir / "rsync"), rclone_bin=str(stub_dir / "rclone"),
+                    ionice_prefix=[], pacing=None, backoff_seconds=5, backoff_factor=2)
+    return settings
+
+@pytest.fixture
+def sleeps(monkeypatch):
+    """Anota las esperas entre reintentos sin dormir de verdad."""
+    delays = []
+    monkeypatch.setattr(bo.time, "sleep", delays.append)
+    return delays
+
+def make_job(tmp_path, stub_dir, name, index, kind="rsync", resources=None, **behaviour):
+    source = tmp_path / f"src_{name}"
+    source.mkdir()
+    (stub_dir / f"{name}.json").write_text(json.dumps(behaviour))
+    if kind == "rsync":
+        job = {"kind": "rsync", "origen": str(source), "destino": str(tmp_path / f"dst_{name}")}
+    else:
+        job = {"kind": "rclone", "origen": str(source), "destino": f"Remoto:{name}", "local": str(source)}
+    job.update(index=index, resources=resources or [f"read:dev:{name}"])
+    return job
+
+def attempts(stub_dir, name):
+    return int((stub_dir / f"{name}.attempts").read_text())
+
+def intervals(stub_dir, name):
+    times = [float(line.split()[1]) for line in (stub_dir / f"{name}.times").read_text().splitlines()]
+    return list(zip(times[::2], times[1::2]))
+
+def test_retries_with_exponential_backoff(tmp_path, stub_dir, settings, sleeps):
+    job = make_job(tmp_path, stub_dir, "fotos", 0, fail=2, fail_code=23, output=RSYNC_STATS)
+    [result] = bo.run_jobs([job], settings, str(tmp_path))
+    assert result["status"] == "ok"
+    assert result["attempts"] == 3
+    assert attempts(stub_dir, "fotos") == 3
+    assert sleeps == [5, 10]
+
+def test_gives_up_after_last_retry(tmp_path, stub_dir, settings, sleeps):
+    job = make_job(tmp_path, stub_dir, "fotos", 0, fail=10, fail_code=23)
+    [result] = bo.run_jobs([job], settings, str(tmp_path))
+    assert result["status"] == "error"
+    assert result["returncode"] == 23
+    assert attempts(stub_dir, "fotos") == settings["retries"]
+    assert len(sleeps) == settings["retries"] - 1
+
+def test_rsync_exit_code_24_is_success(tmp_path, stub_dir, settings, sleeps):
+    job = make_job(tmp_path, stub_dir, "fotos", 0, code=24, output=RSYNC_STATS)
+    [result] = bo.run_jobs([job], settings, str(tmp_path))
+    assert result["status"] == "ok"
+    assert result["returncode"] == 24
+    assert result["attempts"] == 1
+    assert sleeps == []
+
+def test_rclone_exit_code_24_is_an_error(tmp_path, stub_dir, settings, sleeps):
+    job = make_job(tmp_path, stub_dir, "libros", 0, kind="rclone", fail=10, fail_code=24)
+    [result] = bo.run_jobs([job], settings, str(tmp_path))
+    assert result["status"] == "error"
+    assert attempts(stub_dir, "libros") == settings["retries"]
+
+def test_rsync_stats_are_parsed(tmp_path, stub_dir, settings, sleeps):
+    job = make_job(tmp_path, stub_dir, "fotos", 0, output=RSYNC_STATS)
+    [result] = bo.run_jobs([job], settings, str(tmp_path))
+    assert result["stats"] == {
+        "files": 1234, "files_transferred": 7, "files_created": 5, "files_deleted": 2,
+        "total_size": 52428800, "transferred_size": 1048576, "literal_data": 1048576,
+        "bytes_sent": 1050000, "bytes_received": 200,
+    }
+
+def test_rclone_stats_use_the_last_json_block(tmp_path, stub_dir, settings, sleeps):
+    job = make_job(tmp_path, stub_dir, "libros", 0, kind="rclone", output=RCLONE_LOG)
+    [result] = bo.run_jobs([job], settings, str(tmp_path))
+    assert result["status"] == "ok"
+    assert result["stats"] == {"bytes": 4096, "checks": 10, "deletes": 1, "errors": 0,
+                               "transfers": 2, "elapsedTime": 1.5}
+
+def test_stats_only_cover_the_successful_attempt(tmp_path, stub_dir, settings, sleeps):
+    job = make_job(tmp_path, stub_dir, "fotos", 0, fail=1, fail_code=12, output=RSYNC_STATS)
+    [result] = bo.run_jobs([job], settings, str(tmp_path))
+    log = (tmp_path / "00_rsync.log").read_text()
+    assert log.count("Number of files:") == 2
+    assert result["stats"]["files"] == 1234
+
+def test_jobs_sharing_a_disk_run_one_at_a_time(tmp_path, stub_dir, settings, sleeps):
+    settings.update(max_workers=3, per_device_read=1, per_device_write=1)
+    jobs = [
+        make_job(tmp_path, stub_dir, "a", 0, resources=["read:dev:1", "write:dev:2"], sleep=0.3),
+        make_job(tmp_path, stub_dir, "b", 1, resources=["read:dev:1", "write:dev:3"], sleep=0.3),
+        make_job(tmp_path, stub_dir, "c", 2, resources=["read:dev:4", "write:dev:5"], sleep=0.3),
+    ]
+    results = bo.run_jobs(jobs, settings, str(tmp_path))
+    assert [r["status"] for r in results] == ["ok", "ok", "ok"]
+    [(a_start, a_end)] = intervals(stub_dir, "a")
+    [(b_start, b_end)] = intervals(stub_dir, "b")
+    [(c_start, c_end)] = intervals(stub_dir, "c")
+    # 'b' espera a que 'a' suelte la lectura de dev:1; 'c' no comparte nada y va en paralelo con 'a'
+    assert b_start >= a_end
+    assert c_start < a_end and a_start < c_end
+
+def test_remote_limit_is_separate_from_disk_limit(tmp_path, stub_dir, settings, sleeps):
+    settings.update(max_workers=4, per_device_write=2, per_remote=1)
+    jobs = [
+        make_job(tmp_path, stub_dir, "a", 0, kind="rclone", resources=["remote:GDrive", "write:dev:1"], sleep=0.3),
+        make_job(tmp_path, stub_dir, "b", 1, kind="rclone", resources=["remote:GDrive", "write:dev:1"], sleep=0.3),
+        make_job(tmp_path, stub_dir, "c", 2, resources=["read:dev:2", "write:dev:1"], sleep=0.3),
+    ]
+    bo.run_jobs(jobs, settings, str(tmp_path))
+    [(a_start, a_end)] = intervals(stub_dir, "a")
+    [(b_start, b_end)] = intervals(stub_dir, "b")
+    [(c_start, c_end)] = intervals(stub_dir, "c")
+    assert b_start >= a_end
+    assert c_start < a_end
+
+def test_zero_limit_never_runs(tmp_path, stub_dir, settings, sleeps):
+    settings.update(per_remote=0)
+    job = make_job(tmp_path, stub_dir, "libros", 0, kind="rclone", resources=["remote:GDrive"])
+    assert bo.run_jobs([job], settings, str(tmp_path)) == []
+    assert not (stub_dir / "libros.attempts").exists()
+
+def test_build_jobs_rclone_uses_remote_and_local_disk(tmp_path):
+    local = tmp_path / "Libros"
+    local.mkdir()
+    [job] = bo.build_jobs(None, {"directorios": [{"origen": str(local), "destino": "GDrive:Libros"}]})
+    assert job["local"] == str(local)
+    assert job["resources"] == sorted({"remote:GDrive", f"read:dev:{os.stat(local).st_dev}"})
+    [job] = bo.build_jobs(None, {"directorios": [{"origen": "GDrive:Libros", "destino": str(local)}]})
+    assert job["resources"] == sorted({"remote:GDrive", f"write:dev:{os.stat(local).st_dev}"})
+
+def test_shipped_configs_run_jobs_in_parallel(monkeypatch):
+    """Con las configuraciones del repositorio, un rclone lento no deja en cola a los rsync."""
+    config_dir = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "configs")
+    disks = {"/media/WDElements": 1, "/media/Backup": 2}
+    # Cada punto de montaje es un disco distinto; el resto está en la tarjeta SD
+    monkeypatch.setattr(bo, "device_of", lambda path: next(
+        (dev for mount, dev in disks.items() if path.startswith(mount)), 3))
+    settings = dict(bo.DEFAULTS)
+    settings.update(bo.load_json(os.path.join(config_dir, "backup_orchestrator.json")))
+    jobs = bo.build_jobs(bo.load_json(os.path.join(config_dir, "backup_rsync_config.json")),
+                         bo.load_json(os.path.join(config_dir, "backup_rclone_config.json")))
+    for index, job in enumerate(jobs):
+        job["index"] = index
+
+    running = set()
+    overlaps = []
+    lock = threading.Lock()
+
+    def fake_run_job(job, settings, output_dir):
+        with lock:
+            running.add(job["index"])
+            overlaps.append({jobs[i]["kind"] for i in running})
+        time.sleep(0.05)
+        with lock:
+            running.discard(job["index"])
+        return {"kind": job["kind"], "origen": job["origen"], "destino": job["destino"], "status": "ok"}
+
+    monkeypatch.setattr(bo, "run_job", fake_run_job)
+    results = bo.run_jobs(jobs, settings, "/nonexistent")
+    assert len(results) == len(jobs)
+    # Un rsync y un rclone a la vez sobre el mismo disco de backup, sin pasar de sus plazas de escritura
+    assert {"rsync", "rclone"} in overlaps
+    assert max(len(kinds) for kinds in overlaps) <= settings["per_device_write"]
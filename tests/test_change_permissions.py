@@ -0,0 +1,124 @@
+"""Pruebas de la corrección incremental de propietario y permisos."""
+
+import os
+import grp
+import pwd
+import json
+import stat
+import time
+import argparse
+
+import pytest
+
+import change_permissions as cp
+
+FILE_MODE = 0o664
+DIR_MODE = 0o775
+
+@pytest.fixture
+def target():
+    # Propietario actual: las pruebas no necesitan ser root para chmod ni para un chown sin cambios
+    return {"uid": os.getuid(), "gid": os.getgid(), "file_mode": FILE_MODE, "dir_mode": DIR_MODE}
+
+@pytest.fixture
+def tree(tmp_path):
+    root = tmp_path / "Peliculas"
+    for path in ("A (2020)/a.mkv", "A (2020)/a.srt", "B (2021)/Extras/b.mkv"):
+        (root / path).parent.mkdir(parents=True, exist_ok=True)
+        (root / path).write_bytes(b"x")
+        os.chmod(root / path, 0o600)
+    return root
+
+def mode(path):
+    return stat.S_IMODE(os.stat(path).st_mode)
+
+def high_water_mark():
+    """Marca de agua para una pasada incremental que empieza ahora.
+
+    El ctime se toma del reloj grueso del núcleo, que avanza a tics: se espera a que avance para que
+    los cambios que siguen queden por encima de la marca.
+    """
+    high_water_ns = time.time_ns()
+    time.sleep(0.05)
+    return high_water_ns
+
+def walk(target, root, high_water_ns=None):
+    fixer = cp.PermissionFixer(target)
+    fixer.walk(str(root), high_water_ns)
+    return fixer.stats
+
+def test_full_walk_fixes_only_what_differs(target, tree):
+    stats = walk(target, tree)
+    assert stats["files"] == 3
+    assert stats["chown"] == 0
+    assert all(mode(p) == (DIR_MODE if p.is_dir() else FILE_MODE) for p in tree.rglob("*"))
+    # Una segunda pasada no cambia nada
+    again = walk(target, tree)
+    assert again["chmod"] == again["chown"] == 0
+
+def test_incremental_walk_skips_files_of_unchanged_directories(target, tree):
+    walk(target, tree)
+    high_water_ns = high_water_mark()
+    # Cambio hecho a mano en un archivo existente: su directorio no cambia y no se revisa
+    os.chmod(tree / "A (2020)" / "a.mkv", 0o600)
+    # Archivo nuevo en un subdirectorio profundo: su directorio cambia y se revisa
+    (tree / "B (2021)" / "Extras" / "new.mkv").write_bytes(b"x")
+    os.chmod(tree / "B (2021)" / "Extras" / "new.mkv", 0o600)
+    stats = walk(target, tree, high_water_ns)
+    assert stats["dirs"] == 4
+    assert stats["dirs_skipped"] == 3
+    assert stats["files"] == 2
+    assert mode(tree / "B (2021)" / "Extras" / "new.mkv") == FILE_MODE
+    assert mode(tree / "A (2020)" / "a.mkv") == 0o600
+
+def test_incremental_walk_checks_moved_directories_with_old_mtime(target, tree, tmp_path):
+    walk(target, tree)
+    # Importación de Sonarr/Radarr: un directorio con mtime antiguo movido a la biblioteca
+    incoming = tmp_path / "incoming" / "C (2022)"
+    incoming.mkdir(parents=True)
+    (incoming / "c.mkv").write_bytes(b"x")
+    os.chmod(incoming / "c.mkv", 0o600)
+    old = time.time() - 30 * 86400
+    os.utime(incoming, (old, old))
+    high_water_ns = high_water_mark()
+    os.rename(incoming, tree / "C (2022)")
+    assert os.stat(tree / "C (2022)").st_mtime < high_water_ns / 1e9
+    walk(target, tree, high_water_ns)
+    assert mode(tree / "C (2022)" / "c.mkv") == FILE_MODE
+
+# --- run: marca de agua y pasadas completas ------------------------------------------------------
+
+@pytest.fixture
+def config(tmp_path, tree, monkeypatch):
+    config = {
+        "usuario": pwd.getpwuid(os.getuid()).pw_name,
+        "grupo": grp.getgrgid(os.getgid()).gr_name,
+        "permisos_archivos": "664",
+        "permisos_directorios": "775",
+        "full_every_runs": 2,
+        "directorios": [str(tree)],
+    }
+    config_file = tmp_path / "change_permissions_config.json"
+    config_file.write_text(json.dumps(config))
+    monkeypatch.setattr(cp, "CONFIG_FILE", str(config_file))
+    monkeypatch.setattr(cp.os, "geteuid", lambda: 0)
+    return config
+
+def run(tmp_path, full=False):
+    state_file = str(tmp_path / "state.json")
+    cp.run(argparse.Namespace(full=full, dry_run=False, state_file=state_file))
+    return cp.load_state(state_file)
+
+def test_run_forces_full_pass_every_n_runs(tmp_path, tree, config):
+    runs = [run(tmp_path)[str(tree)]["incremental_runs"] for _ in range(4)]
+    # Completa, dos incrementales, completa
+    assert runs == [0, 1, 2, 0]
+    assert run(tmp_path, full=True)[str(tree)]["incremental_runs"] == 0
+
+def test_run_does_full_pass_when_configuration_changes(tmp_path, tree, config):
+    run(tmp_path)
+    run(tmp_path)
+    config["permisos_archivos"] = "644"
+    (tmp_path / "change_permissions_config.json").write_text(json.dumps(config))
+    assert run(tmp_path)[str(tree)]["incremental_runs"] == 0
+    assert mode(tree / "A (2020)" / "a.mkv") == 0o644
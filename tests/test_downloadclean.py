@@ -0,0 +1,271 @@
+"""Pruebas de downloadclean."""
+
+import os
+import time
+
+import pytest
+
+import downloadclean as dc
+import inotify_shim as ino
+
+SIZE = 300 * 1024
+
+def write(path, data):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "wb") as f:
+        f.write(data)
+    return str(path)
+
+# --- execute_plan --------------------------------------------------------------------------------
+
+@pytest.fixture
+def tree(tmp_path):
+    """Biblioteca con una película y descargas con una copia (y sus subtítulos) y un archivo distinto."""
+    movie = os.urandom(SIZE)
+    paths = {
+        "library": write(tmp_path / "lib" / "Peliculas" / "Movie (2020).mkv", movie),
+        "download": write(tmp_path / "dl" / "Movie.2020" / "Movie.2020.mkv", movie),
+        "sidecar": write(tmp_path / "dl" / "Movie.2020" / "Movie.2020.srt", b"1\n00:00 --> 00:01\nHola\n"),
+        "other": write(tmp_path / "dl" / "Other" / "Other.mkv", os.urandom(SIZE)),
+    }
+    paths["download_dir"] = str(tmp_path / "dl")
+    paths["library_dir"] = str(tmp_path / "lib")
+    return paths
+
+def make_plan(tree, tmp_path):
+    index = dc.open_hash_index(str(tmp_path / "hash_index.db"))
+    size_map = dc.build_size_map([tree["library_dir"]])
+    return dc.build_plan({}, tree["download_dir"], size_map, index)
+
+def test_plan_lists_matches_with_sidecars(tree, tmp_path):
+    plan = make_plan(tree, tmp_path)
+    [directory] = plan["directories"]
+    [record] = directory["files"]
+    assert directory["dir"] == os.path.dirname(tree["download"])
+    assert record["match"] == tree["library"]
+    assert [s["name"] for s in record["sidecars"]] == ["Movie.2020.srt"]
+    assert os.path.exists(tree["download"])
+
+def test_execute_plan_deletes_matches_and_empty_dirs(tree, tmp_path):
+    plan = make_plan(tree, tmp_path)
+    assert dc.execute_plan(plan, tree["download_dir"])
+    assert not os.path.exists(os.path.dirname(tree["download"]))
+    assert os.path.exists(tree["other"])
+    assert os.path.exists(tree["library"])
+    assert os.path.isdir(tree["download_dir"])
+
+def test_execute_plan_skips_files_changed_since_plan(tree, tmp_path):
+    plan = make_plan(tree, tmp_path)
+    # Mismo tamaño, otro contenido y otro mtime
+    write(tree["download"], os.urandom(SIZE))
+    st = os.stat(tree["download"])
+    os.utime(tree["download"], ns=(st.st_atime_ns, st.st_mtime_ns + 10 ** 9))
+    assert dc.execute_plan(plan, tree["download_dir"])
+    assert os.path.exists(tree["download"])
+    assert os.path.exists(tree["sidecar"])
+
+def test_execute_plan_refuses_other_download_dir(tree, tmp_path):
+    plan = make_plan(tree, tmp_path)
+    assert not dc.execute_plan(plan, str(tmp_path / "lib"))
+    assert os.path.exists(tree["download"])
+
+def test_execute_plan_ignores_paths_outside_download_dir(tree, tmp_path):
+    st = os.stat(tree["library"])
+    plan = {
+        "download_dir": tree["download_dir"],
+        "directories": [{
+            "dir": os.path.join(tree["download_dir"], "..", "lib", "Peliculas"),
+            "files": [{"name": os.path.basename(tree["library"]), "size": st.st_size,
+                       "mtime_ns": st.st_mtime_ns, "ino": st.st_ino, "sidecars": []}],
+        }],
+    }
+    assert dc.execute_plan(plan, tree["download_dir"])
+    assert os.path.exists(tree["library"])
+
+def test_execute_plan_in_batches(tmp_path):
+    data = os.urandom(SIZE)
+    write(tmp_path / "lib" / "a.mkv", data)
+    downloads = [write(tmp_path / "dl" / f"d{i}" / "a.mkv", data) for i in range(3)]
+    index = dc.open_hash_index(str(tmp_path / "hash_index.db"))
+    plan = dc.build_plan({}, str(tmp_path / "dl"), dc.build_size_map([str(tmp_path / "lib")]), index)
+    assert dc.execute_plan(plan, str(tmp_path / "dl"), batch_size=1)
+    assert not any(os.path.exists(p) for p in downloads)
+
+# --- hardlink_duplicates -------------------------------------------------------------------------
+
+@pytest.fixture
+def library(tmp_path):
+    data = os.urandom(SIZE)
+    paths = [write(tmp_path / "lib" / name, data) for name in ("a.mkv", "b.mkv", "c.mkv")]
+    # 'd' ya es un hardlink de 'c': el inodo solo se libera si se enlazan las dos rutas
+    os.link(paths[2], str(tmp_path / "lib" / "d.mkv"))
+    paths.append(str(tmp_path / "lib" / "d.mkv"))
+    write(tmp_path / "lib" / "other.mkv", os.urandom(SIZE))
+    return paths
+
+def find_groups(tmp_path):
+    return dc.find_library_duplicates({}, [str(tmp_path / "lib")], None, 1)
+
+def inodes(paths):
+    return {os.stat(p).st_ino for p in paths}
+
+def test_duplicates_are_grouped_by_inode(library, tmp_path):
+    [group] = find_groups(tmp_path)
+    # Se conserva el inodo con más rutas
+    assert group["keep"] == sorted(library[2:])
+    assert sorted(p for d in group["duplicates"] for p in d["paths"]) == sorted(library[:2])
+    assert group["reclaimable"] == 2 * SIZE
+
+def test_hardlink_duplicates(library, tmp_path):
+    groups = find_groups(tmp_path)
+    assert dc.hardlink_duplicates(groups) == 2 * SIZE
+    assert len(inodes(library)) == 1
+    assert os.stat(library[0]).st_nlink == 4
+
+def test_hardlink_skips_duplicate_changed_since_comparison(library, tmp_path):
+    groups = find_groups(tmp_path)
+    # Etiquetas reescritas en el sitio: mismo tamaño, otro contenido
+    write(library[0], os.urandom(SIZE))
+    assert dc.hardlink_duplicates(groups) == SIZE
+    assert os.stat(library[0]).st_nlink == 1
+    assert os.stat(library[1]).st_nlink == 3
+
+def test_hardlink_skips_group_when_kept_file_changed(library, tmp_path):
+    groups = find_groups(tmp_path)
+    os.chmod(library[2], 0o600)
+    assert dc.hardlink_duplicates(groups) == 0
+    assert len(inodes(library)) == 3
+
+def test_hardlink_removes_temporary_link_when_replace_fails(library, tmp_path, monkeypatch):
+    groups = find_groups(tmp_path)
+
+    def failing_replace(src, dst):
+        raise OSError("replace falla")
+
+    with monkeypatch.context() as m:
+        m.setattr(dc.os, "replace", failing_replace)
+        assert dc.hardlink_duplicates(groups) == 0
+    assert not [n for n in os.listdir(tmp_path / "lib") if n.endswith(".dedup-tmp")]
+    assert os.stat(library[2]).st_nlink == 2
+    assert len(inodes(library)) == 3
+
+def test_hardlink_ignores_stale_temporary_link(library, tmp_path):
+    groups = find_groups(tmp_path)
+    # Restos de una ejecución interrumpida con el nombre temporal fijo de versiones anteriores
+    for path in library[:2]:
+        write(f"{path}.dedup-tmp", b"resto")
+    assert dc.hardlink_duplicates(groups) == 2 * SIZE
+    assert len(inodes(library)) == 1
+
+# --- Modo residente ------------------------------------------------------------------------------
+
+SETTLE = 30
+
+class FakeInotify:
+    """Registra las vigilancias; los eventos se entregan llamando a 'handle_event'."""
+
+    def __init__(self):
+        self.watches = {}
+
+    def add_watch(self, path, mask):
+        wd = len(self.watches) + 1
+        self.watches[wd] = path
+        return wd
+
+    def rm_watch(self, wd):
+        self.watches.pop(wd, None)
+
+@pytest.fixture
+def clock(monkeypatch):
+    """Reloj de 'time.time' que solo avanza a mano, partiendo de la hora real."""
+    now = [time.time()]
+    monkeypatch.setattr(dc.time, "time", lambda: now[0])
+    return now
+
+@pytest.fixture
+def daemon(tmp_path):
+    (tmp_path / "dl").mkdir()
+    (tmp_path / "lib").mkdir()
+    index = dc.open_hash_index(str(tmp_path / "hash_index.db"))
+    daemon = dc.CleanupDaemon({}, str(tmp_path / "dl"), [str(tmp_path / "lib")], index,
+                              str(tmp_path / "journal.json"), SETTLE)
+    daemon.inotify = FakeInotify()
+    daemon.add_watch_tree(daemon.download_dir, False)
+    daemon.add_watch_tree(daemon.library_dirs[0], True)
+    return daemon
+
+def event(daemon, path, mask):
+    """Entrega a 'daemon' el evento de inotify de 'path' en el directorio vigilado que lo contiene."""
+    directory, name = os.path.split(str(path))
+    wd = next(wd for wd, (d, _) in daemon.watches.items() if d == directory)
+    daemon.handle_event(wd, mask, name)
+
+def test_daemon_waits_for_writes_to_settle(daemon, tmp_path, clock):
+    data = os.urandom(SIZE)
+    library = write(tmp_path / "lib" / "Movie.mkv", data)
+    event(daemon, library, ino.IN_CLOSE_WRITE)
+    download = write(tmp_path / "dl" / "Movie.mkv", data)
+    event(daemon, download, ino.IN_CLOSE_WRITE)
+    assert daemon.queue[download] == clock[0] + SETTLE
+
+    # Cada escritura reinicia la espera
+    clock[0] += SETTLE - 1
+    event(daemon, download, ino.IN_MODIFY)
+    clock[0] += SETTLE - 1
+    assert not daemon.process_due()
+    assert os.path.exists(download)
+
+    clock[0] += 1
+    assert daemon.process_due()
+    assert not os.path.exists(download)
+    assert daemon.queue == {} and daemon.download_paths == {}
+
+def test_daemon_requeues_downloads_when_library_gets_same_size(daemon, tmp_path, clock):
+    data = os.urandom(SIZE)
+    download = write(tmp_path / "dl" / "Movie.mkv", data)
+    event(daemon, download, ino.IN_CLOSE_WRITE)
+    clock[0] += SETTLE
+    daemon.process_due()
+    assert os.path.exists(download) and download not in daemon.queue
+
+    library = write(tmp_path / "lib" / "Peliculas" / "Movie.mkv", data)
+    event(daemon, os.path.dirname(library), ino.IN_CREATE | ino.IN_ISDIR)
+    assert daemon.queue[download] == clock[0] + SETTLE
+    assert daemon.size_map[SIZE] == [(library, os.stat(library).st_dev, os.stat(library).st_ino)]
+    event(daemon, library, ino.IN_DELETE)
+    assert SIZE not in daemon.size_map
+
+def test_daemon_forgets_directories_moved_away(daemon, tmp_path, clock):
+    download = write(tmp_path / "dl" / "Show" / "E01.mkv", os.urandom(SIZE))
+    event(daemon, tmp_path / "dl" / "Show", ino.IN_CREATE | ino.IN_ISDIR)
+    assert download in daemon.queue
+    event(daemon, tmp_path / "dl" / "Show", ino.IN_MOVED_FROM | ino.IN_ISDIR)
+    assert daemon.queue == {} and daemon.download_sizes == {}
+    assert str(tmp_path / "dl" / "Show") not in daemon.inotify.watches.values()
+
+def test_journal_round_trip(tmp_path):
+    journal_file = str(tmp_path / "data" / "journal.json")
+    dc.save_journal(journal_file, 1234.5, {"/dl/b.mkv": 0, "/dl/a.mkv": 10})
+    assert dc.load_journal(journal_file) == {"checkpoint": 1234.5, "pending": ["/dl/a.mkv", "/dl/b.mkv"]}
+    with open(journal_file, "w") as f:
+        f.write("{roto")
+    assert dc.load_journal(journal_file) == {}
+    assert dc.load_journal(str(tmp_path / "missing.json")) == {}
+
+def test_catch_up_queues_only_what_changed_since_checkpoint(daemon, tmp_path):
+    old = write(tmp_path / "dl" / "old.mkv", os.urandom(SIZE))
+    pending = write(tmp_path / "dl" / "pending.mkv", os.urandom(SIZE + 1))
+    same_size = write(tmp_path / "dl" / "same_size.mkv", os.urandom(SIZE + 2))
+    # El ctime lo fija el reloj grueso del núcleo: se espera un tic para que lo siguiente sea posterior
+    checkpoint = time.time()
+    time.sleep(0.05)
+    new = write(tmp_path / "dl" / "new.mkv", os.urandom(SIZE + 3))
+    write(tmp_path / "lib" / "Movie.mkv", os.urandom(SIZE + 2))
+
+    daemon.catch_up(checkpoint, [pending])
+    assert sorted(daemon.queue) == sorted([pending, same_size, new])
+    assert daemon.download_paths[old] == SIZE
+    # Sin diario se compara todo
+    daemon.queue.clear()
+    daemon.catch_up(None, [])
+    assert sorted(daemon.queue) == sorted([old, pending, same_size, new])
@@ -0,0 +1,121 @@
+"""Pruebas de los bloqueos y los aplazamientos de job_runner."""
+
+import os
+import sys
+import json
+import argparse
+
+import pytest
+
+import job_runner as jr
+
+@pytest.fixture
+def sleeps(monkeypatch):
+    delays = []
+    monkeypatch.setattr(jr.time, "sleep", delays.append)
+    return delays
+
+# --- Bloqueos de discos ---------------------------------------------------------------------------
+
+def test_lock_devices_takes_every_disk(sleeps):
+    held = jr.lock_devices({1, 2}, 0)
+    assert len(held) == 2
+    assert jr.try_lock("dev_1") is None
+    for f in held:
+        f.close()
+    assert jr.try_lock("dev_1") is not None
+
+def test_lock_devices_is_all_or_nothing(sleeps):
+    busy = jr.try_lock("dev_2")
+    assert jr.lock_devices({1, 2}, 0) is None
+    # No se retiene el disco libre mientras se espera por el ocupado
+    free = jr.try_lock("dev_1")
+    assert free is not None
+    free.close()
+    busy.close()
+
+def test_lock_devices_waits_until_disk_is_released(monkeypatch):
+    busy = jr.try_lock("dev_1")
+    delays = []
+
+    def release_on_sleep(seconds):
+        delays.append(seconds)
+        busy.close()
+
+    monkeypatch.setattr(jr.time, "sleep", release_on_sleep)
+    held = jr.lock_devices({1}, 60)
+    assert len(held) == 1
+    assert delays == [jr.LOCK_POLL_SECONDS]
+    held[0].close()
+
+# --- Aplazamiento por carga -----------------------------------------------------------------------
+
+def test_wait_for_quiet_defers_while_busy(monkeypatch, sleeps):
+    loads = iter([3.0, 2.0, 0.5])
+    monkeypatch.setattr(jr, "normalized_load", lambda: next(loads))
+    monkeypatch.setattr(jr, "disk_busy", lambda devices: 10.0)
+    jr.wait_for_quiet({1}, dict(jr.DEFAULTS))
+    assert sleeps == [jr.POLL_SECONDS, jr.POLL_SECONDS]
+
+def test_wait_for_quiet_defers_for_busy_disks(monkeypatch, sleeps):
+    busy = iter([90.0, 20.0])
+    monkeypatch.setattr(jr, "normalized_load", lambda: 0.1)
+    monkeypatch.setattr(jr, "disk_busy", lambda devices: next(busy))
+    jr.wait_for_quiet({1}, dict(jr.DEFAULTS))
+    assert sleeps == [jr.POLL_SECONDS]
+
+def test_wait_for_quiet_gives_up_after_max_defer(monkeypatch, sleeps):
+    monkeypatch.setattr(jr, "normalized_load", lambda: 5.0)
+    monkeypatch.setattr(jr, "disk_busy", lambda devices: 0.0)
+    jr.wait_for_quiet(set(), dict(jr.DEFAULTS, max_defer_minutes=0))
+    assert sleeps == []
+
+# --- run ------------------------------------------------------------------------------------------
+
+@pytest.fixture
+def job_config(tmp_path, monkeypatch):
+    """Trabajo que anota cada ejecución en 'runs.txt' y termina con el código de 'code.txt'."""
+    scripts_dir = tmp_path / "scripts"
+    scripts_dir.mkdir()
+    (scripts_dir / "tarea.py").write_text(
+        "import sys\n"
+        f"open({str(tmp_path / 'runs.txt')!r}, 'a').write('run\\n')\n"
+        f"sys.exit(int(open({str(tmp_path / 'code.txt')!r}).read()))\n"
+    )
+    (tmp_path / "code.txt").write_text("0")
+    monkeypatch.setattr(jr, "SCRIPTS_DIR", str(scripts_dir))
+    config_file = tmp_path / "scripts_and_crontab.json"
+    config_file.write_text(json.dumps([
+        {"script": "tarea.py", "interpreter": sys.executable, "schedule": "0 3 * * *",
+         "resources": [str(tmp_path)]},
+    ]))
+    return argparse.Namespace(config=str(config_file), history_file=str(tmp_path / "history.json"),
+                              script="tarea.py")
+
+def runs(tmp_path):
+    path = tmp_path / "runs.txt"
+    return len(path.read_text().splitlines()) if path.exists() else 0
+
+def test_run_records_history(tmp_path, job_config, sleeps):
+    assert jr.run(job_config) == 0
+    (tmp_path / "code.txt").write_text("3")
+    assert jr.run(job_config) == 3
+    history = jr.load_history(job_config.history_file)["tarea.py"]
+    assert [r["returncode"] for r in history] == [0, 3]
+    assert runs(tmp_path) == 2
+
+def test_run_skips_job_still_running(tmp_path, job_config, sleeps):
+    previous = jr.try_lock("job_tarea.py")
+    assert jr.run(job_config) == 0
+    assert runs(tmp_path) == 0
+    previous.close()
+
+def test_run_gives_up_when_disk_stays_locked(tmp_path, job_config, sleeps, monkeypatch):
+    other = jr.try_lock(f"dev_{os.stat(tmp_path).st_dev}")
+    monkeypatch.setattr(jr, "DEFAULTS", dict(jr.DEFAULTS, max_wait_minutes=0))
+    assert jr.run(job_config) == 1
+    assert runs(tmp_path) == 0
+    other.close()
+    # El bloqueo del propio trabajo se ha soltado: la siguiente ejecución no se omite
+    assert jr.run(job_config) == 0
+    assert runs(tmp_path) == 1
@@ -0,0 +1,102 @@
+"""Pruebas de la rotación, la compresión y el presupuesto de logmanager."""
+
+import os
+import time
+import gzip
+from datetime import datetime, timedelta
+
+import logmanager as lm
+
+# Las edades se calculan con la hora real, porque los mtime de los archivos de prueba también lo son
+NOW = datetime.now().replace(microsecond=0)
+HOUR = 3600
+
+def write(path, data=b"linea\n", age=0):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_bytes(data)
+    mtime = time.time() - age
+    os.utime(path, (mtime, mtime))
+    return str(path)
+
+def rotated_name(path, when, suffix=""):
+    return f"{path}-{when.strftime(lm.ROTATED_DATE_FORMAT)}{suffix}"
+
+def write_copy(tmp_path, log, days_ago, suffix=""):
+    """Copia rotada de 'log' de hace 'days_ago' días."""
+    return write(tmp_path / os.path.basename(rotated_name(log, NOW - timedelta(days=days_ago), suffix)))
+
+def test_fixed_log_rotates_when_period_is_due(tmp_path):
+    log = write(tmp_path / "rotabackup.log")
+    old_copy = write_copy(tmp_path, log, 31)
+    job = {"name": "rotabackup", "path": log, "rotate": 4, "monthly": True, "compress": True}
+    to_compress, rotated = lm.process_job(job, NOW, HOUR)
+    assert rotated
+    assert not os.path.exists(log)
+    assert sorted(to_compress) == sorted([rotated_name(log, NOW), old_copy])
+
+def test_fixed_log_is_kept_until_period_or_size(tmp_path):
+    log = write(tmp_path / "rotabackup.log")
+    write_copy(tmp_path, log, 3, ".gz")
+    job = {"name": "rotabackup", "path": log, "monthly": True, "max_size": "1K"}
+    assert lm.process_job(job, NOW, HOUR) == ([], False)
+    write(tmp_path / "rotabackup.log", b"x" * 2048)
+    assert lm.process_job(job, NOW, HOUR)[1]
+
+def test_prune_keeps_newest_rotated_copies(tmp_path):
+    log = write(tmp_path / "job_runner.log", b"")
+    copies = [write_copy(tmp_path, log, days, ".gz") for days in (1, 8, 15, 22)]
+    job = {"name": "job_runner", "path": log, "rotate": 2, "weekly": True, "notifempty": True}
+    lm.process_job(job, NOW, HOUR)
+    assert [os.path.exists(c) for c in copies] == [True, True, False, False]
+
+def test_rotate_each_rotates_every_matching_log(tmp_path):
+    logs = [write(tmp_path / f"restore_apps_{app}.log") for app in ("radarr", "sonarr")]
+    other = write(tmp_path / "restore_apps.log")
+    job = {"name": "restore", "path": str(tmp_path / "restore_apps_*.log"), "rotate_each": True,
+           "monthly": True, "compress": True}
+    assert lm.fixed_logs(job) == logs
+    to_compress, rotated = lm.process_job(job, NOW, HOUR)
+    assert rotated
+    assert sorted(to_compress) == [rotated_name(log, NOW) for log in logs]
+    assert os.path.exists(other)
+
+def test_per_run_logs_are_compressed_in_place(tmp_path):
+    runs = [write(tmp_path / f"backup_rsync_{d}.log", age=d * 86400) for d in (1, 2, 3)]
+    running = write(tmp_path / "backup_rsync_0.log")
+    job = {"name": "backup_rsync", "path": str(tmp_path / "backup_rsync_*.log"), "rotate": 2, "compress": True}
+    to_compress, rotated = lm.process_job(job, NOW, HOUR)
+    assert not rotated
+    assert to_compress == runs[:2]
+    assert not os.path.exists(runs[2])
+    assert os.path.exists(running)
+
+def test_compress_all(tmp_path):
+    log = write(tmp_path / "a.log", b"a" * 1000)
+    assert lm.compress_all([log, str(tmp_path / "missing.log")], "gzip", 2) == 1
+    with gzip.open(log + ".gz") as f:
+        assert f.read() == b"a" * 1000
+    assert not os.path.exists(log)
+
+def test_compress_all_counts_unexpected_errors(tmp_path):
+    log = write(tmp_path / "a.log")
+    # Un método desconocido falla en el proceso del pool con KeyError, no con OSError
+    assert lm.compress_all([log], "bogus", 1) == 1
+    assert os.path.exists(log)
+
+def test_enforce_budget_removes_oldest_but_not_active_or_recent(tmp_path):
+    active = write(tmp_path / "downloadclean.log", b"x" * 400, age=10 * 86400)
+    oldest = write(tmp_path / "old.log.gz", b"x" * 300, age=5 * 86400)
+    older = write(tmp_path / "run" / "job.log", b"x" * 300, age=4 * 86400)
+    recent = write(tmp_path / "recent.log", b"x" * 300, age=60)
+    lm.enforce_budget(str(tmp_path), 1000, {active}, HOUR)
+    assert not os.path.exists(oldest)
+    assert os.path.exists(older)
+    assert os.path.exists(active)
+    assert os.path.exists(recent)
+
+def test_enforce_budget_reports_error_when_only_active_logs_remain(tmp_path, monkeypatch):
+    active = write(tmp_path / "downloadclean.log", b"x" * 2000, age=10 * 86400)
+    monkeypatch.setattr(lm.metrics, "status", "ok")
+    lm.enforce_budget(str(tmp_path), 1000, {active}, HOUR)
+    assert os.path.exists(active)
+    assert lm.metrics.status == "error"
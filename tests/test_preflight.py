@@ -0,0 +1,137 @@
+"""Pruebas de las comprobaciones de montaje y del ritmo de E/S adaptativo."""
+
+import os
+import json
+
+import pytest
+
+import preflight as pf
+
+# /dev/null es un dispositivo real con st_rdev conocido: sirve de disco en /dev/disk/by-*
+NULL_DEV = (os.major(os.stat("/dev/null").st_rdev), os.minor(os.stat("/dev/null").st_rdev))
+
+@pytest.fixture
+def disks(tmp_path, monkeypatch):
+    """'/dev/disk' falso con el disco 'Backup' (por etiqueta y por UUID) enlazado a /dev/null."""
+    for kind, value in (("label", "Backup"), ("uuid", "1234-ABCD")):
+        (tmp_path / f"by-{kind}").mkdir()
+        os.symlink("/dev/null", tmp_path / f"by-{kind}" / value)
+    monkeypatch.setattr(pf, "DISK_BY_DIR", str(tmp_path))
+
+def mount(mount_point, dev=NULL_DEV, source="/dev/null", fstype="ext4"):
+    return {"mount_point": mount_point, "dev": dev, "fstype": fstype, "source": source}
+
+def test_read_mountinfo_unescapes_paths(tmp_path):
+    mountinfo = tmp_path / "mountinfo"
+    mountinfo.write_text(
+        "22 1 179:2 / / rw,noatime shared:1 - ext4 /dev/root rw\n"
+        "40 22 0:45 / /media/WD\\040Elements rw,relatime shared:20 - fuseblk /dev/sda1 rw,user_id=0\n"
+    )
+    assert pf.read_mountinfo(str(mountinfo)) == [
+        mount("/", (179, 2), "/dev/root"),
+        mount("/media/WD Elements", (0, 45), "/dev/sda1", "fuseblk"),
+    ]
+
+def test_check_mount_reports_missing_mount(disks):
+    problem = pf.check_mount({"ruta": "/media/Backup", "label": "Backup"}, [mount("/")], {})
+    assert "no está montado" in problem
+
+def test_check_mount_accepts_expected_disk(disks):
+    assert pf.check_mount({"ruta": "/media/Backup/", "label": "Backup"}, [mount("/media/Backup")], {}) is None
+    # El UUID de fstab tiene prioridad sobre la etiqueta
+    uuids = {"/media/Backup": "1234-ABCD"}
+    assert pf.check_mount({"ruta": "/media/Backup", "label": "Otro"}, [mount("/media/Backup")], uuids) is None
+
+def test_check_mount_rejects_other_disk(disks):
+    mountinfo = [mount("/media/Backup", (8, 17), "/dev/sdb1")]
+    problem = pf.check_mount({"ruta": "/media/Backup", "label": "Backup"}, mountinfo, {})
+    assert "'/dev/sdb1'" in problem and "LABEL=Backup" in problem
+    # Disco desconectado: no aparece en /dev/disk
+    problem = pf.check_mount({"ruta": "/media/Backup", "uuid": "FFFF-0000"}, [mount("/media/Backup")], {})
+    assert "UUID=FFFF-0000" in problem
+
+def test_check_mount_uses_source_of_fuse_mounts(disks):
+    mountinfo = [mount("/media/Backup", (0, 45), "/dev/null", "fuseblk")]
+    assert pf.check_mount({"ruta": "/media/Backup", "label": "Backup"}, mountinfo, {}) is None
+    mountinfo = [mount("/media/Backup", (0, 45), "/dev/sdb1", "fuseblk")]
+    assert pf.check_mount({"ruta": "/media/Backup", "label": "Backup"}, mountinfo, {}) is not None
+
+def test_check_mount_uses_last_stacked_mount(disks):
+    mountinfo = [mount("/media/Backup"), mount("/media/Backup", (8, 17), "/dev/sdb1")]
+    assert pf.check_mount({"ruta": "/media/Backup", "label": "Backup"}, mountinfo, {}) is not None
+
+def test_check_paths_only_checks_configured_mounts(tmp_path, disks, monkeypatch):
+    config_file = tmp_path / "puntos_de_montaje.json"
+    config_file.write_text(json.dumps({"puntos_de_montaje": [
+        {"label": "Backup", "ruta": "/media/Backup"},
+        {"label": "WDElements", "ruta": "/media/WDElements"},
+    ]}))
+    monkeypatch.setattr(pf, "read_mountinfo", lambda: [mount("/media/Backup")])
+    monkeypatch.setattr(pf, "fstab_uuids", lambda: {})
+    assert pf.check_paths(["/var/lib/sonarr", "/media/Backup/radarr"], str(config_file)) == []
+    [problem] = pf.check_paths(["/media/WDElements/Fotos", "/media/Backupfoo"], str(config_file))
+    assert "/media/WDElements" in problem
+
+# --- IOPacer --------------------------------------------------------------------------------------
+
+class FakeDisk:
+    """Reloj y contador de /proc/diskstats simulados: 'sleep' avanza el reloj."""
+
+    def __init__(self, monkeypatch):
+        self.now = 1000.0
+        self.bytes = 0
+        self.sleeps = []
+        monkeypatch.setattr(pf.time, "monotonic", lambda: self.now)
+        monkeypatch.setattr(pf.time, "sleep", self.sleep)
+        monkeypatch.setattr(pf, "read_diskstats", lambda: {(8, 0): self.bytes})
+        monkeypatch.setattr(pf, "diskstats_key", lambda dev: (8, 0))
+
+    def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+    def read(self, pacer, nbytes, foreign=0, elapsed=0.0):
+        """Lectura propia de 'nbytes' tras 'elapsed' segundos con 'foreign' bytes ajenos en el disco."""
+        self.now += elapsed
+        self.bytes += nbytes + foreign
+        self.sleeps.clear()
+        pacer.consume(1, nbytes)
+        return sum(self.sleeps)
+
+@pytest.fixture
+def disk(monkeypatch):
+    return FakeDisk(monkeypatch)
+
+MiB = 1024**2
+
+def pacer(**settings):
+    return pf.IOPacer(dict({"min_rate": 16 * MiB, "max_rate": None, "foreign_threshold": 256 * 1024,
+                            "sample_seconds": 1}, **settings))
+
+def test_pacer_unthrottled_while_disk_is_quiet(disk):
+    p = pacer()
+    for _ in range(5):
+        assert disk.read(p, 8 * MiB, elapsed=1) == 0
+    assert p.rate(1) is None
+
+def test_pacer_slows_down_on_foreign_io_and_recovers(disk):
+    p = pacer()
+    disk.read(p, MiB)
+    assert disk.read(p, 8 * MiB, foreign=4 * MiB, elapsed=1) == pytest.approx(0.5)
+    assert p.rate(1) == 16 * MiB
+    # Con el disco tranquilo el límite se duplica en cada muestra hasta desaparecer
+    disk.read(p, MiB, elapsed=1)
+    assert p.rate(1) == 32 * MiB
+    disk.read(p, MiB, elapsed=1)
+    assert p.rate(1) is None
+
+def test_pacer_respects_max_rate(disk):
+    p = pacer(min_rate=MiB, max_rate=4 * MiB)
+    assert disk.read(p, 2 * MiB) == pytest.approx(0.5)
+    for _ in range(4):
+        disk.read(p, MiB, elapsed=1)
+    assert p.rate(1) == 4 * MiB
+
+def test_pacer_does_nothing_when_disabled(disk):
+    p = pacer(enabled=False, max_rate=MiB)
+    assert disk.read(p, 100 * MiB) == 0
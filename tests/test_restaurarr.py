@@ -0,0 +1,169 @@
+"""Pruebas de la extracción verificada y el intercambio de archivos de restaurarr."""
+
+import io
+import os
+import sqlite3
+import zipfile
+
+import pytest
+
+import restaurarr as ra
+
+def make_db(path):
+    conn = sqlite3.connect(path)
+    conn.execute("CREATE TABLE movies (id INTEGER PRIMARY KEY, title TEXT)")
+    conn.executemany("INSERT INTO movies (title) VALUES (?)", [(f"Movie {i}",) for i in range(200)])
+    conn.commit()
+    conn.close()
+    with open(path, "rb") as f:
+        return f.read()
+
+@pytest.fixture
+def backup(tmp_path):
+    """Backup ZIP de radarr con su base de datos y su configuración."""
+    db = make_db(str(tmp_path / "source.db"))
+    path = str(tmp_path / "radarr_backup_v5_2024.05.26_03.15.22.zip")
+    with zipfile.ZipFile(path, "w") as zf:
+        zf.writestr("radarr.db", db)
+        zf.writestr("config.xml", b"<Config/>")
+    return path
+
+def extract(backup, restore_dir, files=("radarr.db", "config.xml")):
+    return ra.extract_backup(backup, ".zip", list(files), str(restore_dir), str(restore_dir / ra.STAGING_DIR_NAME))
+
+# --- Verificación en el flujo --------------------------------------------------------------------
+
+def test_stream_to_file_verifies_size_and_crc(tmp_path):
+    data = b"x" * 1000
+    result = ra.stream_to_file(io.BytesIO(data), str(tmp_path / "out"), len(data), ra.zlib.crc32(data))
+    assert (tmp_path / "out").read_bytes() == data
+    assert result["size"] == len(data)
+    assert result["sqlite_check"] is None
+
+@pytest.mark.parametrize("size_delta, crc_delta", [(1, 0), (0, 1)])
+def test_stream_to_file_keeps_destination_on_mismatch(tmp_path, size_delta, crc_delta):
+    dst = tmp_path / "out"
+    dst.write_bytes(b"en uso")
+    data = b"x" * 1000
+    with pytest.raises(ra.VerificationError):
+        ra.stream_to_file(io.BytesIO(data), str(dst), len(data) + size_delta, ra.zlib.crc32(data) + crc_delta)
+    assert dst.read_bytes() == b"en uso"
+    assert not (tmp_path / "out.restoring").exists()
+
+def test_stream_to_file_checks_sqlite_databases(tmp_path):
+    db = make_db(str(tmp_path / "source.db"))
+    assert ra.stream_to_file(io.BytesIO(db), str(tmp_path / "ok.db"))["sqlite_check"] == "ok"
+    # Cabecera de SQLite con páginas dañadas
+    damaged = db[:4096] + b"\xff" * (len(db) - 4096)
+    with pytest.raises((ra.VerificationError, sqlite3.DatabaseError)):
+        ra.stream_to_file(io.BytesIO(damaged), str(tmp_path / "bad.db"))
+    assert not (tmp_path / "bad.db").exists()
+
+def test_extract_zip_stages_verified_files(backup, tmp_path):
+    restore_dir = tmp_path / "radarr"
+    manifest, staged, unchanged = extract(backup, restore_dir)
+    assert sorted(staged) == ["config.xml", "radarr.db"]
+    assert unchanged == []
+    assert (restore_dir / ra.STAGING_DIR_NAME / "config.xml").read_bytes() == b"<Config/>"
+    assert manifest["files"]["radarr.db"]["sqlite_check"] == "ok"
+
+def test_extract_skips_files_identical_to_manifest(backup, tmp_path):
+    restore_dir = tmp_path / "radarr"
+    staging_dir = restore_dir / ra.STAGING_DIR_NAME
+    manifest, staged, _ = extract(backup, restore_dir)
+    ra.swap_into_place(staged, str(restore_dir), str(staging_dir), str(restore_dir / ra.BACKUP_ORIG_DIR_NAME))
+    ra.save_manifest(str(restore_dir), manifest)
+    _, staged, unchanged = extract(backup, restore_dir)
+    assert staged == []
+    assert sorted(unchanged) == ["config.xml", "radarr.db"]
+    # Un archivo modificado después de la restauración se vuelve a extraer
+    (restore_dir / "config.xml").write_bytes(b"<Config>cambiada</Config>")
+    _, staged, unchanged = extract(backup, restore_dir)
+    assert staged == ["config.xml"]
+
+def test_extract_returns_none_on_corrupt_member(backup, tmp_path):
+    restore_dir = tmp_path / "radarr"
+    # Los miembros se guardan sin comprimir: se cambian los datos de 'config.xml' sin tocar su CRC
+    with open(backup, "r+b") as f:
+        f.seek(f.read().index(b"<Config/>"))
+        f.write(b"<CONFIG/>")
+    assert extract(backup, restore_dir, ["config.xml"]) is None
+    assert not (restore_dir / "config.xml").exists()
+
+# --- Intercambio preparado ------------------------------------------------------------------------
+
+@pytest.fixture
+def services(monkeypatch):
+    """Anota las paradas y arranques de servicios en lugar de llamar a systemctl."""
+    calls = []
+    monkeypatch.setattr(ra, "stop_app", lambda app: calls.append(("stop", app)))
+    monkeypatch.setattr(ra, "start_app", lambda app: calls.append(("start", app)))
+    return calls
+
+def app_config(backup, restore_dir):
+    return {"backup_dir": os.path.dirname(backup), "backup_ext": "zip", "restore_dir": str(restore_dir),
+            "files_to_restore": ["radarr.db", "config.xml"]}
+
+def test_swap_keeps_previous_files_in_backup_orig(tmp_path):
+    restore_dir, staging_dir, orig_dir = tmp_path / "app", tmp_path / "app" / "stage", tmp_path / "app" / "orig"
+    staging_dir.mkdir(parents=True)
+    (restore_dir / "a").write_bytes(b"viejo")
+    (staging_dir / "a").write_bytes(b"nuevo")
+    (staging_dir / "b").write_bytes(b"nuevo b")
+    ra.swap_into_place(["a", "b"], str(restore_dir), str(staging_dir), str(orig_dir))
+    assert (restore_dir / "a").read_bytes() == b"nuevo"
+    assert (restore_dir / "b").read_bytes() == b"nuevo b"
+    assert (orig_dir / "a").read_bytes() == b"viejo"
+
+def test_swap_rolls_back_on_failure(tmp_path):
+    restore_dir, staging_dir, orig_dir = tmp_path / "app", tmp_path / "app" / "stage", tmp_path / "app" / "orig"
+    staging_dir.mkdir(parents=True)
+    for name in ("a", "b"):
+        (restore_dir / name).write_bytes(b"viejo " + name.encode())
+    (staging_dir / "a").write_bytes(b"nuevo a")
+    # 'b' no está preparado: su renombrado falla después de haber sustituido 'a'
+    with pytest.raises(OSError):
+        ra.swap_into_place(["a", "b"], str(restore_dir), str(staging_dir), str(orig_dir))
+    assert (restore_dir / "a").read_bytes() == b"viejo a"
+    assert (restore_dir / "b").read_bytes() == b"viejo b"
+    assert (staging_dir / "a").read_bytes() == b"nuevo a"
+
+def test_restore_app_stops_service_only_for_the_swap(backup, tmp_path, services):
+    restore_dir = tmp_path / "radarr"
+    restore_dir.mkdir()
+    (restore_dir / "config.xml").write_bytes(b"<Config>vieja</Config>")
+    catalog = ra.BackupCatalog(str(tmp_path / "catalog.db"))
+    try:
+        result = ra.restore_app("radarr", app_config(backup, restore_dir), catalog)
+        assert result["status"] == "ok"
+        assert services == [("stop", "radarr"), ("start", "radarr")]
+        assert (restore_dir / "config.xml").read_bytes() == b"<Config/>"
+        assert (restore_dir / ra.BACKUP_ORIG_DIR_NAME / "config.xml").read_bytes() == b"<Config>vieja</Config>"
+        assert not (restore_dir / ra.STAGING_DIR_NAME).exists()
+
+        # Segunda restauración del mismo backup: nada cambia y el servicio no se detiene
+        services.clear()
+        result = ra.restore_app("radarr", app_config(backup, restore_dir), catalog)
+        assert result["status"] == "ok"
+        assert services == []
+    finally:
+        catalog.close()
+
+def test_restore_app_restarts_service_after_failed_swap(backup, tmp_path, services, monkeypatch):
+    restore_dir = tmp_path / "radarr"
+    restore_dir.mkdir()
+    (restore_dir / "config.xml").write_bytes(b"<Config>vieja</Config>")
+
+    def failing_swap(names, restore_dir, staging_dir, backup_orig_dir):
+        raise OSError("disco lleno")
+
+    monkeypatch.setattr(ra, "swap_into_place", failing_swap)
+    catalog = ra.BackupCatalog(str(tmp_path / "catalog.db"))
+    try:
+        result = ra.restore_app("radarr", app_config(backup, restore_dir), catalog)
+    finally:
+        catalog.close()
+    assert result["status"] == "error"
+    assert services == [("stop", "radarr"), ("start", "radarr")]
+    assert (restore_dir / "config.xml").read_bytes() == b"<Config>vieja</Config>"
+    assert not os.path.exists(os.path.join(restore_dir, ra.MANIFEST_FILE_NAME))
@@ -0,0 +1,66 @@
+"""Pruebas de la política de retención abuelo-padre-hijo de rotabackup."""
+
+from datetime import datetime, timedelta
+
+from backup_catalog import BackupEntry
+import rotabackup
+
+NEWEST = datetime(2024, 12, 31, 3, 0)
+
+def daily_entries(days, size=100):
+    """Un backup diario a las 3:00 durante 'days' días, del más nuevo al más antiguo."""
+    entries = []
+    for age in range(days):
+        ts = NEWEST - timedelta(days=age)
+        entries.append(BackupEntry("/backups", f"radarr_{ts:%Y.%m.%d}.zip", False, size,
+                                   int(ts.timestamp() * 1e9), ts.timestamp(), None))
+    return entries
+
+def policy(**rules):
+    return dict({"keep_last": 0, "keep_daily": 0, "keep_weekly": 0, "keep_monthly": 0,
+                 "keep_yearly": 0, "max_total_bytes": None}, **rules)
+
+def kept_dates(keep):
+    return sorted(path.split("_")[1][:10] for path in keep)
+
+def test_keep_last():
+    entries = daily_entries(10)
+    keep = rotabackup.select_backups_to_keep(entries, policy(keep_last=3))
+    assert list(keep) == [e.path for e in entries[:3]]
+    assert all(reasons == ["últimas"] for reasons in keep.values())
+
+def test_weekly_keeps_newest_of_each_iso_week():
+    keep = rotabackup.select_backups_to_keep(daily_entries(30), policy(keep_weekly=3))
+    # 31/12/2024 es martes: su semana ISO (2025-W01) solo tiene ese lunes y martes
+    assert kept_dates(keep) == ["2024.12.22", "2024.12.29", "2024.12.31"]
+
+def test_monthly_and_yearly():
+    keep = rotabackup.select_backups_to_keep(daily_entries(400), policy(keep_monthly=3, keep_yearly=2))
+    assert kept_dates(keep) == ["2023.12.31", "2024.10.31", "2024.11.30", "2024.12.31"]
+    assert sorted(keep[daily_entries(1)[0].path]) == ["monthly 2024-12", "yearly 2024"]
+
+def test_rules_are_combined():
+    entries = daily_entries(60)
+    keep = rotabackup.select_backups_to_keep(entries, policy(keep_last=2, keep_daily=7, keep_weekly=4,
+                                                             keep_monthly=2))
+    # 7 diarios (incluyen los 2 últimos y el domingo 29) + 2 domingos anteriores + el fin de noviembre
+    assert kept_dates(keep) == ["2024.11.30", "2024.12.15", "2024.12.22", "2024.12.25", "2024.12.26",
+                                "2024.12.27", "2024.12.28", "2024.12.29", "2024.12.30", "2024.12.31"]
+    assert keep[entries[0].path] == ["últimas", "daily 2024-12-31", "weekly 2025-W01", "monthly 2024-12"]
+
+def test_fewer_backups_than_rules():
+    entries = daily_entries(2)
+    keep = rotabackup.select_backups_to_keep(entries, policy(keep_last=5, keep_daily=7, keep_yearly=3))
+    assert set(keep) == {e.path for e in entries}
+
+def test_max_total_bytes_drops_oldest_but_never_newest():
+    entries = daily_entries(10, size=100)
+    keep = rotabackup.select_backups_to_keep(entries, policy(keep_last=5, max_total_bytes=250))
+    assert list(keep) == [entries[0].path, entries[1].path]
+    keep = rotabackup.select_backups_to_keep(entries, policy(keep_last=5, max_total_bytes=10))
+    assert list(keep) == [entries[0].path]
+
+def test_policy_from_config_parses_sizes():
+    config = {"num_copies_to_keep": 4, "keep_daily": 7, "max_total_bytes": "20G"}
+    assert rotabackup.policy_from_config(config) == policy(keep_last=4, keep_daily=7,
+                                                           max_total_bytes=20 * 1024 ** 3)
@@ -0,0 +1,99 @@
+"""Pruebas del almacén de instantáneas y de 'arr_snapshot.py'."""
+
+import os
+import zipfile
+import argparse
+
+import pytest
+
+from snapshot_store import SnapshotStore
+import arr_snapshot
+
+CHUNK_SIZE = 4096
+
+def make_zip(path, files):
+    with zipfile.ZipFile(path, "w") as zf:
+        for name, data in files.items():
+            zf.writestr(name, data)
+    return str(path)
+
+def chunk_files(store):
+    return sorted(name for _, _, names in os.walk(store.chunks_dir) for name in names)
+
+@pytest.fixture
+def store(tmp_path):
+    return SnapshotStore(str(tmp_path / "store"), CHUNK_SIZE)
+
+@pytest.fixture
+def backups(tmp_path):
+    """Dos backups de radarr que solo se diferencian en el último bloque de la base de datos."""
+    directory = tmp_path / "scheduled"
+    directory.mkdir()
+    db = os.urandom(4 * CHUNK_SIZE)
+    changed = db[:-CHUNK_SIZE] + os.urandom(CHUNK_SIZE)
+    return [
+        make_zip(directory / "radarr_backup_v5_2024.05.19_03.15.22.zip", {"radarr.db": db, "config.xml": b"<a/>"}),
+        make_zip(directory / "radarr_backup_v5_2024.05.26_03.15.22.zip", {"radarr.db": changed, "config.xml": b"<a/>"}),
+    ]
+
+def test_add_zip_stores_shared_chunks_once(store, backups):
+    first = store.add_zip("radarr", backups[0])
+    second = store.add_zip("radarr", backups[1])
+    assert first["id"] == "radarr_2024-05-19_03-15-22"
+    assert first["new_bytes"] == first["size"]
+    # Solo el bloque cambiado de la base de datos es nuevo
+    assert second["new_bytes"] == CHUNK_SIZE
+    assert [s["id"] for s in store.snapshots("radarr")] == [second["id"], first["id"]]
+
+@pytest.mark.parametrize("verify", [False, True])
+def test_restore_file_rebuilds_original(store, backups, tmp_path, verify):
+    snapshot = store.add_zip("radarr", backups[1])
+    dst = tmp_path / "radarr.db"
+    digest = store.restore_file(snapshot["files"]["radarr.db"], str(dst), verify=verify)
+    with zipfile.ZipFile(backups[1]) as zf:
+        assert dst.read_bytes() == zf.read("radarr.db")
+    assert digest == (snapshot["files"]["radarr.db"]["sha256"] if verify else None)
+
+def test_verify_reports_damaged_chunks(store, backups, tmp_path):
+    snapshot = store.add_zip("radarr", backups[0])
+    assert store.verify(snapshot) == []
+    digest = snapshot["files"]["radarr.db"]["chunks"][0]
+    with open(store.chunk_path(digest), "r+b") as f:
+        f.write(b"X")
+    assert store.verify(snapshot) == [digest]
+    with pytest.raises(OSError):
+        store.restore_file(snapshot["files"]["radarr.db"], str(tmp_path / "radarr.db"), verify=True)
+
+def test_gc_frees_only_unreferenced_chunks(store, backups):
+    first = store.add_zip("radarr", backups[0])
+    second = store.add_zip("radarr", backups[1])
+    before = chunk_files(store)
+    assert store.gc() == (0, 0)
+    store.delete(first["id"])
+    assert store.gc(dry_run=True) == (1, CHUNK_SIZE)
+    assert chunk_files(store) == before
+    assert store.gc() == (1, CHUNK_SIZE)
+    assert store.verify(second) == []
+
+# --- arr_snapshot --dry-run ----------------------------------------------------------------------
+
+def maintain(store, config, command, dry_run):
+    arr_snapshot.maintain(store, config, argparse.Namespace(command=command, dry_run=dry_run))
+
+def test_dry_run_does_not_touch_the_store(store, backups, tmp_path):
+    store.add_zip("radarr", backups[0])
+    config = {"apps": [{"app": "radarr", "source_dir": str(tmp_path / "scheduled"), "keep_snapshots": 0}]}
+    before = chunk_files(store)
+    maintain(store, config, "run", dry_run=True)
+    # Ni se ingiere el ZIP nuevo ni se podan instantáneas ni se borran bloques
+    assert [s["source"] for s in store.snapshots()] == [os.path.basename(backups[0])]
+    assert chunk_files(store) == before
+
+def test_dry_run_gc_counts_chunks_of_pruned_snapshots(store, backups, tmp_path):
+    store.add_zip("radarr", backups[0])
+    store.add_zip("radarr", backups[1])
+    config = {"apps": [{"app": "radarr", "source_dir": str(tmp_path / "scheduled"), "keep_snapshots": 1}]}
+    pruned = arr_snapshot.prune(store, config, dry_run=True)
+    assert pruned == ["radarr_2024-05-19_03-15-22"]
+    assert store.gc(dry_run=True, ignore=set(pruned)) == (1, CHUNK_SIZE)
+    assert len(store.snapshots()) == 2